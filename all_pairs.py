@@ -0,0 +1,152 @@
+import hashlib
+import os
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+import graph_cache
+from compact_graph import CompactGraph, to_compact
+from instrumentation import count, stage
+from scenarios import run_scenarios
+
+BLOCK_SIZE = 64  # Source rows computed by a worker task
+
+
+class TravelTimeMatrix:
+    """ The shortest travel time between every pair of stations, as a float32 matrix memory-mapped from a file.
+
+    Row i holds the travel times in minutes from the station nodes[i], inf when unreachable. Opening the file does
+    not read it: rows and columns are sliced on demand, and processes opening the same file share its pages.
+    """
+
+    def __init__(self, nodes, matrix):
+        self.nodes = np.asarray(nodes, dtype=str)
+        self.index = {node: i for i, node in enumerate(self.nodes.tolist())}
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def row(self, station):
+        """ This function gives the travel times from a station to every station.
+
+        :param station: The UIC code of the station
+        :return: The travel times, in the order of nodes
+        """
+        return self.matrix[self.index[station]]
+
+    def column(self, station):
+        """ This function gives the travel times from every station to a station.
+
+        :param station: The UIC code of the station
+        :return: The travel times, in the order of nodes
+        """
+        return self.matrix[:, self.index[station]]
+
+    def rows(self, stations):
+        """ This function gives the travel times from some stations to every station.
+
+        :param stations: The UIC codes of the stations
+        :return: The (stations, nodes) travel times
+        """
+        return self.matrix[[self.index[station] for station in stations]]
+
+    def between(self, station_a, station_b):
+        """ This function gives the shortest travel time between two stations.
+
+        :param station_a: The UIC code of the source station
+        :param station_b: The UIC code of the destination station
+        :return: The travel time in minutes, inf when unreachable
+        """
+        return float(self.matrix[self.index[station_a], self.index[station_b]])
+
+
+def graph_fingerprint(C: CompactGraph):
+    """ This function summarizes the connections of a graph, so that a modified copy of a parsed graph does not reuse
+    the matrix of the original.
+
+    :param C: The compact graph
+    :return: A hexadecimal fingerprint
+    """
+    digest = hashlib.sha1()
+    for array in (C.nodes.astype(str), C.indptr, C.indices, C.travel_time):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def fill_rows(context, block):
+    """ This function computes the travel times from a block of sources and writes them to the matrix file (run in
+    a scenario worker).
+
+    :param context: The compact graph and the matrix file path
+    :param block: The (first, last) source ids, last excluded
+    :return: The number of rows written
+    """
+    C, path = context
+    first, last = block
+    matrix = np.memmap(path, dtype=np.float32, mode='r+', shape=(len(C), len(C)))
+    count('dijkstra_calls', last - first)
+    matrix[first:last] = dijkstra(C.matrix(), directed=True, indices=np.arange(first, last))
+    matrix.flush()
+    del matrix
+    return last - first
+
+
+@stage('compute_travel_time_matrix')
+def compute_travel_time_matrix(railways, path, workers=None, block_size=BLOCK_SIZE):
+    """ This function computes the all pairs travel time matrix, by blocks of source rows over a process pool, and
+    writes it to a file.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param path: The matrix file path, the station UIC codes are written next to it
+    :param workers: The number of processes, all the cores by default
+    :param block_size: The number of sources of a task
+    :return: The travel time matrix
+    """
+    C = railways if isinstance(railways, CompactGraph) else to_compact(railways)
+    n = len(C)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    np.memmap(temp_path, dtype=np.float32, mode='w+', shape=(n, n)).flush()
+    blocks = [(first, min(first + block_size, n)) for first in range(0, n, block_size)]
+    for _ in run_scenarios(fill_rows, (C, temp_path), blocks, workers, label='travel times'):
+        pass
+
+    np.save(path + ".nodes.npy", C.nodes)
+    os.replace(temp_path, path)  # Never leave a half written matrix behind
+    return open_travel_time_matrix(path)
+
+
+def open_travel_time_matrix(path):
+    """ This function opens a matrix written by compute_travel_time_matrix, without reading it.
+
+    :param path: The matrix file path
+    :return: The travel time matrix
+    """
+    nodes = np.load(path + ".nodes.npy")
+    return TravelTimeMatrix(nodes, np.memmap(path, dtype=np.float32, mode='r', shape=(len(nodes), len(nodes))))
+
+
+def travel_time_matrix(railways, key=None, workers=None):
+    """ This function gives the all pairs travel time matrix of the railways, from the on-disk cache when it is up
+    to date.
+
+    The file is tied to the cache key of the feeds the railways were parsed from, and to the connections of the
+    graph itself.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param key: The cache key of the railways, the one set by parse_railways by default
+    :param workers: The number of processes, all the cores by default
+    :return: The travel time matrix
+    """
+    if key is None and not isinstance(railways, CompactGraph):
+        key = railways.graph.get('cache_key')
+    C = railways if isinstance(railways, CompactGraph) else to_compact(railways)
+
+    path = os.path.join(graph_cache.CACHE_DIR, f"travel_times-{key or 'graph'}-{graph_fingerprint(C)}.f32")
+    if os.path.exists(path) and os.path.exists(path + ".nodes.npy"):
+        count('travel_time_matrix_cache_hits')
+        return open_travel_time_matrix(path)
+    count('travel_time_matrix_cache_misses')
+    return compute_travel_time_matrix(C, path, workers)
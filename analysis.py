@@ -1,78 +1,156 @@
+import argparse
 import random
-from collections import deque
+import weakref
 
 import networkx as nx
 import numpy as np
 import seaborn as sns
 from matplotlib import pyplot as plt
-from parser_GTFS import parse_railways
-from geopy.distance import distance
+from scipy.stats import norm
+from compact_graph import CompactGraph, to_compact, travel_times_from
+from geo import distance_between
+from instrumentation import DEFAULT_TRACE, TRACE_VARIABLE, enable, stage
+from parser_GTFS import parse_railways, HIGH_SPEED
+from robustness import RobustnessEngine, attack_order, percolation_curve
+from scenarios import run_scenarios
+from stations import station_travelers
+from travel_matrix import city_travel_time_matrix
+from what_if import LINE_DISTANCE_BAND, WhatIfEngine, new_line_parameters
+
+# The 25 largest cities and their main stations, the first ten are those of the top 10 experiences
+CITIES = ["Paris", "Marseille", "Lyon", "Toulouse", "Nice", "Nantes", "Strasbourg", "Montpellier", "Bordeaux",
+          "Lille", "Rennes", "Reims", "Toulon", "Saint-Étienne", "Le Havre", "Dijon", "Grenoble", "Angers",
+          "Nîmes", "Clermont-Ferrand", "Aix-en-Provence", "Le Mans", "Brest", "Tours", "Amiens"]
+
+STATIONS_BY_CITY = [(['87271007', '87113001', '87391003', '87547000', '87686006'], 'Paris'),
+                    (['87751008'], 'Marseille'), (['87722025', '87723197'], 'Lyon'), (['87611004'], 'Toulouse'),
+                    (['87756056'], 'Nice'), (['87481002'], 'Nantes'), (['87212027'], 'Strasbourg'),
+                    (['87773002'], 'Montpellier'), (['87581009'], 'Bordeaux'), (['87223263', '87286005'], 'Lille'),
+                    (['87471003'], 'Rennes'), (['87171009'], 'Reims'), (['87755009'], 'Toulon'),
+                    (['87726000'], 'Saint-Étienne'), (['87413013'], 'Le Havre'), (['87713040'], 'Dijon'),
+                    (['87747006'], 'Grenoble'), (['87484006'], 'Angers'),
+                    (['87703975'], 'Nîmes'), (['87734004'], 'Clermont-Ferrand'), (['87319012'], 'Aix-en-Provence'),
+                    (['87396002'], 'Le Mans'), (['87474007'], 'Brest'), (['87571000'], 'Tours'),
+                    (['87313874'], 'Amiens')]
+
+# The cities new lines start from in new_line_experience
+NEW_LINE_CITIES = ["Toulouse", "Nice", "Toulon", "Montpellier", "Clermont-Ferrand", "Caen"]
+
+# Compact graph of each NetworkX graph given to travel_time, dropped with the graph
+_compact_graphs = weakref.WeakKeyDictionary()
 
 
 def travel_time(G, i):
-    D = {}
-    Q = deque()
-    D[i] = 0
-    Q.append(i)
-    while Q:
-        i = Q.popleft()
-        for j in G[i]:
-            if j not in D:
-                D[j] = D[i] + G.get_edge_data(i, j)['travel_time']
-                Q.append(j)
-    return [d for d in list(D.values()) if d > 0]
-
-
-def average_travel_time(G, n=1000):
-    D = {}
-    for i in G.nodes() if len(G) <= n else random.sample(G.nodes(), n):
-        D[i] = travel_time(G, i)
-    average = float(np.mean([i for d in list(D.values()) for i in d]))
-    return round(average, 2)
+    """ This function computes the shortest travel times from a station to the other stations it reaches.
 
+    :param G: A network, as a NetworkX or compact graph
+    :param i: The UIC code of the station
+    :return: The list of travel times, in minutes
+    """
+    if isinstance(G, CompactGraph):
+        C = G
+    else:
+        # Converted once per graph, its connections are assumed not to change after its first use (as in geo)
+        if G not in _compact_graphs:
+            _compact_graphs[G] = to_compact(G)
+        C = _compact_graphs[G]
+    D = travel_times_from(C, C.index[i])
+    D[C.index[i]] = np.inf
+    return D[np.isfinite(D)].tolist()
+
+
+@stage('average_travel_time')
+def average_travel_time(G, tolerance=1.0, confidence=0.95, batch_size=32, seed=None, all_pairs=None):
+    """ This function estimates the average shortest travel time between two stations, over the reachable pairs.
+
+    Sources are sampled without replacement by batches, each batch running one multi-source Dijkstra (or reading the
+    all pairs matrix). Sampling stops once the confidence interval of the mean is narrower than the tolerance on each
+    side. The mean is a ratio (sum of the travel times over number of reached pairs) whose interval is given by the
+    delta method, with the finite population correction: when every station is a source, it is exact.
+
+    :param G: A network, as a NetworkX or compact graph
+    :param tolerance: The half width of the confidence interval to reach, in minutes
+    :param confidence: The confidence level of the interval
+    :param batch_size: The number of sources per Dijkstra run
+    :param seed: The seed of the sources sampling, for reproducible reports
+    :param all_pairs: The all pairs travel time matrix of the network (see all_pairs)
+    :return: The average travel time in minutes, its (low, high) confidence interval and the number of sources
+    """
+    C = G if isinstance(G, CompactGraph) else to_compact(G)
+    n = len(C)
+    order = np.random.default_rng(seed).permutation(n)
+    z = norm.ppf(0.5 + confidence / 2)
+
+    totals = np.zeros(0)
+    counts = np.zeros(0)
+    average, half_width = np.nan, np.inf
+    for start in range(0, n, batch_size):
+        batch = order[start:start + batch_size]
+        if all_pairs is None:
+            D = np.atleast_2d(travel_times_from(C, batch))
+            columns = batch
+        else:
+            D = np.asarray(all_pairs.rows(C.nodes[batch].tolist()), dtype=np.float64)
+            columns = [all_pairs.index[node] for node in C.nodes[batch].tolist()]
+        D[np.arange(len(batch)), columns] = np.inf  # A station does not travel to itself
+        reached = np.isfinite(D)
+        totals = np.append(totals, np.where(reached, D, 0).sum(axis=1))
+        counts = np.append(counts, reached.sum(axis=1))
+
+        k = len(totals)
+        if counts.sum() == 0:
+            continue
+        average = totals.sum() / counts.sum()
+        if k == n:
+            half_width = 0.0
+            break
+        if k > 1:
+            residuals = totals - average * counts
+            variance = residuals.var(ddof=1) / k * (1 - k / n)
+            half_width = z * np.sqrt(variance) / counts.mean()
+            if half_width <= tolerance:
+                break
 
-def distance_between_stations(railways: nx.Graph, station_a, station_b):
-    """ This function compute the distance between two stations.
+    return float(average), (float(average - half_width), float(average + half_width)), len(totals)
 
-    :param railways:
-    :param station_a:
-    :param station_b:
-    :return:
-    """
-    pos_a = (railways.nodes[station_a].get('lat'), railways.nodes[station_a].get('long'))
-    pos_b = (railways.nodes[station_b].get('lat'), railways.nodes[station_b].get('long'))
-    return distance(pos_a, pos_b).km
 
+def distance_between_stations(railways: nx.Graph, station_a, station_b):
+    """ This function compute the geodesic distance between two stations (see geo).
 
-def shortest_travel_time_between_major_stations(railways: nx.Graph, stations_by_city):
-    def min_travel_time(station_a, station_b):
-        return nx.shortest_path_length(railways, station_a, station_b, weight='travel_time')
+    :param railways: A network, as a NetworkX or compact graph
+    :param station_a: The UIC code of the first station
+    :param station_b: The UIC code of the second station
+    :return: The distance in km
+    """
+    return distance_between(railways, station_a, station_b)
 
-    travel_times = []
-    distances = []
-    for data_source in stations_by_city:
-        travel_times_from_city = []
-        distances_from_city = []
 
-        for data_destination in stations_by_city:
-            best_travel_time = None
-            selected_stations_distance = None
+def stations_in_railways(*networks, stations_by_city):
+    """ This function keeps the stations of each city found in every given network, and leaves out the cities
+    without any, so that the travel times of the cities can be computed and compared on these networks.
 
-            for station_source in data_source[0]:
-                for station_destination in data_destination[0]:
-                    travel_time = min_travel_time(station_source, station_destination)
-                    stations_distance = distance_between_stations(railways, station_source, station_destination)
-                    if best_travel_time is None or travel_time < best_travel_time:
-                        best_travel_time = travel_time
-                        selected_stations_distance = stations_distance
+    :param networks: The networks
+    :param stations_by_city: A list of (stations, city name) tuples
+    :return: The list of (stations, city name) tuples of the cities left, in the same order
+    """
+    kept = []
+    for stations, city in stations_by_city:
+        stations = [station for station in stations if all(station in network for network in networks)]
+        if stations:
+            kept.append((stations, city))
+    return kept
 
-            travel_times_from_city.append(best_travel_time)
-            distances_from_city.append(selected_stations_distance)
 
-        travel_times.append(travel_times_from_city)
-        distances.append(distances_from_city)
+def shortest_travel_time_between_major_stations(railways, stations_by_city, timetable=None, all_pairs=None):
+    """ This function computes the shortest travel time matrix between cities (see travel_matrix).
 
-    return travel_times, distances
+    :param railways: A network, as a NetworkX or compact graph
+    :param stations_by_city: A list of stations for each city
+    :param timetable: The timetable (see timetable.build_timetable), to use the real journeys instead of the graph
+    :param all_pairs: The all pairs travel time matrix (see all_pairs), to read the graph travel times
+    :return: The travel times and the distances between the stations of the fastest connections
+    """
+    return city_travel_time_matrix(railways, stations_by_city, timetable, all_pairs)
 
 
 def travellers_by_city(railways: nx.Graph, stations_by_city):
@@ -86,7 +164,7 @@ def travellers_by_city(railways: nx.Graph, stations_by_city):
     for data in stations_by_city:
         temp = 0
         for station in data[0]:
-            temp += int(railways.nodes[station].get('travelers_2021'))
+            temp += station_travelers(railways, station)
         travellers.append(temp)
     return travellers
 
@@ -102,24 +180,19 @@ def travellers_by_station(railways: nx.Graph, stations_by_city):
     travellers = []
     for data in stations_by_city:
         for station in data[0]:
-            travellers.append(int(railways.nodes[station].get('travelers_2021')))
+            travellers.append(station_travelers(railways, station))
     return travellers
 
 
+@stage('travel_times_experience_top10')
 def travel_times_experience_top10():
     # Railways network
     railways = parse_railways('dataset')
     # And also without the high speed network
-    railways_without_high_speed = parse_railways('dataset', networks=["french_inter_city_network_GTFS",
-                                                                      "french_regional_networks_GTFS"])
+    railways_without_high_speed = parse_railways('dataset', exclude=[HIGH_SPEED])
 
-    cities = ['Paris', 'Marseille', 'Lyon', 'Toulouse', 'Nice', 'Nantes', 'Strasbourg',
-              'Montpellier', 'Bordeaux', 'Lille']
-
-    stations_by_city = [(['87271007', '87113001', '87391003', '87547000', '87686006'], 'Paris'),
-                        (['87751008'], 'Marseille'), (['87722025', '87723197'], 'Lyon'), (['87611004'], 'Toulouse'),
-                        (['87756056'], 'Nice'), (['87481002'], 'Nantes'), (['87212027'], 'Strasbourg'),
-                        (['87773002'], 'Montpellier'), (['87581009'], 'Bordeaux'), (['87223263', '87286005'], 'Lille')]
+    cities = CITIES[:10]
+    stations_by_city = STATIONS_BY_CITY[:10]
 
     data_with_high_speed = shortest_travel_time_between_major_stations(railways, stations_by_city)
     data_without_high_speed = shortest_travel_time_between_major_stations(railways_without_high_speed, stations_by_city)
@@ -158,6 +231,7 @@ def travel_times_experience_top10():
                 pad_inches=0.3)
 
 
+@stage('travel_times_experience_top25')
 def travel_times_experience_top25():
     # Complete railways network
     railways = parse_railways('dataset')
@@ -240,61 +314,45 @@ def travel_times_experience_top25():
     plt.clf()
 
 
-def robustness_experience():
-    # Complete railways network
-    railways = parse_railways('dataset')
-
-    cities = ['Paris', 'Marseille', 'Lyon', 'Toulouse', 'Nice', 'Nantes', 'Strasbourg',
-              'Montpellier', 'Bordeaux', 'Lille']
-
-    stations_by_city = [(['87271007', '87113001', '87391003', '87547000', '87686006'], 'Paris'),
-                        (['87751008'], 'Marseille'), (['87722025', '87723197'], 'Lyon'), (['87611004'], 'Toulouse'),
-                        (['87756056'], 'Nice'), (['87481002'], 'Nantes'), (['87212027'], 'Strasbourg'),
-                        (['87773002'], 'Montpellier'), (['87581009'], 'Bordeaux'), (['87223263', '87286005'], 'Lille')]
+def city_removal_delta(engine, city):
+    """ This function measures the average travel time increase between the other cities when a city is removed
+    (run in a scenario worker).
 
-    data_with_high_speed = shortest_travel_time_between_major_stations(railways, stations_by_city)
+    :param engine: The RobustnessEngine of the studied cities
+    :param city: The name of the removed city
+    :return: The average delta in minutes, and the number of pairs of cities left disconnected
+    """
+    for stations, name in engine.stations_by_city:
+        if name == city:
+            return engine.degradation(stations)
 
-    for city in cities:
-        railways_copy = railways.copy()
-        stations_by_city_copy = stations_by_city.copy()
 
-        for i in range(len(stations_by_city)):
-            if stations_by_city[i][1] == city:
-                stations = stations_by_city_copy.pop(i)
-                for station in stations[0]:
-                    railways_copy.remove_node(station)
+@stage('robustness_experience')
+def robustness_experience(workers=None):
+    # Complete railways network
+    railways = parse_railways('dataset')
 
-        data_without_city = shortest_travel_time_between_major_stations(railways, stations_by_city_copy)
+    cities = CITIES[:10]
+    stations_by_city = STATIONS_BY_CITY[:10]
 
-        average_delta = []
-        for i in range(len(stations_by_city_copy)):
-            # For each city the average travel time to reach other 8 cities
-            temp = []
-            for j in range(len(stations_by_city_copy)):
-                temp.append(data_without_city[0][i][j] - data_with_high_speed[0][i][j])
-            average_delta.append(np.mean(temp))
+    engine = RobustnessEngine(railways, stations_by_city)
+    for city, (delta, disconnected) in zip(cities, run_scenarios(city_removal_delta, engine, cities, workers,
+                                                                 label='robustness')):
+        print(city, delta, disconnected)
 
-        print(city, np.mean(average_delta))
+    # Share of the stations still connected while the busiest stations fail
+    curve = percolation_curve(railways, attack_order(railways, 'degree'))
+    print("Largest component after removing 1%, 5%, 10% of the stations:",
+          [round(curve[int(p * len(railways))], 3) for p in (0.01, 0.05, 0.1)])
 
 
-def new_line_experience():
+@stage('new_line_experience')
+def new_line_experience(workers=None):
     # Complete railways network
     railways = parse_railways('dataset')
 
-    cities = ["Paris", "Marseille", "Lyon", "Toulouse", "Nice", "Nantes", "Strasbourg", "Montpellier", "Bordeaux",
-              "Lille", "Rennes", "Reims", "Toulon", "Saint-Étienne", "Le Havre", "Dijon", "Grenoble", "Angers",
-              "Nîmes", "Clermont-Ferrand", "Aix-en-Provence", "Le Mans", "Brest", "Tours", "Amiens"]
-
-    stations_by_city = [(['87271007', '87113001', '87391003', '87547000', '87686006'], 'Paris'),
-                        (['87751008'], 'Marseille'), (['87722025', '87723197'], 'Lyon'), (['87611004'], 'Toulouse'),
-                        (['87756056'], 'Nice'), (['87481002'], 'Nantes'), (['87212027'], 'Strasbourg'),
-                        (['87773002'], 'Montpellier'), (['87581009'], 'Bordeaux'), (['87223263', '87286005'], 'Lille'),
-                        (['87471003'], 'Rennes'), (['87171009'], 'Reims'), (['87755009'], 'Toulon'),
-                        (['87726000'], 'Saint-Étienne'), (['87413013'], 'Le Havre'), (['87713040'], 'Dijon'),
-                        (['87747006'], 'Grenoble'), (['87484006'], 'Angers'),
-                        (['87703975'], 'Nîmes'), (['87734004'], 'Clermont-Ferrand'), (['87319012'], 'Aix-en-Provence'),
-                        (['87396002'], 'Le Mans'), (['87474007'], 'Brest'), (['87571000'], 'Tours'),
-                        (['87313874'], 'Amiens')]
+    cities = CITIES
+    stations_by_city = STATIONS_BY_CITY
 
     data_with_high_speed = shortest_travel_time_between_major_stations(railways, stations_by_city)
     travellers = travellers_by_city(railways, stations_by_city)
@@ -304,90 +362,98 @@ def new_line_experience():
         a = data_with_high_speed[0][i]
         weighted_travel_time.append(np.average(a, weights=travellers))
 
-    best_lines = find_best_lines_to_build(railways,
-                                          ["Toulouse", "Nice", "Toulon", "Montpellier", "Clermont-Ferrand", "Caen"],
-                                          stations_by_city, cities,
-                                          weighted_travel_time)
+    best_lines = find_best_lines_to_build(railways, NEW_LINE_CITIES, stations_by_city, cities,
+                                          weighted_travel_time, workers, LINE_DISTANCE_BAND)
 
 
-def build_new_line(railways: nx.Graph, station_a, station_b):
-    """ This function add a new connection between two stations.
+def score_new_line(context, candidate):
+    """ This function scores a candidate line for find_best_lines_to_build (run in a scenario worker).
 
-    :param railways: A network
-    :param station_a: A source station
-    :param station_b: A destination station
-    :return: The new network
+    :param context: The (engine, travellers, cities, initial weighted travel times) shared by all candidates
+    :param candidate: A (source city, destination city, station_source, station_destination) tuple
+    :return: The report line, the cost per minute saved and the line
     """
-    new_railways = railways.copy()
+    engine, travellers, cities, initial_weighted_travel_time = context
+    source, destination, station_source, station_destination = candidate
 
-    average_speed = 250  # The minimum speed in km/h for a high speed rail of category I.
-    dist = distance_between_stations(railways, station_a, station_b)
-    travel_time = dist / average_speed
+    dist, cost, travel_time = new_line_parameters(engine.railways, station_source, station_destination)
 
-    new_railways.add_edge(station_a, station_b, travel_time=travel_time)
-    cost = dist * 25
+    # Compute the weighted travel time
+    i = cities.index(source)
+    a = engine.with_line(station_source, station_destination, travel_time)[i]
+    weighted_travel_time = np.average(a, weights=travellers)
 
-    return new_railways, dist, cost, travel_time
+    # Check the delta and the cost of delta
+    delta = initial_weighted_travel_time[i] - weighted_travel_time
+    delta_cost = cost / delta
 
+    output = f"[{source}]<->[{destination}] - Distance: {round(dist, 2)} km," \
+             f" Accessibility: {round(weighted_travel_time)} min (-{round(delta)}),"\
+             f" Cost: {round(cost)} M€ ({round(delta_cost, 2)} M€/min) \n"
 
-def find_best_lines_to_build(railways: nx.Graph, from_cities, stations_by_city, cities,
-                             initial_weighted_travel_time):
-
-    travellers = travellers_by_city(railways, stations_by_city)
-    output = ""
-    best_lines = []
-    for data_source in stations_by_city:
-
-        if data_source[1] not in from_cities:
-            continue
-
-        best_line_output = None
-        best_perf = None
-        best_line = None
-        for data_destination in stations_by_city:
-
-            if data_source[1] == data_destination[1]:
-                continue
-
-            for station_source in data_source[0]:
-                for station_destination in data_destination[0]:
-                    new_railways, dist, cost, travel_time = build_new_line(railways, station_source, station_destination)
-
-                    data_with_new_line = shortest_travel_time_between_major_stations(new_railways, stations_by_city)
+    return output, delta_cost, (station_source, station_destination, travel_time)
 
-                    # Compute the weighted travel time
-                    i = cities.index(data_source[1])
-                    a = np.array(data_with_new_line[0][i])
-                    weighted_travel_time = np.average(a, weights=travellers)
 
-                    # Check the delta and the cost of delta
-                    delta = initial_weighted_travel_time[i] - weighted_travel_time
-                    delta_cost = cost / delta
-
-                    temp_output = f"[{data_source[1]}]<->[{data_destination[1]}] - Distance: {round(dist, 2)} km," \
-                                  f" Accessibility: {round(weighted_travel_time)} min (-{round(delta)}),"\
-                                  f" Cost: {round(cost)} M€ ({round(delta_cost, 2)} M€/min) \n"
-
-                    output += temp_output
-
-                    if best_perf is None or delta_cost < best_perf:
-                        best_perf = delta_cost
-                        best_line_output = temp_output
-                        best_line = (station_source, station_destination, travel_time)
+@stage('find_best_lines_to_build')
+def find_best_lines_to_build(railways: nx.Graph, from_cities, stations_by_city, cities,
+                             initial_weighted_travel_time, workers=None, distance_band=None):
+    """ This function looks for the new line improving the most the accessibility of each given city, per M€.
 
-        best_lines.append(best_line)
+    Candidate lines are evaluated with a WhatIfEngine, the railways are neither copied nor searched again, and spread
+    over a process pool (see scenarios). The report is written to output/new_line_analysis.txt as results arrive.
 
-        output += f"\nThe best line to build is : {best_line_output}\n"
-        output += "\n-----------------\n"
+    :param railways: A network
+    :param from_cities: The cities a new line starts from
+    :param stations_by_city: A list of stations for each city
+    :param cities: The names of the cities, in the order of stations_by_city
+    :param initial_weighted_travel_time: The current weighted travel time of each city
+    :param workers: The number of processes, all the cores by default
+    :param distance_band: The (minimum, maximum) length of a line in km, e.g. LINE_DISTANCE_BAND, any by default
+    :return: The {city: (station_source, station_destination, travel_time)} best line of each city of from_cities,
+             None for the cities without candidate line (no station, or none in the distance band)
+    """
 
-        print(output)
+    travellers = travellers_by_city(railways, stations_by_city)
+    engine = WhatIfEngine(railways, stations_by_city)
+    candidates = engine.candidate_lines(from_cities, *(distance_band or ()))
+    context = (engine, travellers, cities, initial_weighted_travel_time)
 
+    best_lines = dict.fromkeys(from_cities)
     with open("./output/new_line_analysis.txt", "w") as file:
-        file.write(output)
+        output = ""
+        best_perf = None
+        results = run_scenarios(score_new_line, context, candidates, workers, label='new lines')
+        for k, (temp_output, delta_cost, line) in enumerate(results):
+            output += temp_output
+
+            if best_perf is None or delta_cost < best_perf:
+                best_perf = delta_cost
+                best_line_output = temp_output
+                best_line = line
+
+            # Results come in the order of the candidates: write the report of a city once all its lines are scored
+            if k + 1 == len(candidates) or candidates[k + 1][0] != candidates[k][0]:
+                best_lines[candidates[k][0]] = best_line
+
+                output += f"\nThe best line to build is : {best_line_output}\n"
+                output += "\n-----------------\n"
+
+                print(output)
+                file.write(output)
+                file.flush()
+                output = ""
+                best_perf = None
+
+        for city in [city for city, line in best_lines.items() if line is None]:
+            output = f"[{city}] No candidate line" + (" in the distance band" if distance_band else "") + "\n"
+            output += "\n-----------------\n"
+            print(output)
+            file.write(output)
 
     return best_lines
 
 
+@stage('traffic_law_experience')
 def traffic_law_experience():
     railways = parse_railways('dataset')
 
@@ -487,6 +553,18 @@ def traffic_law_experience():
         print(estimated, true, estimated - true)
 
 
-# travel_times_experience()
-# travel_times_experience_top25()
-new_line_experience()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Travel time experiments on the French railways")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of processes for the scenario sweeps (default: all cores)")
+    parser.add_argument('--trace', nargs='?', const=DEFAULT_TRACE, default=None, metavar='PATH',
+                        help="Record the time, memory and counters of each stage to PATH.jsonl and PATH.trace.json "
+                             f"(default: {DEFAULT_TRACE}, or set {TRACE_VARIABLE})")
+    args = parser.parse_args()
+    if args.trace is not None:
+        enable(args.trace)
+
+    # travel_times_experience()
+    # travel_times_experience_top25()
+    # robustness_experience(args.workers)
+    new_line_experience(args.workers)
@@ -0,0 +1,391 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import networkx as nx
+import numpy as np
+import scipy
+
+import parser_GTFS
+import stations
+from analysis import find_best_lines_to_build, shortest_travel_time_between_major_stations, travellers_by_city
+from centrality import betweenness
+from instrumentation import memory_usage, reset_peak_memory
+from parser_GTFS import parse_railways
+from spatial import urban_areas
+from structure_analysis import small_world
+from synthetic_gtfs import SYNTHETIC_DIR, synthetic_dataset
+from what_if import LINE_DISTANCE_BAND
+
+BENCHMARK_VERSION = 1  # Bump when the stages or the format of the results change
+RESULTS_DIR = "output/benchmarks"
+SCALES = [1, 10, 100]
+
+CITIES = 10  # Urban areas of the travel time matrix and of the new lines
+LINE_CITIES = 2  # Cities the new lines start from
+PIVOTS = 200  # Sampled sources of the betweenness
+REPLICATES = 3  # Null models of the small world coefficient
+
+
+def children_peak_memory():
+    # Peak resident set size of the largest worker process waited for so far
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(run, state, trace_allocations=False):
+    """ This function runs a stage once and measures its time and memory.
+
+    CPU time includes the worker processes of the stage (see scenarios). The peak memory of the workers is the
+    largest of any worker so far, as the system does not reset it.
+
+    :param run: The function of the stage, taking the benchmark state
+    :param state: The benchmark state
+    :param trace_allocations: Whether to trace the peak of the Python and NumPy allocations, which slows the stage
+    :return: The measures, and the result of the stage
+    """
+    gc.collect()
+    peak_reset = reset_peak_memory()
+    rss_before, _ = memory_usage()
+    if trace_allocations:
+        tracemalloc.start()
+    times_before = os.times()
+    start = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run(state)
+
+    wall = time.perf_counter() - start
+    times_after = os.times()
+    rss_after, peak = memory_usage()
+    measures = {
+        'wall': wall,
+        'cpu': (times_after.user + times_after.system) - (times_before.user + times_before.system),
+        'children_cpu': ((times_after.children_user + times_after.children_system)
+                         - (times_before.children_user + times_before.children_system)),
+        'rss_before': rss_before,
+        'rss_after': rss_after,
+        'peak_rss': peak if peak_reset else None,
+        'peak_increase': peak - rss_before if peak_reset and rss_before is not None else None,
+        'children_peak_rss': children_peak_memory(),
+    }
+    if trace_allocations:
+        measures['peak_allocations'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return measures, result
+
+
+def clear_parsed_feeds():
+    # Forget the feeds and station indexes parsed by this process, so that the next parse reads the files again
+    parser_GTFS._layers.clear()
+    stations._indexes.clear()
+
+
+def needs_railways(state):
+    """ This function prepares the inputs of the stages after the parsing, when they are not in the state yet: the
+    railways, and the cities of the experiments, the busiest urban areas of the largest component.
+
+    :param state: The benchmark state
+    """
+    if 'railways' not in state:
+        state['railways'] = parse_railways(state['dataset'])
+    if 'stations_by_city' not in state:
+        railways = state['railways']
+        component = max(nx.connected_components(railways), key=len)
+        state['stations_by_city'] = urban_areas(railways.subgraph(component), top=CITIES)
+        state['cities'] = [name for _, name in state['stations_by_city']]
+
+
+def needs_travel_times(state):
+    needs_railways(state)
+    if 'weighted_travel_time' not in state:
+        travel_time_matrix(state)
+
+
+def parse_cold(state):
+    clear_parsed_feeds()
+    state['railways'] = parse_railways(state['dataset'], use_cache=False)
+    return {'nodes': state['railways'].number_of_nodes(), 'edges': state['railways'].number_of_edges()}
+
+
+def warm_cache(state):
+    parse_railways(state['dataset'])
+    clear_parsed_feeds()
+
+
+def parse_cached(state):
+    clear_parsed_feeds()
+    railways = parse_railways(state['dataset'])
+    return {'nodes': railways.number_of_nodes(), 'edges': railways.number_of_edges()}
+
+
+def travel_time_matrix(state):
+    travel_times, _ = shortest_travel_time_between_major_stations(state['railways'], state['stations_by_city'])
+    travellers = travellers_by_city(state['railways'], state['stations_by_city'])
+    state['weighted_travel_time'] = [np.average(row, weights=travellers) for row in travel_times]
+    return {'cities': len(travel_times), 'mean': float(np.mean(travel_times))}
+
+
+def best_lines(state):
+    lines = find_best_lines_to_build(state['railways'], state['cities'][:LINE_CITIES], state['stations_by_city'],
+                                     state['cities'], state['weighted_travel_time'], state['workers'],
+                                     LINE_DISTANCE_BAND)
+    return {'lines': len(lines)}
+
+
+def betweenness_centrality(state):
+    centrality = betweenness(state['railways'], k=min(PIVOTS, len(state['railways'])), seed=state['seed'],
+                             workers=state['workers'])
+    return {'max': max(centrality.values())}
+
+
+def closeness_centrality(state):
+    centrality = nx.closeness_centrality(state['railways'], distance='travel_time')
+    return {'max': max(centrality.values())}
+
+
+def degree_centrality(state):
+    centrality = nx.degree_centrality(state['railways'])
+    return {'max': max(centrality.values())}
+
+
+def pagerank(state):
+    centrality = nx.pagerank(state['railways'])
+    return {'max': max(centrality.values())}
+
+
+def small_world_coefficient(state):
+    sigma, clustering_ratio, distance_ratio, _ = small_world(state['railways'], REPLICATES, state['seed'],
+                                                             state['workers'])
+    return {'sigma': float(sigma)}
+
+
+# name: (setup, run, largest scale), in the order they run. The setup is not measured, it prepares the inputs of the
+# stage. Exact closeness and the exact average path length of the small world coefficient search from every
+# station, their time grows with the square of the size: they are left out of the largest scales.
+STAGES = {
+    'parse_railways': (None, parse_cold, None),
+    'parse_railways_cached': (warm_cache, parse_cached, None),
+    'shortest_travel_time_between_major_stations': (needs_railways, travel_time_matrix, None),
+    'find_best_lines_to_build': (needs_travel_times, best_lines, None),
+    'betweenness': (needs_railways, betweenness_centrality, None),
+    'closeness_centrality': (needs_railways, closeness_centrality, 10),
+    'degree_centrality': (needs_railways, degree_centrality, None),
+    'pagerank': (needs_railways, pagerank, None),
+    'small_world': (needs_railways, small_world_coefficient, 10),
+}
+
+
+def table_rows(dataset_path):
+    """ This function counts the rows of the tables of a dataset.
+
+    :param dataset_path: The dataset directory
+    :return: The {feed/table: rows} dictionary
+    """
+    rows = {}
+    for root, _, files in os.walk(dataset_path):
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as file:
+                rows[os.path.relpath(os.path.join(root, name), dataset_path)] = max(sum(1 for _ in file) - 1, 0)
+    return dict(sorted(rows.items()))
+
+
+def summarize(runs):
+    """ This function summarizes the measures of the runs of a stage: the median of each, and the fastest wall time.
+
+    :param runs: The measures of each run
+    :return: The summary
+    """
+    summary = {'wall_min': min(run['wall'] for run in runs)}
+    for measure in runs[0]:
+        values = [run[measure] for run in runs if run[measure] is not None]
+        summary[measure] = statistics.median(values) if values else None
+    return summary
+
+
+def benchmark_scale(scale, seed=0, repeat=3, workers=None, stages=None, trace_allocations=False,
+                    data_dir=SYNTHETIC_DIR):
+    """ This function runs the benchmark stages on the synthetic dataset of a scale.
+
+    :param scale: The size of the dataset relative to dataset/
+    :param seed: The seed of the dataset and of the sampled stages
+    :param repeat: The number of measured runs of each stage
+    :param workers: The number of processes of the parallel stages, all the cores by default
+    :param stages: The names of the stages to run, all of them by default
+    :param trace_allocations: Whether to trace the peak of the Python and NumPy allocations
+    :param data_dir: The directory of the generated datasets
+    :return: The results of the scale
+    """
+    start = time.perf_counter()
+    dataset_path = synthetic_dataset(scale, seed, data_dir)
+    results = {'scale': scale, 'dataset': {'path': dataset_path, 'seconds': time.perf_counter() - start,
+                                           'rows': table_rows(dataset_path)}, 'stages': {}, 'skipped': []}
+
+    state = {'dataset': dataset_path, 'seed': seed, 'workers': workers}
+    for name, (setup, run, largest_scale) in STAGES.items():
+        if stages is not None and name not in stages:
+            continue
+        if largest_scale is not None and scale > largest_scale:
+            results['skipped'].append(name)
+            continue
+        if setup is not None:
+            setup(state)
+
+        runs = []
+        for _ in range(repeat):
+            measures, result = measure(run, state, trace_allocations)
+            runs.append(measures)
+        results['stages'][name] = {'summary': summarize(runs), 'runs': runs, 'result': result}
+        sys.stderr.write(f"[benchmark] scale {scale} - {name}: {results['stages'][name]['summary']['wall']:.3f}s\n")
+    return results
+
+
+def environment():
+    """ This function describes the code and the machine of a benchmark run, to compare runs across commits.
+
+    :return: The description
+    """
+    def git(*command):
+        try:
+            return subprocess.run(['git', *command], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'networkx': nx.__version__,
+    }
+
+
+def run_benchmarks(scales=SCALES, seed=0, repeat=3, workers=None, stages=None, trace_allocations=False,
+                   data_dir=SYNTHETIC_DIR):
+    """ This function benchmarks the pipeline stages on synthetic datasets of several scales.
+
+    The stages run in a temporary working directory, so that their caches and reports do not mix with those of
+    real runs. The generated datasets are kept in data_dir and reused by later runs.
+
+    :param scales: The sizes of the datasets relative to dataset/
+    :param seed: The seed of the datasets and of the sampled stages
+    :param repeat: The number of measured runs of each stage
+    :param workers: The number of processes of the parallel stages, all the cores by default
+    :param stages: The names of the stages to run, all of them by default
+    :param trace_allocations: Whether to trace the peak of the Python and NumPy allocations
+    :param data_dir: The directory of the generated datasets
+    :return: The results
+    """
+    results = {'version': BENCHMARK_VERSION, 'environment': environment(),
+               'settings': {'seed': seed, 'repeat': repeat, 'workers': workers, 'stages': stages,
+                            'trace_allocations': trace_allocations},
+               'scales': []}
+    data_dir = os.path.abspath(data_dir)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        os.makedirs('output')
+        try:
+            for scale in scales:
+                results['scales'].append(benchmark_scale(scale, seed, repeat, workers, stages, trace_allocations,
+                                                         data_dir))
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def save_results(results, path=None):
+    """ This function writes benchmark results as JSON.
+
+    :param results: The results (see run_benchmarks)
+    :param path: The file path, output/benchmarks/<date>-<commit>.json by default
+    :return: The file path
+    """
+    if path is None:
+        commit = (results['environment']['commit'] or 'unknown')[:10]
+        date = results['environment']['timestamp'].replace(':', '')
+        path = os.path.join(RESULTS_DIR, f"{date}-{commit}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+    return path
+
+
+def compare_results(baseline, current):
+    """ This function compares the median wall time and peak memory increase of the stages of two benchmark runs.
+
+    :param baseline: The results of the reference run
+    :param current: The results of the compared run
+    :return: A list of (scale, stage, baseline wall, current wall, wall ratio, baseline peak increase, current peak
+        increase) tuples
+    """
+    def stages(results):
+        return {(scale['scale'], name): stage['summary'] for scale in results['scales']
+                for name, stage in scale['stages'].items()}
+
+    before, after = stages(baseline), stages(current)
+    rows = []
+    for key in [key for key in after if key in before]:
+        rows.append((*key, before[key]['wall'], after[key]['wall'], after[key]['wall'] / before[key]['wall'],
+                     before[key]['peak_increase'], after[key]['peak_increase']))
+    return rows
+
+
+def print_comparison(rows):
+    def megabytes(value):
+        return f"{value / 2 ** 20:,.0f} MB" if value is not None else "-"
+
+    print("{:>6s} | {:<44s} | {:>10s} | {:>10s} | {:>7s} | {:>10s} | {:>10s}".format(
+        'Scale', 'Stage', 'Before', 'After', 'Ratio', 'Mem. bef.', 'Mem. aft.'))
+    for scale, name, wall_before, wall_after, ratio, peak_before, peak_after in rows:
+        print("{:>6} | {:<44s} | {:>9.3f}s | {:>9.3f}s | {:>6.2f}x | {:>10s} | {:>10s}".format(
+            scale, name, wall_before, wall_after, ratio, megabytes(peak_before), megabytes(peak_after)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the pipeline stages on synthetic GTFS datasets")
+    parser.add_argument('--scales', type=float, nargs='+', default=SCALES,
+                        help="Sizes of the datasets relative to dataset/ (default: 1 10 100)")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=None,
+                        help="Stages to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="Measured runs of each stage (default: 3)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the datasets and of the sampled stages")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of processes of the parallel stages (default: all cores)")
+    parser.add_argument('--trace-allocations', action='store_true',
+                        help="Also measure the peak of the Python and NumPy allocations (slower)")
+    parser.add_argument('--output', default=None, help="Results file (default: output/benchmarks/<date>-<commit>.json)")
+    parser.add_argument('--compare', nargs='+', default=None, metavar='RESULTS',
+                        help="Compare a new run to a results file, or two results files without running")
+    args = parser.parse_args()
+
+    if args.compare is not None and len(args.compare) == 2:
+        with open(args.compare[0]) as baseline_file, open(args.compare[1]) as current_file:
+            print_comparison(compare_results(json.load(baseline_file), json.load(current_file)))
+        sys.exit()
+
+    scales = [int(scale) if float(scale).is_integer() else scale for scale in args.scales]
+    benchmark = run_benchmarks(scales, args.seed, args.repeat, args.workers, args.stages, args.trace_allocations)
+    print("Results written to", save_results(benchmark, args.output))
+
+    if args.compare is not None:
+        with open(args.compare[0]) as baseline_file:
+            print_comparison(compare_results(json.load(baseline_file), benchmark))
@@ -0,0 +1,146 @@
+import math
+import random
+from heapq import heappop, heappush
+
+import numpy as np
+
+import instrumentation
+from compact_graph import CompactGraph, to_compact
+from instrumentation import stage
+from scenarios import run_scenarios
+
+
+def pivots_for_error(n, epsilon, delta=0.1):
+    """ This function gives the number of sampled sources bounding the error of the approximate betweenness.
+
+    Each sampled source s gives the estimate n δ_s(v) / ((n - 1)(n - 2)) of the normalized betweenness of v, which
+    lies in [0, n / (n - 1)]. By Hoeffding's inequality and a union bound over the n stations, with this number of
+    pivots every estimate is within epsilon of the exact value with probability at least 1 - delta.
+
+    :param n: The number of stations
+    :param epsilon: The maximum absolute error on the normalized betweenness
+    :param delta: The probability of exceeding the error
+    :return: The number of pivots, at most n
+    """
+    bound = n / (n - 1)
+    return min(n, math.ceil(bound ** 2 * math.log(2 * n / delta) / (2 * epsilon ** 2)))
+
+
+def dependencies(context, sources):
+    """ This function accumulates the pair dependencies of a batch of sources with Brandes' algorithm (run in a
+    scenario worker).
+
+    :param context: The adjacency lists of (neighbour, weight) pairs, or of neighbours when unweighted
+    :param sources: The ids of the sources
+    :return: The sum of the dependencies of each station on the sources
+    """
+    adjacency, weighted = context
+    if weighted:
+        instrumentation.count('dijkstra_calls', len(sources))
+    n = len(adjacency)
+    total = np.zeros(n)
+
+    for s in sources:
+        order = []
+        predecessors = [[] for _ in range(n)]
+        sigma = [0] * n
+        sigma[s] = 1
+        distance = [None] * n
+
+        if weighted:
+            # Same path counting as networkx, zero travel times included
+            seen = {s: 0}
+            heap = [(0, 0, s, s)]
+            count = 1
+            while heap:
+                d, _, predecessor, v = heappop(heap)
+                if distance[v] is not None:
+                    continue
+                if v != s:
+                    sigma[v] += sigma[predecessor]
+                distance[v] = d
+                order.append(v)
+                for w, weight in adjacency[v]:
+                    vw = d + weight
+                    if distance[w] is None and (w not in seen or vw < seen[w]):
+                        seen[w] = vw
+                        heappush(heap, (vw, count, v, w))
+                        count += 1
+                        sigma[w] = 0
+                        predecessors[w] = [v]
+                    elif vw == seen.get(w):
+                        sigma[w] += sigma[v]
+                        predecessors[w].append(v)
+        else:
+            distance[s] = 0
+            queue = [s]
+            for v in queue:
+                order.append(v)
+                for w in adjacency[v]:
+                    if distance[w] is None:
+                        distance[w] = distance[v] + 1
+                        queue.append(w)
+                    if distance[w] == distance[v] + 1:
+                        sigma[w] += sigma[v]
+                        predecessors[w].append(v)
+
+        delta = [0.0] * n
+        for w in reversed(order):
+            coefficient = (1 + delta[w]) / sigma[w]
+            for v in predecessors[w]:
+                delta[v] += sigma[v] * coefficient
+            if w != s:
+                total[w] += delta[w]
+
+    return total
+
+
+@stage('betweenness')
+def betweenness(railways, k=None, epsilon=None, delta=0.1, seed=None, weight='travel_time', normalized=True,
+                workers=None):
+    """ This function computes the betweenness centrality of the stations, exactly or from sampled sources.
+
+    Sources are split in batches over a process pool (see scenarios) and their partial dependencies summed. The
+    values are those of networkx.betweenness_centrality with the same parameters, so they can be given to tops().
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param k: The number of sampled sources (pivots), all the stations by default
+    :param epsilon: The maximum error of the estimates, used to choose k when it is not given (see pivots_for_error)
+    :param delta: The probability of exceeding epsilon
+    :param seed: The seed of the pivots sampling
+    :param weight: The edge weight, travel_time by default, None for hops
+    :param normalized: Whether to normalize by the number of pairs
+    :param workers: The number of processes, all the cores by default
+    :return: The betweenness of each station, by UIC code
+    """
+    C = railways if isinstance(railways, CompactGraph) else to_compact(railways, weight=weight or 'travel_time')
+    n = len(C)
+
+    if weight is None:
+        adjacency = [C.neighbors(i).tolist() for i in range(n)]
+    else:
+        weights = C.travel_time.astype(float)
+        adjacency = [list(zip(C.neighbors(i).tolist(), weights[C.indptr[i]:C.indptr[i + 1]].tolist()))
+                     for i in range(n)]
+
+    if k is None and epsilon is not None:
+        k = pivots_for_error(n, epsilon, delta)
+    sources = list(range(n)) if k is None or k >= n else random.Random(seed).sample(range(n), k)
+
+    batches = [sources[i::64] for i in range(min(64, len(sources)))]
+    total = np.zeros(n)
+    for partial in run_scenarios(dependencies, (adjacency, weight is not None), batches, workers,
+                                 label='betweenness'):
+        total += partial
+
+    # Same rescaling as networkx for undirected graphs
+    if normalized:
+        scale = 1 / ((n - 1) * (n - 2)) if n > 2 else None
+    else:
+        scale = 0.5
+    if scale is not None:
+        if len(sources) < n:
+            scale *= n / len(sources)
+        total *= scale
+
+    return dict(zip(C.nodes.tolist(), total.tolist()))
@@ -0,0 +1,214 @@
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra, shortest_path
+
+from instrumentation import count
+
+
+class CompactGraph:
+    """ An undirected railways graph stored as CSR adjacency arrays with integer node ids.
+
+    Node i is the station nodes[i] (its UIC code), index maps UIC codes back to ids. Every edge is stored in both
+    directions: the neighbours of i are indices[indptr[i]:indptr[i + 1]] and the matching travel times are
+    travel_time[indptr[i]:indptr[i + 1]]. Node attributes are typed columns: NaN coordinates and -1 travellers
+    when missing.
+    """
+
+    def __init__(self, nodes, indptr, indices, travel_time, stop_name=None, lat=None, long=None, travelers=None,
+                 name=''):
+        n = len(nodes)
+        self.name = name
+        self.nodes = np.asarray(nodes, dtype=str)
+        self.index = {node: i for i, node in enumerate(self.nodes.tolist())}
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.travel_time = np.asarray(travel_time, dtype=np.float32)
+        self.stop_name = np.asarray(stop_name if stop_name is not None else [''] * n, dtype=str)
+        self.lat = np.asarray(lat if lat is not None else np.full(n, np.nan), dtype=np.float64)
+        self.long = np.asarray(long if long is not None else np.full(n, np.nan), dtype=np.float64)
+        self.travelers = np.asarray(travelers if travelers is not None else np.full(n, -1), dtype=np.int64)
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.indices) // 2
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def matrix(self):
+        """ This function gives the weighted adjacency matrix, as expected by scipy.sparse.csgraph.
+
+        Explicit zeros are kept: a travel time of 0 minutes is still an edge.
+
+        :return: The travel time CSR matrix
+        """
+        if self._matrix is None:
+            n = len(self.nodes)
+            self._matrix = csr_matrix((self.travel_time, self.indices, self.indptr), shape=(n, n))
+        return self._matrix
+
+
+def to_compact(G: nx.Graph, weight='travel_time'):
+    """ This function converts a railways graph to its compact form.
+
+    :param G: The railways graph
+    :param weight: The edge attribute used as travel time
+    :return: The compact graph
+    """
+    count('graph_copies')
+    nodes = list(G.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+
+    sources = []
+    destinations = []
+    weights = []
+    for u, v, w in G.edges(data=weight, default=0):
+        if u == v:
+            continue
+        sources += [index[u], index[v]]
+        destinations += [index[v], index[u]]
+        weights += [w, w]
+
+    def column(key, dtype, missing):
+        return np.array([dtype(G.nodes[node][key]) if G.nodes[node].get(key) is not None else missing
+                         for node in nodes], dtype=dtype)
+
+    return from_edges(nodes, sources, destinations, weights, symmetric=True,
+                      stop_name=[G.nodes[node].get('stop_name', '') for node in nodes],
+                      lat=column('lat', float, np.nan), long=column('long', float, np.nan),
+                      travelers=column('travelers_2021', int, -1), name=G.name)
+
+
+def from_edges(nodes, sources, destinations, weights=None, symmetric=False, **attributes):
+    """ This function builds a compact graph from edge arrays.
+
+    :param nodes: The UIC codes (or any labels) of the nodes
+    :param sources: The ids of the first ends of the edges
+    :param destinations: The ids of the second ends of the edges
+    :param weights: The travel times of the edges, 0 by default
+    :param symmetric: Whether both directions of every edge are already given
+    :param attributes: The node columns given to CompactGraph
+    :return: The compact graph
+    """
+    n = len(nodes)
+    sources = np.asarray(sources, dtype=np.int32)
+    destinations = np.asarray(destinations, dtype=np.int32)
+    weights = np.zeros(len(sources), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+    if not symmetric:
+        sources, destinations = np.concatenate([sources, destinations]), np.concatenate([destinations, sources])
+        weights = np.concatenate([weights, weights])
+
+    order = np.lexsort((destinations, sources))
+    indptr = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+
+    return CompactGraph(nodes, indptr, destinations[order], weights[order], **attributes)
+
+
+def to_networkx(C: CompactGraph):
+    """ This function converts a compact graph back to a NetworkX graph keyed by UIC codes.
+
+    :param C: The compact graph
+    :return: The railways graph
+    """
+    G = nx.Graph(name=C.name)
+    nodes = C.nodes.tolist()
+    for i, node in enumerate(nodes):
+        attributes = {}
+        if C.stop_name[i] != '':
+            attributes['stop_name'] = str(C.stop_name[i])
+        if not np.isnan(C.lat[i]) and not np.isnan(C.long[i]):
+            attributes['lat'] = float(C.lat[i])
+            attributes['long'] = float(C.long[i])
+        if C.travelers[i] >= 0:
+            attributes['travelers_2021'] = int(C.travelers[i])
+        G.add_node(node, **attributes)
+
+    sources = np.repeat(np.arange(len(nodes)), np.diff(C.indptr))
+    upper = sources < C.indices
+    G.add_edges_from((nodes[u], nodes[v], {'travel_time': float(w)})
+                     for u, v, w in zip(sources[upper], C.indices[upper], C.travel_time[upper]))
+    return G
+
+
+def hop_distances(C: CompactGraph, i):
+    """ This function computes the number of hops from station i to every station.
+
+    :param C: The compact graph
+    :param i: The id of the source station
+    :return: The hop distances, inf for unreachable stations
+    """
+    return shortest_path(C.matrix(), directed=True, unweighted=True, indices=i)
+
+
+def travel_times_from(C: CompactGraph, sources):
+    """ This function computes the shortest travel times from one or several stations.
+
+    :param C: The compact graph
+    :param sources: A station id or a list of station ids
+    :return: The shortest travel times, one row per source when a list is given
+    """
+    count('dijkstra_calls', np.size(sources))
+    return dijkstra(C.matrix(), directed=True, indices=sources)
+
+
+def hop_distance_sums(C: CompactGraph, sources=None, batch_size=256):
+    """ This function sums the number of hops of the shortest paths from many sources at once.
+
+    Sources are processed by batches: the BFS frontiers of a whole batch are advanced together with one sparse
+    matrix product per level.
+
+    :param C: The compact graph
+    :param sources: The ids of the sources, all the stations by default
+    :param batch_size: The number of sources advanced together
+    :return: The sum of the distances and the number of (source, reachable station) pairs, the source excluded
+    """
+    n = len(C)
+    sources = np.arange(n) if sources is None else np.asarray(sources)
+    A = csr_matrix((np.ones(len(C.indices), dtype=np.float32), C.indices, C.indptr), shape=(n, n))
+
+    total = 0
+    pairs = 0
+    for start in range(0, len(sources), batch_size):
+        batch = sources[start:start + batch_size]
+        visited = np.zeros((n, len(batch)), dtype=bool)
+        visited[batch, np.arange(len(batch))] = True
+        frontier = visited.astype(np.float32)
+        level = 0
+        while True:
+            level += 1
+            reached = (A @ frontier > 0) & ~visited
+            count = int(reached.sum())
+            if count == 0:
+                break
+            total += level * count
+            pairs += count
+            visited |= reached
+            frontier = reached.astype(np.float32)
+
+    return total, pairs
+
+
+def average_clustering(C: CompactGraph):
+    """ This function computes the average clustering coefficient, as networkx.average_clustering.
+
+    :param C: The compact graph
+    :return: The average clustering coefficient
+    """
+    n = len(C)
+    A = csr_matrix((np.ones(len(C.indices)), C.indices, C.indptr), shape=(n, n))
+    triangles = np.asarray((A @ A).multiply(A).sum(axis=1)).ravel() / 2
+    degree = C.degree().astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        clustering = np.where(degree > 1, 2 * triangles / (degree * (degree - 1)), 0.0)
+    return float(clustering.mean()) if n else 0.0
@@ -0,0 +1,205 @@
+import glob
+import hashlib
+import os
+
+import networkx as nx
+import numpy as np
+
+import graph_cache
+from gtfs_reader import table_files
+from instrumentation import count, stage
+from parser_GTFS import NETWORKS, parse_railways
+from service_days import ServiceIndex, gtfs_date
+
+# Tables read by the service index besides those of the parsed graph (see graph_cache.GTFS_TABLES)
+SERVICE_TABLES = ['trips', 'calendar', 'calendar_dates']
+
+
+class EdgeStatistics:
+    """ The statistics of the trains serving each edge of the railways, as columns.
+
+    Row i is the edge (sources[i], destinations[i]) of UIC codes. Travel times are in minutes, departures in seconds
+    since the start of the service day, and networks[i, j] tells whether the feed network_names[j] serves the edge.
+    """
+
+    COLUMNS = ['min_travel_time', 'median_travel_time', 'max_travel_time', 'trips', 'first_departure',
+               'last_departure']
+
+    def __init__(self, sources, destinations, min_travel_time, median_travel_time, max_travel_time, trips,
+                 first_departure, last_departure, networks, network_names):
+        self.sources = np.asarray(sources, dtype=str)
+        self.destinations = np.asarray(destinations, dtype=str)
+        self.min_travel_time = np.asarray(min_travel_time, dtype=np.float64)
+        self.median_travel_time = np.asarray(median_travel_time, dtype=np.float64)
+        self.max_travel_time = np.asarray(max_travel_time, dtype=np.float64)
+        self.trips = np.asarray(trips, dtype=np.int64)
+        self.first_departure = np.asarray(first_departure, dtype=np.int64)
+        self.last_departure = np.asarray(last_departure, dtype=np.int64)
+        self.networks = np.asarray(networks, dtype=bool).reshape(len(self.sources), len(network_names))
+        self.network_names = list(network_names)
+
+        self.index = {}
+        for i, (u, v) in enumerate(zip(self.sources.tolist(), self.destinations.tolist())):
+            self.index[(u, v)] = i
+            self.index[(v, u)] = i
+
+    def __len__(self):
+        return len(self.sources)
+
+    def row(self, u, v):
+        """ This function gives the statistics of an edge.
+
+        :param u: The UIC code of a station
+        :param v: The UIC code of the other station
+        :return: The {column: value} dictionary of the edge, with the names of its networks
+        """
+        i = self.index[(u, v)]
+        row = {column: getattr(self, column)[i].item() for column in self.COLUMNS}
+        row['networks'] = [name for name, serves in zip(self.network_names, self.networks[i]) if serves]
+        return row
+
+    def column(self, G: nx.Graph, column, default=0):
+        """ This function gives a column of the statistics in the order of the edges of a graph.
+
+        :param G: The railways graph
+        :param column: The name of the column
+        :param default: The value of the edges without statistics
+        :return: The values, as a numpy array
+        """
+        values = getattr(self, column)
+        rows = np.array([self.index.get((u, v), -1) for u, v in G.edges()], dtype=np.int64)
+        return np.where(rows >= 0, values[rows], default) if len(rows) else values[:0]
+
+    def set_edge_attributes(self, G: nx.Graph, columns=('trips',)):
+        """ This function copies columns of the statistics to the edge attributes of a graph, e.g. to weight
+        analyses by service frequency.
+
+        :param G: The railways graph
+        :param columns: The names of the columns
+        """
+        for column in columns:
+            values = getattr(self, column).tolist()
+            nx.set_edge_attributes(G, {(u, v): values[self.index[(u, v)]] for u, v in G.edges()
+                                       if (u, v) in self.index}, column)
+
+    def save(self, path):
+        """ This function writes the statistics to a compressed numpy archive.
+
+        :param path: The archive path
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = path + ".tmp.npz"
+        np.savez_compressed(temp_path, sources=self.sources, destinations=self.destinations, networks=self.networks,
+                            network_names=np.array(self.network_names, dtype=str),
+                            **{column: getattr(self, column) for column in self.COLUMNS})
+        os.replace(temp_path, path)
+
+
+def load_statistics(path):
+    """ This function reads statistics written by EdgeStatistics.save.
+
+    :param path: The archive path
+    :return: The edge statistics
+    """
+    with np.load(path) as archive:
+        return EdgeStatistics(archive['sources'], archive['destinations'],
+                              *(archive[column] for column in EdgeStatistics.COLUMNS),
+                              archive['networks'], archive['network_names'].tolist())
+
+
+@stage('compute_edge_statistics')
+def compute_edge_statistics(index: ServiceIndex, dates=None):
+    """ This function computes the statistics of every edge in one grouped pass over the connections.
+
+    :param index: The service index of the feeds
+    :param dates: A date or a list of dates (see service_days.gtfs_date), every trip by default
+    :return: The edge statistics
+    """
+    running = np.flatnonzero(index.running_connections(dates))
+    edge = index.edge[running]
+    travel_times = (index.arrival_time[running] - index.departure_time[running]) / 60
+    departures = index.departure_time[running]
+
+    # Connections grouped by edge, by increasing travel time within an edge
+    order = np.lexsort((travel_times, edge))
+    edge, travel_times, departures = edge[order], travel_times[order], departures[order]
+    trips = index.trip[running][order]
+    served, starts, counts = np.unique(edge, return_index=True, return_counts=True)
+    ends = starts + counts
+
+    median = (travel_times[starts + (counts - 1) // 2] + travel_times[starts + counts // 2]) / 2
+    first_departure = np.minimum.reduceat(departures, starts) if len(starts) else departures[:0]
+    last_departure = np.maximum.reduceat(departures, starts) if len(starts) else departures[:0]
+
+    # A trip may serve the same edge twice, it is counted once
+    distinct = np.unique(np.stack([edge, trips], axis=1).reshape(-1, 2), axis=0)[:, 0]
+    trip_counts = np.bincount(distinct, minlength=len(index.edges))[served]
+
+    networks = np.zeros((len(index.edges), len(index.networks)), dtype=bool)
+    networks[edge, index.network[running][order]] = True
+
+    stations = np.array(index.stations, dtype=str)
+    return EdgeStatistics(stations[index.edges[served, 0]], stations[index.edges[served, 1]],
+                          travel_times[starts], median, travel_times[ends - 1], trip_counts,
+                          first_departure, last_departure, networks[served], index.networks)
+
+
+def railway_statistics(dataset_path, networks=None, exclude=(), dates=None, use_cache=True, index=None):
+    """ This function gives the edge statistics of the railways, from the on-disk cache when it is up to date.
+
+    The archive is tied to the stop_times, trips and calendars of the feeds. Archives of older versions of the same
+    feeds and dates are removed when a new one is written.
+
+    :param dataset_path: The dataset path where GTFS files are stored
+    :param networks: The GTFS directories to merge, all of them by default
+    :param exclude: The GTFS directories to leave out
+    :param dates: A date or a list of dates (see service_days.gtfs_date), every trip by default
+    :param use_cache: Whether to read and write the on-disk cache
+    :param index: The service index of the feeds, built when needed by default
+    :return: The edge statistics
+    """
+    if not use_cache:
+        return compute_edge_statistics(index or ServiceIndex(dataset_path, networks, exclude), dates)
+
+    networks = NETWORKS if networks is None else networks
+    network_paths = [dataset_path + "/" + network for network in networks if network not in exclude]
+
+    # The selection of feeds and dates names the archive, the versions of the files read by the service index key it
+    selection = hashlib.sha1('|'.join(network_paths).encode())
+    if dates is not None:
+        dates = [dates] if isinstance(dates, str) or not hasattr(dates, '__iter__') else dates
+        selection.update(('|' + '|'.join(gtfs_date(date) for date in dates)).encode())
+    name = f"edge_statistics-{selection.hexdigest()[:16]}"
+    digest = hashlib.sha1()
+    for network_path in network_paths:
+        digest.update(f"{graph_cache.cache_key(network_path, table_files(network_path, SERVICE_TABLES))}|".encode())
+    path = os.path.join(graph_cache.CACHE_DIR, f"{name}-{digest.hexdigest()[:16]}.npz")
+
+    if os.path.exists(path):
+        count('edge_statistics_cache_hits')
+        return load_statistics(path)
+    count('edge_statistics_cache_misses')
+    statistics = compute_edge_statistics(index or ServiceIndex(dataset_path, networks, exclude), dates)
+    for stale in glob.glob(os.path.join(graph_cache.CACHE_DIR, f"{name}-*.npz")):
+        os.remove(stale)
+    statistics.save(path)
+    return statistics
+
+
+def railways_with_statistics(dataset_path, networks=None, exclude=(), use_cache=True):
+    """ This function parses the railways graph with its edge statistics.
+
+    The statistics are stored next to the graph, in railways.graph['edge_statistics'], and the number of trips of
+    each edge in its 'trips' attribute.
+
+    :param dataset_path: The dataset path where GTFS files are stored
+    :param networks: The GTFS directories to merge, all of them by default
+    :param exclude: The GTFS directories to leave out
+    :param use_cache: Whether to read and write the on-disk caches
+    :return: The railways graph
+    """
+    railways = parse_railways(dataset_path, networks, use_cache, exclude)
+    statistics = railway_statistics(dataset_path, networks, exclude, use_cache=use_cache)
+    railways.graph['edge_statistics'] = statistics
+    statistics.set_edge_attributes(railways)
+    return railways
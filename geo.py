@@ -0,0 +1,144 @@
+import weakref
+
+import numpy as np
+
+from compact_graph import CompactGraph
+from instrumentation import count, stage
+
+# WGS-84 ellipsoid, as used by geopy
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+# Per graph: coordinates by UIC code and computed distances, dropped with the graph
+_cache = weakref.WeakKeyDictionary()
+
+
+def geodesic(lat_a, long_a, lat_b, long_b, tolerance=1e-12, max_iterations=200):
+    """ This function computes geodesic distances on the WGS-84 ellipsoid with Vincenty's inverse formula.
+
+    All arguments are broadcast against each other, so a single call can compute a batch of pairs or a whole matrix.
+    The results match geopy.distance.distance to well under a meter.
+
+    :param lat_a: The latitudes of the first points, in degrees
+    :param long_a: The longitudes of the first points, in degrees
+    :param lat_b: The latitudes of the second points, in degrees
+    :param long_b: The longitudes of the second points, in degrees
+    :param tolerance: The convergence threshold on the longitude on the auxiliary sphere
+    :param max_iterations: The maximum number of iterations
+    :return: The distances in km
+    """
+    phi_a, phi_b, L = np.broadcast_arrays(np.radians(lat_a), np.radians(lat_b),
+                                          np.radians(np.subtract(long_b, long_a)))
+    count('geodesic_distances', phi_a.size)
+
+    U_a = np.arctan((1 - WGS84_F) * np.tan(phi_a))
+    U_b = np.arctan((1 - WGS84_F) * np.tan(phi_b))
+    sin_U_a, cos_U_a = np.sin(U_a), np.cos(U_a)
+    sin_U_b, cos_U_b = np.sin(U_b), np.cos(U_b)
+
+    lambda_ = L
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sin_lambda, cos_lambda = np.sin(lambda_), np.cos(lambda_)
+            sin_sigma = np.hypot(cos_U_b * sin_lambda, cos_U_a * sin_U_b - sin_U_a * cos_U_b * cos_lambda)
+            cos_sigma = sin_U_a * sin_U_b + cos_U_a * cos_U_b * cos_lambda
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_U_a * cos_U_b * sin_lambda / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_U_a * sin_U_b / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            previous = lambda_
+            lambda_ = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            if np.all(np.abs(lambda_ - previous) <= tolerance):
+                break
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+        - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+
+    return WGS84_B * A * (sigma - delta_sigma) / 1000
+
+
+def _graph_cache(railways):
+    if railways not in _cache:
+        if isinstance(railways, CompactGraph):
+            index = railways.index
+            lat, long = railways.lat, railways.long
+        else:
+            nodes = list(railways.nodes())
+            index = {node: i for i, node in enumerate(nodes)}
+            lat = np.array([float(railways.nodes[node].get('lat', np.nan)) for node in nodes])
+            long = np.array([float(railways.nodes[node].get('long', np.nan)) for node in nodes])
+        _cache[railways] = {'index': index, 'lat': lat, 'long': long, 'matrices': {}, 'pairs': {}}
+    return _cache[railways]
+
+
+def station_coordinates(railways, stations):
+    """ This function gives the coordinates of stations, read once per graph.
+
+    The coordinates of a graph are assumed not to change after its first use.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param stations: The UIC codes of the stations
+    :return: The latitudes and longitudes arrays
+    """
+    cache = _graph_cache(railways)
+    ids = np.array([cache['index'][station] for station in stations], dtype=np.int64)
+    return cache['lat'][ids], cache['long'][ids]
+
+
+def station_distances(railways, stations_a, stations_b):
+    """ This function computes the distances of a batch of station pairs in one call.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param stations_a: The UIC codes of the first stations
+    :param stations_b: The UIC codes of the second stations, as many as stations_a
+    :return: The distances in km
+    """
+    lat_a, long_a = station_coordinates(railways, stations_a)
+    lat_b, long_b = station_coordinates(railways, stations_b)
+    return geodesic(lat_a, long_a, lat_b, long_b)
+
+
+def distance_matrix(railways, sources=None, destinations=None):
+    """ This function computes the distances between every source and destination station.
+
+    Matrices are cached per graph and per station lists, so experiments asking again for the same matrix reuse it.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param sources: The UIC codes of the source stations, all the stations by default
+    :param destinations: The UIC codes of the destination stations, the sources by default
+    :return: The distance matrix in km, one row per source
+    """
+    cache = _graph_cache(railways)
+    sources = tuple(cache['index'] if sources is None else sources)
+    destinations = sources if destinations is None else tuple(destinations)
+
+    key = (sources, destinations)
+    count('distance_matrix_cache_hits' if key in cache['matrices'] else 'distance_matrix_cache_misses')
+    if key not in cache['matrices']:
+        with stage('distance_matrix', sources=len(sources), destinations=len(destinations)):
+            lat_a, long_a = station_coordinates(railways, sources)
+            lat_b, long_b = station_coordinates(railways, destinations)
+            cache['matrices'][key] = geodesic(lat_a[:, None], long_a[:, None], lat_b[None, :], long_b[None, :])
+    return cache['matrices'][key]
+
+
+def distance_between(railways, station_a, station_b):
+    """ This function gives the distance between two stations, computed once per graph and pair.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param station_a: The UIC code of the first station
+    :param station_b: The UIC code of the second station
+    :return: The distance in km
+    """
+    pairs = _graph_cache(railways)['pairs']
+    key = (station_a, station_b) if station_a <= station_b else (station_b, station_a)
+    if key not in pairs:
+        pairs[key] = float(station_distances(railways, [station_a], [station_b])[0])
+    return pairs[key]
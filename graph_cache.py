@@ -0,0 +1,134 @@
+import glob
+import hashlib
+import os
+
+import networkx as nx
+import numpy as np
+
+from gtfs_reader import MissingTableError, feed_name, read_table, table_files
+from instrumentation import count
+
+CACHE_DIR = "cache"
+CACHE_VERSION = 2  # Bump when the parser output changes, to drop every cached graph
+
+GTFS_TABLES = ["feed_info", "stop_times"]
+
+
+def feed_version(network_path):
+    """ This function reads the version of a GTFS feed.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :return: The feed_version field of feed_info.txt, or an empty string if there is none
+    """
+    try:
+        for chunk in read_table(network_path, 'feed_info'):
+            return chunk.get('feed_version', [''])[0]
+    except MissingTableError:
+        pass
+    return ""
+
+
+def cache_key(network_path, dependencies=()):
+    """ This function computes the cache key of a GTFS feed.
+
+    The key changes whenever the feed version, or the size or modification time of one of the input files (or of
+    the feed archive), changes.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :param dependencies: Other files the parsed graph depends on
+    :return: A hexadecimal key
+    """
+    digest = hashlib.sha1()
+    digest.update(f"{CACHE_VERSION}|{feed_version(network_path)}".encode())
+    for path in table_files(network_path, GTFS_TABLES) + list(dependencies):
+        try:
+            stat = os.stat(path)
+            digest.update(f"|{path}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+        except FileNotFoundError:
+            digest.update(f"|{path}|missing".encode())
+    return digest.hexdigest()[:16]
+
+
+def combined_key(network_paths):
+    """ This function computes the cache key of a merge of GTFS feeds.
+
+    :param network_paths: The GTFS directories or .zip archives paths, in the order of the merge
+    :return: A hexadecimal key
+    """
+    digest = hashlib.sha1()
+    for network_path in network_paths:
+        digest.update(f"{feed_name(network_path)}|{cache_key(network_path)}|".encode())
+    return digest.hexdigest()[:16]
+
+
+def save_graph(path, G: nx.Graph):
+    """ This function writes a graph, its node attributes and edge weights to a compressed numpy archive.
+
+    Node attributes are stored as strings, one column per attribute, with an empty string when missing.
+
+    :param path: The archive path
+    :param G: The graph
+    """
+    nodes = list(G.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    attributes = sorted({key for _, data in G.nodes(data=True) for key in data})
+
+    columns = {}
+    for key in attributes:
+        columns['node_' + key] = np.array([str(G.nodes[node].get(key, '')) for node in nodes])
+
+    edges = np.array([(index[u], index[v]) for u, v in G.edges()], dtype=np.int32).reshape(-1, 2)
+    travel_times = np.array([data.get('travel_time', 0) for _, _, data in G.edges(data=True)])
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp.npz"
+    np.savez_compressed(temp_path, name=np.array(G.name), nodes=np.array(nodes, dtype=str), edges=edges,
+                        travel_time=travel_times, **columns)
+    os.replace(temp_path, path)  # Never leave a half written archive behind
+
+
+def load_graph(path):
+    """ This function reads a graph written by save_graph.
+
+    :param path: The archive path
+    :return: The graph
+    """
+    with np.load(path) as archive:
+        nodes = archive['nodes'].tolist()
+        G = nx.Graph(name=str(archive['name']))
+        G.add_nodes_from(nodes)
+        for column in archive.files:
+            if column.startswith('node_'):
+                key = column[len('node_'):]
+                for node, value in zip(nodes, archive[column].tolist()):
+                    if value != '':
+                        G.nodes[node][key] = value
+        edges = archive['edges'].tolist()
+        travel_times = archive['travel_time'].tolist()
+    G.add_edges_from((nodes[u], nodes[v], {'travel_time': t}) for (u, v), t in zip(edges, travel_times))
+    return G
+
+
+def cached_graph(network_path, build, dependencies=()):
+    """ This function returns the graph of a GTFS feed, from the on-disk cache when it is up to date.
+
+    Archives of older versions of the same feed are removed when a new one is written.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :param build: A function building the graph of the feed when it is not cached
+    :param dependencies: Other files the parsed graph depends on
+    :return: The graph of the feed
+    """
+    name = feed_name(network_path)
+    path = os.path.join(CACHE_DIR, f"{name}-{cache_key(network_path, dependencies)}.npz")
+
+    if os.path.exists(path):
+        count('graph_cache_hits')
+        return load_graph(path)
+
+    count('graph_cache_misses')
+    G = build()
+    for stale in glob.glob(os.path.join(CACHE_DIR, f"{name}-*.npz")):
+        os.remove(stale)
+    save_graph(path, G)
+    return G
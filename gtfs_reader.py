@@ -0,0 +1,145 @@
+import csv
+import io
+import itertools
+import os
+import zipfile
+from contextlib import contextmanager
+
+from instrumentation import count
+
+CHUNK_SIZE = 100000  # Rows per chunk
+
+
+class MissingTableError(FileNotFoundError):
+    """ Raised when a GTFS feed has no file for a requested table. """
+
+    def __init__(self, feed_path, table):
+        super().__init__(f"The GTFS feed '{feed_path}' has no {table}.txt table")
+        self.feed_path = feed_path
+        self.table = table
+
+
+def feed_name(feed_path):
+    """ This function gives the name of a feed: its directory or archive name, without extension.
+
+    :param feed_path: The GTFS directory or .zip archive path
+    :return: The name of the feed
+    """
+    name = os.path.basename(os.path.normpath(feed_path))
+    return name[:-len('.zip')] if name.endswith('.zip') else name
+
+
+def _zip_member(archive, table):
+    # Tables may be stored at the root of the archive or in a single sub-directory
+    for member in archive.namelist():
+        if member.split('/')[-1] == table + '.txt':
+            return member
+    return None
+
+
+def has_table(feed_path, table):
+    """ This function tells whether a feed has a table.
+
+    :param feed_path: The GTFS directory or .zip archive path
+    :param table: The table name, without the .txt extension
+    :return: True if the table exists
+    """
+    if zipfile.is_zipfile(feed_path):
+        with zipfile.ZipFile(feed_path) as archive:
+            return _zip_member(archive, table) is not None
+    return os.path.isfile(os.path.join(feed_path, table + '.txt'))
+
+
+def table_files(feed_path, tables):
+    """ This function lists the files a feed's tables are read from, e.g. to detect that a feed changed.
+
+    :param feed_path: The GTFS directory or .zip archive path
+    :param tables: The table names
+    :return: The file paths (the archive itself for a zipped feed)
+    """
+    if os.path.isfile(feed_path):
+        return [feed_path]
+    return [os.path.join(feed_path, table + '.txt') for table in tables]
+
+
+@contextmanager
+def open_table(feed_path, table, encoding='utf-8-sig'):
+    """ This function opens a table of a GTFS feed as a text stream, without extracting zipped feeds.
+
+    The default encoding drops the byte order mark some producers write at the start of their files.
+
+    :param feed_path: The GTFS directory or .zip archive path
+    :param table: The table name, without the .txt extension
+    :param encoding: The encoding of the table
+    :return: The text stream
+    """
+    if zipfile.is_zipfile(feed_path):
+        with zipfile.ZipFile(feed_path) as archive:
+            member = _zip_member(archive, table)
+            if member is None:
+                raise MissingTableError(feed_path, table)
+            with archive.open(member) as raw:
+                yield io.TextIOWrapper(raw, encoding=encoding, newline='')
+    else:
+        path = os.path.join(feed_path, table + '.txt')
+        if not os.path.isfile(path):
+            raise MissingTableError(feed_path, table)
+        with open(path, 'r', encoding=encoding, newline='') as file:
+            yield file
+
+
+def read_chunks(file, columns=None, chunk_size=CHUNK_SIZE, delimiter=','):
+    """ This function reads a CSV stream by chunks of rows, as columns of strings.
+
+    Only one chunk is held in memory at a time.
+
+    :param file: The text stream, starting with the header
+    :param columns: The columns to keep, all of them by default
+    :param chunk_size: The number of rows of a chunk
+    :param delimiter: The field delimiter
+    :return: A generator of {column: list of values} chunks
+    """
+    reader = csv.reader(file, delimiter=delimiter)
+    header = [name.strip() for name in next(reader, [])]
+    columns = header if columns is None else columns
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise KeyError(f"Missing columns {missing} in {getattr(file, 'name', 'table')}")
+    positions = [header.index(column) for column in columns]
+
+    while True:
+        rows = list(itertools.islice(reader, chunk_size))
+        if not rows:
+            return
+        count('rows_parsed', len(rows))
+        # Short rows (e.g. trailing empty fields left out) are padded
+        rows = [row + [''] * (len(header) - len(row)) if len(row) < len(header) else row for row in rows]
+        yield {column: [row[position] for row in rows] for column, position in zip(columns, positions)}
+
+
+def read_table(feed_path, table, columns=None, chunk_size=CHUNK_SIZE, encoding='utf-8-sig'):
+    """ This function streams a table of a GTFS feed, from a directory or straight out of a .zip archive.
+
+    :param feed_path: The GTFS directory or .zip archive path
+    :param table: The table name, without the .txt extension
+    :param columns: The columns to keep, all of them by default
+    :param chunk_size: The number of rows of a chunk
+    :param encoding: The encoding of the table
+    :return: A generator of {column: list of values} chunks
+    """
+    with open_table(feed_path, table, encoding) as file:
+        yield from read_chunks(file, columns, chunk_size)
+
+
+def read_csv(path, columns=None, chunk_size=CHUNK_SIZE, delimiter=';', encoding='utf-8-sig'):
+    """ This function streams a CSV file which is not part of a feed, like the SNCF open data files.
+
+    :param path: The file path
+    :param columns: The columns to keep, all of them by default
+    :param chunk_size: The number of rows of a chunk
+    :param delimiter: The field delimiter
+    :param encoding: The encoding of the file
+    :return: A generator of {column: list of values} chunks
+    """
+    with open(path, 'r', encoding=encoding, newline='') as file:
+        yield from read_chunks(file, columns, chunk_size, delimiter)
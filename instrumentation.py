@@ -0,0 +1,222 @@
+import atexit
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+
+TRACE_VARIABLE = "RAILWAYS_TRACE"  # Set to a path prefix (or 1 for DEFAULT_TRACE) to record a trace
+DEFAULT_TRACE = "output/trace"
+
+# Path prefix of the trace files, None while instrumentation is off: every hook then returns at once
+_trace_path = None
+_main_pid = None
+
+# Counters of this process since it started, e.g. rows_parsed or dijkstra_calls
+_counters = {}
+
+# Frames of the running stages of this process, the innermost last
+_stack = []
+
+
+def enabled():
+    return _trace_path is not None
+
+
+def enable(path=DEFAULT_TRACE):
+    """ This function starts recording the stages and counters of this process and of its workers.
+
+    Each stage is appended to <path>.jsonl as it ends, by whichever process ran it. When the process exits, the
+    stages are converted to <path>.trace.json, to load in a timeline viewer (chrome://tracing or Perfetto), and a
+    summary is printed on stderr.
+
+    :param path: The path prefix of the trace files
+    """
+    global _trace_path, _main_pid
+    _trace_path = path
+    if multiprocessing.parent_process() is not None:
+        return  # A spawned worker appends to the trace of its parent
+
+    _main_pid = os.getpid()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    open(path + ".jsonl", 'w').close()
+    atexit.register(finish)
+
+
+def count(name, n=1):
+    """ This function increments a counter, when instrumentation is on.
+
+    :param name: The counter, e.g. 'rows_parsed', 'dijkstra_calls', 'graph_copies' or '<cache>_cache_hits'
+    :param n: The increment
+    """
+    if _trace_path is not None:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def reset_counters():
+    # Forked workers start from the counters of their parent: they count their own work only
+    _counters.clear()
+
+
+def memory_usage():
+    """ This function gives the resident memory of this process, from /proc on Linux, from getrusage elsewhere.
+
+    :return: The current and peak resident set size in bytes, the current one None when unknown
+    """
+    try:
+        with open('/proc/self/status') as file:
+            status = dict(line.split(':', 1) for line in file if ':' in line)
+        return int(status['VmRSS'].split()[0]) * 1024, int(status['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_memory():
+    # Linux resets the peak resident set size of a process written "5" to its clear_refs, returns whether it did
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class stage(contextlib.ContextDecorator):
+    """ A stage of the pipeline, as a context manager or a function decorator, recorded when instrumentation is on.
+
+    A stage records its wall time, the CPU time of its process, the peak resident memory while it ran, and the
+    counters incremented meanwhile. Stages nest: the peak memory of a stage includes that of its inner stages.
+    """
+
+    def __init__(self, name, **details):
+        self.name = name
+        self.details = details
+
+    def __enter__(self):
+        if _trace_path is None:
+            return self
+        _, peak = memory_usage()
+        if _stack:
+            # The peak so far belongs to the enclosing stage, before it is reset for this one
+            _stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+        reset_peak_memory()
+        _stack.append({'stage': self, 'start': time.time(), 'wall': time.perf_counter(), 'cpu': time.process_time(),
+                       'counters': dict(_counters), 'peak': 0})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if _trace_path is None or not _stack or _stack[-1]['stage'] is not self:
+            return False
+        frame = _stack.pop()
+        wall = time.perf_counter() - frame['wall']
+        cpu = time.process_time() - frame['cpu']
+        rss, peak = memory_usage()
+        peak = max(peak, frame['peak'])
+        if _stack:
+            _stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+
+        event = {
+            'name': self.name,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'parent': _stack[-1]['stage'].name if _stack else None,
+            'depth': len(_stack),
+            'start': frame['start'],
+            'wall': wall,
+            'cpu': cpu,
+            'rss': rss,
+            'peak_rss': peak,
+            'counters': {name: value - frame['counters'].get(name, 0) for name, value in _counters.items()
+                         if value != frame['counters'].get(name, 0)},
+            'totals': dict(_counters),
+        }
+        if self.details:
+            event['details'] = self.details
+        if exc_type is not None:
+            event['error'] = exc_type.__name__
+        # One short append per stage: the lines of the worker processes do not interleave
+        with open(_trace_path + ".jsonl", 'a') as file:
+            file.write(json.dumps(event, default=str) + "\n")
+        return False
+
+
+def read_trace(path=DEFAULT_TRACE):
+    """ This function reads the stages of a trace.
+
+    :param path: The path prefix of the trace files
+    :return: The list of stage events, by start time
+    """
+    with open(path + ".jsonl") as file:
+        events = [json.loads(line) for line in file if line.strip()]
+    return sorted(events, key=lambda event: event['start'])
+
+
+def chrome_trace(events):
+    """ This function converts stage events to the Chrome trace event format: a complete event per stage, a counter
+    event per stage end, and the names of the processes.
+
+    :param events: The stage events (see read_trace)
+    :return: The trace, as a JSON serializable dictionary
+    """
+    trace = []
+    for pid in sorted({event['pid'] for event in events}):
+        trace.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                      'args': {'name': 'main' if pid == _main_pid else f'worker {pid}'}})
+    for event in events:
+        start = int(event['start'] * 1e6)
+        args = {'cpu_s': round(event['cpu'], 6), 'peak_rss_mb': round(event['peak_rss'] / 2 ** 20, 1),
+                **event['counters'], **event.get('details', {})}
+        if 'error' in event:
+            args['error'] = event['error']
+        trace.append({'name': event['name'], 'cat': 'stage', 'ph': 'X', 'ts': start,
+                      'dur': max(int(event['wall'] * 1e6), 1), 'pid': event['pid'], 'tid': event['tid'],
+                      'args': args})
+        if event['totals']:
+            trace.append({'name': 'counters', 'ph': 'C', 'ts': start + int(event['wall'] * 1e6),
+                          'pid': event['pid'], 'args': event['totals']})
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+def summary(events):
+    """ This function aggregates the stage events by stage name.
+
+    :param events: The stage events (see read_trace)
+    :return: A list of (name, calls, wall, cpu, peak RSS, counters) tuples, in order of first start
+    """
+    stages = {}
+    for event in events:
+        calls, wall, cpu, peak, counters = stages.get(event['name'], (0, 0.0, 0.0, 0, {}))
+        for name, value in event['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+        stages[event['name']] = (calls + 1, wall + event['wall'], cpu + event['cpu'], max(peak, event['peak_rss']),
+                                 counters)
+    return [(name, *values) for name, values in stages.items()]
+
+
+def print_summary(rows, file=sys.stderr):
+    print("{:<40s} | {:>6s} | {:>10s} | {:>10s} | {:>9s} | {}".format(
+        'Stage', 'Calls', 'Wall', 'CPU', 'Peak RSS', 'Counters'), file=file)
+    for name, calls, wall, cpu, peak, counters in rows:
+        print("{:<40s} | {:>6,d} | {:>9.3f}s | {:>9.3f}s | {:>6,.0f} MB | {}".format(
+            name, calls, wall, cpu, peak / 2 ** 20, ", ".join(f"{key}={value:,}" for key, value in counters.items())),
+            file=file)
+
+
+def finish():
+    """ This function writes the Chrome trace and prints the summary of the trace, once the traced process is done.
+    """
+    if _trace_path is None or os.getpid() != _main_pid:
+        return
+    events = read_trace(_trace_path)
+    with open(_trace_path + ".trace.json", 'w') as file:
+        json.dump(chrome_trace(events), file)
+    print_summary(summary(events))
+    print(f"Trace written to {_trace_path}.jsonl and {_trace_path}.trace.json", file=sys.stderr)
+
+
+if os.environ.get(TRACE_VARIABLE):
+    enable(DEFAULT_TRACE if os.environ[TRACE_VARIABLE] == '1' else os.environ[TRACE_VARIABLE])
@@ -1,13 +1,210 @@
+import argparse
+import functools
+import os
+import sys
+
+import matplotlib
 import networkx as nx
-from prettytable import PrettyTable
-import parser_GTFS as gtfs
-import analysis
-import visualization
-import transnet_generator as transnet
-from datetime import datetime
-
-railways = gtfs.parse_railways('dataset')
-
-analysis.tops(railways, nx.betweenness_centrality(railways), 'betweenness_centrality')
-# visualization.draw_network(railways)
-# transnet.generate_graph(["dataset/french_high_speed_network_GTFS", "dataset/french_inter_city_network_GTFS", "dataset/french_regional_networks_GTFS"], "output/test.gml", output_format="gml")
+import numpy as np
+import seaborn as sns
+from matplotlib import pyplot as plt
+
+import graph_cache
+import structure_analysis
+from analysis import NEW_LINE_CITIES, STATIONS_BY_CITY, find_best_lines_to_build, \
+    shortest_travel_time_between_major_stations, stations_in_railways, travellers_by_city
+from centrality import betweenness
+from gtfs_reader import table_files
+from instrumentation import DEFAULT_TRACE, TRACE_VARIABLE, enable
+from parser_GTFS import HIGH_SPEED, INTER_CITY, NETWORKS, REGIONAL, merge_layers, network_layer
+from pipeline import Pipeline, PipelineError, Step, file_fingerprint
+from stations import FREQUENTATION_PATH, LIST_STATIONS_PATH, station_index
+from what_if import LINE_DISTANCE_BAND
+
+FEEDS = {'high_speed': HIGH_SPEED, 'inter_city': INTER_CITY, 'regional': REGIONAL}
+
+# Experiments are named groups of target steps
+EXPERIMENTS = {
+    'structure': ['info_railways', 'info_high_speed', 'info_inter_city', 'info_regional'],
+    'centrality': ['central_stations'],
+    'k_core': ['k_core'],
+    'degrees': ['degree_distribution'],
+    'travel_times': ['travel_time_plots_top10'],
+    'new_lines': ['best_lines'],
+}
+
+
+def load_feed(dataset_path, network):
+    return network_layer(dataset_path, network)
+
+
+def load_stations(dataset_path):
+    return station_index(dataset_path, NETWORKS)
+
+
+def station_files(dataset_path):
+    """ This function lists the files the station index of a dataset is read from.
+
+    :param dataset_path: The dataset path where GTFS files are stored
+    :return: The file paths
+    """
+    paths = [path for network in NETWORKS for path in table_files(dataset_path + "/" + network, ['stops'])]
+    return paths + [os.path.join(dataset_path, os.path.basename(FREQUENTATION_PATH)),
+                    os.path.join(dataset_path, os.path.basename(LIST_STATIONS_PATH))]
+
+
+def build_railways(stations, *layers):
+    return merge_layers(layers, stations)
+
+
+def describe(railways, assortativity=False):
+    structure_analysis.info(railways)
+    if assortativity:
+        print("{:>12s} | {:.2f}".format('Assort.', nx.degree_assortativity_coefficient(railways)))
+
+
+def central_stations(railways, betweenness_centrality):
+    structure_analysis.tops(railways, betweenness_centrality, 'betweenness_centrality')
+
+
+def plot_degree_distribution(railways):
+    plt.figure()
+    degrees = structure_analysis.degree_distribution(railways)
+    plt.close()
+    return degrees
+
+
+def weighted_travel_times(travel_times, travellers):
+    return [float(np.average(row, weights=travellers)) for row in travel_times[0]]
+
+
+def best_lines(railways, weighted_travel_time, stations_by_city, from_cities, distance_band, workers=None):
+    cities = [data[1] for data in stations_by_city]
+    return find_best_lines_to_build(railways, from_cities, stations_by_city, cities, weighted_travel_time, workers,
+                                    distance_band)
+
+
+def plot_travel_times_top10(with_high_speed, without_high_speed, stations_by_city):
+    """ This function draws the travel time maps of travel_times_experience_top10.
+
+    :param with_high_speed: The travel times and distances between the cities (see city_travel_time_matrix)
+    :param without_high_speed: The same, without the high speed network
+    :param stations_by_city: The list of (stations, city name) tuples of the matrices
+    """
+    cities = [data[1] for data in stations_by_city]
+    times = np.array(with_high_speed[0])
+    # Convert km/min to km/h
+    speeds = np.divide(np.array(with_high_speed[1]), times) * 60
+    savings = np.array(without_high_speed[0]) - times
+
+    plots = [('travel_time_top_10_cities', sns.heatmap, {'data': times, 'cmap': 'Blues'}),
+             ('travel_time_top_10_cities_normalized', sns.heatmap, {'data': speeds, 'cmap': 'Blues'}),
+             ('average_travel_time_top_10_cities', sns.barplot, {'x': cities, 'y': times.mean(axis=1), 'width': 0.6}),
+             ('time_saving_with_high_speed_top_10_cities', sns.heatmap, {'data': savings, 'cmap': 'Greens'})]
+    for name, plot, arguments in plots:
+        fig, ax = plt.subplots()
+        if plot is sns.heatmap:
+            arguments = dict(arguments, xticklabels=cities, yticklabels=cities)
+        plot(ax=ax, **arguments)
+        fig.savefig(f'output/{name}.svg', format="svg", bbox_inches="tight", pad_inches=0.3)
+        plt.close(fig)
+
+
+def experiments_pipeline(dataset_path='dataset'):
+    """ This function declares the steps of the experiments: load feeds → build graphs → travel time matrices →
+    metrics → plots.
+
+    :param dataset_path: The dataset path where GTFS files are stored
+    :return: The pipeline
+    """
+    pipeline = Pipeline()
+
+    # Load feeds
+    for name, network in FEEDS.items():
+        pipeline.add(Step(f'feed_{name}', load_feed, params={'dataset_path': dataset_path, 'network': network},
+                          fingerprint=functools.partial(graph_cache.cache_key, dataset_path + "/" + network)))
+    pipeline.add(Step('stations', load_stations, params={'dataset_path': dataset_path},
+                      fingerprint=functools.partial(file_fingerprint, station_files(dataset_path))))
+
+    # Build graphs
+    pipeline.add(Step('railways', build_railways, ['stations'] + [f'feed_{name}' for name in FEEDS]))
+    pipeline.add(Step('railways_without_high_speed', build_railways, ['stations', 'feed_inter_city', 'feed_regional']))
+    for name in FEEDS:
+        pipeline.add(Step(f'railways_{name}', build_railways, ['stations', f'feed_{name}']))
+
+    # Cities whose stations are in the graphs, the top 10 ones are compared with and without high speed
+    pipeline.add(Step('stations_by_city_top10', stations_in_railways, ['railways', 'railways_without_high_speed'],
+                      {'stations_by_city': STATIONS_BY_CITY[:10]}))
+    pipeline.add(Step('stations_by_city_top25', stations_in_railways, ['railways'],
+                      {'stations_by_city': STATIONS_BY_CITY}))
+
+    # Travel time matrices
+    pipeline.add(Step('city_travel_times_top10', shortest_travel_time_between_major_stations,
+                      ['railways', 'stations_by_city_top10']))
+    pipeline.add(Step('city_travel_times_top10_without_high_speed', shortest_travel_time_between_major_stations,
+                      ['railways_without_high_speed', 'stations_by_city_top10']))
+    pipeline.add(Step('city_travel_times_top25', shortest_travel_time_between_major_stations,
+                      ['railways', 'stations_by_city_top25']))
+
+    # Metrics
+    pipeline.add(Step('info_railways', describe, ['railways'], {'assortativity': True}))
+    for name in FEEDS:
+        pipeline.add(Step(f'info_{name}', describe, [f'railways_{name}']))
+    pipeline.add(Step('betweenness', betweenness, ['railways'], {'k': 1000, 'seed': 0}, parallel=True))
+    pipeline.add(Step('central_stations', central_stations, ['railways', 'betweenness']))
+    pipeline.add(Step('travellers_top25', travellers_by_city, ['railways', 'stations_by_city_top25']))
+    pipeline.add(Step('weighted_travel_times_top25', weighted_travel_times,
+                      ['city_travel_times_top25', 'travellers_top25']))
+    pipeline.add(Step('best_lines', best_lines, ['railways', 'weighted_travel_times_top25', 'stations_by_city_top25'],
+                      {'from_cities': NEW_LINE_CITIES, 'distance_band': LINE_DISTANCE_BAND},
+                      outputs=['output/new_line_analysis.txt'], parallel=True))
+
+    # Plots
+    pipeline.add(Step('degree_distribution', plot_degree_distribution, ['railways'],
+                      outputs=['output/degree_distribution.svg']))
+    pipeline.add(Step('k_core', structure_analysis.k_core, ['railways'],
+                      outputs=['output/k-core_french_railway_network.svg']))
+    pipeline.add(Step('travel_time_plots_top10', plot_travel_times_top10,
+                      ['city_travel_times_top10', 'city_travel_times_top10_without_high_speed',
+                       'stations_by_city_top10'],
+                      outputs=[f'output/{name}.svg' for name in ['travel_time_top_10_cities',
+                                                                 'travel_time_top_10_cities_normalized',
+                                                                 'average_travel_time_top_10_cities',
+                                                                 'time_saving_with_high_speed_top_10_cities']]))
+    return pipeline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs experiments on the French railways, reusing the results of "
+                                                 "the steps whose inputs did not change")
+    parser.add_argument('targets', nargs='*', default=['centrality'],
+                        help=f"Experiments ({', '.join(EXPERIMENTS)}) or steps to run (default: centrality)")
+    parser.add_argument('--dataset', default='dataset', help="Dataset path where GTFS files are stored")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Number of steps run at the same time (default: all cores)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of processes of the steps running scenario sweeps (default: all cores)")
+    parser.add_argument('--force', nargs='+', default=[], metavar='STEP', help="Steps to run even when cached")
+    parser.add_argument('--list', action='store_true', help="List the experiments and steps, then exit")
+    parser.add_argument('--trace', nargs='?', const=DEFAULT_TRACE, default=None, metavar='PATH',
+                        help="Record the time, memory and counters of each stage to PATH.jsonl and PATH.trace.json "
+                             f"(default: {DEFAULT_TRACE}, or set {TRACE_VARIABLE})")
+    args = parser.parse_args()
+    if args.trace is not None:
+        enable(args.trace)
+
+    pipeline = experiments_pipeline(args.dataset)
+    if args.list:
+        for experiment, targets in EXPERIMENTS.items():
+            print(f"{experiment}: {', '.join(targets)}")
+        print()
+        for step in pipeline.steps.values():
+            print(f"{step.name} <- {', '.join(step.inputs) or args.dataset}")
+    else:
+        matplotlib.use('Agg')
+        os.makedirs('output', exist_ok=True)
+        targets = [name for target in args.targets for name in EXPERIMENTS.get(target, [target])]
+        try:
+            pipeline.run(targets, args.jobs, args.workers, args.force)
+        except PipelineError as error:
+            sys.exit(str(error))
@@ -0,0 +1,252 @@
+import math
+import os
+
+import matplotlib.pyplot as plt
+import networkx as nx
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+from instrumentation import stage
+from scenarios import run_scenarios
+from visualization import FRANCE, basemap, edge_segments, new_map, project
+
+TILE_SIZE = 256  # Pixels
+ZOOMS = range(5, 9)
+
+VIEWER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>French railway network</title>
+<style>
+  html, body { margin: 0; height: 100%%; overflow: hidden; font-family: sans-serif; }
+  #map { position: absolute; inset: 0; cursor: grab; background: #f4f4f4; }
+  #map img { position: absolute; width: 256px; height: 256px; user-select: none; -webkit-user-drag: none; }
+  #zoom { position: absolute; top: 10px; left: 10px; z-index: 1; }
+  #zoom button { display: block; width: 30px; height: 30px; font-size: 18px; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="zoom"><button id="in">+</button><button id="out">-</button></div>
+<script>
+  var MIN_ZOOM = %(min_zoom)d, MAX_ZOOM = %(max_zoom)d, SIZE = 256;
+  var map = document.getElementById('map');
+  // Top left corner of the view, in pixels of the current zoom level
+  var zoom = MIN_ZOOM, left = %(left)f, top = %(top)f;
+
+  function draw() {
+    map.innerHTML = '';
+    var count = Math.pow(2, zoom);
+    for (var x = Math.floor(left / SIZE); x * SIZE < left + map.clientWidth; x++) {
+      for (var y = Math.floor(top / SIZE); y * SIZE < top + map.clientHeight; y++) {
+        if (x < 0 || y < 0 || x >= count || y >= count) continue;
+        var tile = document.createElement('img');
+        tile.src = zoom + '/' + x + '/' + y + '.png';
+        tile.style.left = (x * SIZE - left) + 'px';
+        tile.style.top = (y * SIZE - top) + 'px';
+        tile.onerror = function () { this.style.display = 'none'; };
+        map.appendChild(tile);
+      }
+    }
+  }
+
+  function zoomTo(level, cx, cy) {
+    level = Math.max(MIN_ZOOM, Math.min(MAX_ZOOM, level));
+    var scale = Math.pow(2, level - zoom);
+    left = (left + cx) * scale - cx;
+    top = (top + cy) * scale - cy;
+    zoom = level;
+    draw();
+  }
+
+  var drag = null;
+  map.onmousedown = function (e) { drag = [e.clientX, e.clientY]; map.style.cursor = 'grabbing'; };
+  window.onmouseup = function () { drag = null; map.style.cursor = 'grab'; };
+  window.onmousemove = function (e) {
+    if (!drag) return;
+    left -= e.clientX - drag[0];
+    top -= e.clientY - drag[1];
+    drag = [e.clientX, e.clientY];
+    draw();
+  };
+  map.onwheel = function (e) { e.preventDefault(); zoomTo(zoom + (e.deltaY < 0 ? 1 : -1), e.clientX, e.clientY); };
+  document.getElementById('in').onclick = function () { zoomTo(zoom + 1, map.clientWidth / 2, map.clientHeight / 2); };
+  document.getElementById('out').onclick = function () { zoomTo(zoom - 1, map.clientWidth / 2, map.clientHeight / 2); };
+  window.onresize = draw;
+  draw();
+</script>
+</body>
+</html>
+"""
+
+
+def web_mercator(long, lat):
+    """ This function projects coordinates to the pixels of the world map at zoom level 0 (Web Mercator, as the
+    usual map tiles).
+
+    It is a projection in the sense of visualization.project, and gives the pixels of zoom z once scaled by 2^z.
+
+    :param long: The longitudes, in degrees
+    :param lat: The latitudes, in degrees
+    :return: The x and y pixels, y growing southwards
+    """
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -85.0511, 85.0511)
+    x = (np.asarray(long, dtype=np.float64) + 180) / 360 * TILE_SIZE
+    y = (1 - np.log(np.tan(np.radians(lat)) + 1 / np.cos(np.radians(lat))) / np.pi) / 2 * TILE_SIZE
+    return x, y
+
+
+def tile_range(bounds, zoom):
+    """ This function lists the tiles covering some bounds.
+
+    :param bounds: The (west longitude, south latitude, east longitude, north latitude) bounds
+    :param zoom: The zoom level
+    :return: The ranges of tile x and y
+    """
+    x_min, y_min = web_mercator(bounds[0], bounds[3])
+    x_max, y_max = web_mercator(bounds[2], bounds[1])
+    scale = 2 ** zoom / TILE_SIZE
+    return (range(int(x_min * scale), int(math.ceil(x_max * scale))),
+            range(int(y_min * scale), int(math.ceil(y_max * scale))))
+
+
+def outlines(bounds=FRANCE):
+    """ This function gives the coastlines and borders of a map, in pixels of zoom level 0.
+
+    :param bounds: The bounds of the map (see visualization.basemap)
+    :return: The list of (points, 2) polylines
+    """
+    m = basemap(bounds)
+    fig, _ = new_map(m)  # Drawing loads the borders
+    plt.close(fig)
+    polylines = []
+    for segment in m.coastsegs + m.cntrysegs:
+        xs, ys = np.asarray(segment).T
+        long, lat = m(xs, ys, inverse=True)
+        polylines.append(np.stack(web_mercator(long, lat), axis=1))
+    return polylines
+
+
+def simplify(network: nx.Graph, level, levels):
+    """ This function simplifies the railways for a level of detail: the lower the level, the higher the k-core the
+    stations must belong to.
+
+    :param network: The railways graph
+    :param level: The level of detail, from 0 (coarsest) to levels - 1 (every station)
+    :param levels: The number of levels
+    :return: The simplified railways
+    """
+    cores = nx.core_number(nx.Graph(network.edges()))
+    k = max(cores.values(), default=0)
+    threshold = 0 if levels <= 1 else math.ceil(k * (1 - level / (levels - 1)))
+    return network.subgraph([node for node in network.nodes() if cores.get(node, 0) >= threshold])
+
+
+def merge_segments(segments, resolution=1.0):
+    """ This function merges the segments whose ends fall in the same pixels, and drops those shorter than a pixel.
+
+    :param segments: The (segments, 2, 2) array of segment ends, in pixels
+    :param resolution: The size of a pixel
+    :return: The merged segments and the number of segments merged into each
+    """
+    snapped = np.round(segments / resolution).astype(np.int64).reshape(-1, 4)
+    # Both directions are the same segment
+    swap = (snapped[:, 0] > snapped[:, 2]) | ((snapped[:, 0] == snapped[:, 2]) & (snapped[:, 1] > snapped[:, 3]))
+    snapped[swap] = snapped[swap][:, [2, 3, 0, 1]]
+    keep = (snapped[:, 0] != snapped[:, 2]) | (snapped[:, 1] != snapped[:, 3])
+    merged, counts = np.unique(snapped[keep], axis=0, return_counts=True)
+    return merged.reshape(-1, 2, 2) * resolution, counts
+
+
+def zoom_layers(network: nx.Graph, zooms=ZOOMS):
+    """ This function prepares the edges and stations of each zoom level, in pixels of that level.
+
+    :param network: The railways graph
+    :param zooms: The zoom levels
+    :return: The {zoom: (segments, widths, x, y, sizes)} dictionary
+    """
+    zooms = list(zooms)
+    layers = {}
+    for level, zoom in enumerate(zooms):
+        simplified = simplify(network, level, len(zooms))
+        nodes, x, y = project(web_mercator, simplified)
+        scale = 2 ** zoom
+        segments, counts = merge_segments(edge_segments(simplified, nodes, x * scale, y * scale))
+        travelers = np.array([max(int(simplified.nodes[node].get('travelers_2021', 0)), 0) for node in nodes])
+        sizes = np.clip(np.sqrt(travelers) / 2000 * scale / 2 ** zooms[0], 1, 60)
+        layers[zoom] = (segments, 0.4 + 0.3 * np.log2(counts), x * scale, y * scale, sizes)
+    return layers
+
+
+def render_tile(context, tile):
+    """ This function renders a tile to a PNG file (run in a scenario worker).
+
+    :param context: The layers of every zoom (see zoom_layers), the outlines and the output path
+    :param tile: The (zoom, x, y) of the tile
+    :return: Whether the tile has content and was written
+    """
+    layers, polylines, path = context
+    zoom, tile_x, tile_y = tile
+    segments, widths, x, y, sizes = layers[zoom]
+    left, top = tile_x * TILE_SIZE, tile_y * TILE_SIZE
+    right, bottom = left + TILE_SIZE, top + TILE_SIZE
+
+    # Segments whose bounding box meets the tile, with a margin for the line widths
+    low, high = segments.min(axis=1), segments.max(axis=1)
+    shown = (high[:, 0] >= left - 2) & (low[:, 0] <= right + 2) & (high[:, 1] >= top - 2) & (low[:, 1] <= bottom + 2)
+    located = (x >= left - 30) & (x <= right + 30) & (y >= top - 30) & (y <= bottom + 30)
+    outline = [polyline * 2 ** zoom for polyline in polylines]
+    outline = [polyline for polyline in outline if (polyline[:, 0].max() >= left and polyline[:, 0].min() <= right
+                                                   and polyline[:, 1].max() >= top and polyline[:, 1].min() <= bottom)]
+    if not shown.any() and not located.any() and not outline:
+        return False
+
+    # A figure of its own canvas: rendering tiles neither uses nor changes the pyplot backend of the process
+    fig = Figure(figsize=(1, 1), dpi=TILE_SIZE)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes((0, 0, 1, 1))
+    ax.set_axis_off()
+    ax.set_xlim(left, right)
+    ax.set_ylim(bottom, top)
+    ax.add_collection(LineCollection(outline, colors='k', linewidths=0.5))
+    ax.add_collection(LineCollection(segments[shown], colors='g', alpha=0.6, linewidths=widths[shown]))
+    ax.scatter(x[located], y[located], s=sizes[located], c='r', alpha=0.8, linewidths=0)
+
+    tile_path = os.path.join(path, str(zoom), str(tile_x))
+    os.makedirs(tile_path, exist_ok=True)
+    fig.savefig(os.path.join(tile_path, f"{tile_y}.png"), dpi=TILE_SIZE, transparent=False)
+    return True
+
+
+@stage('export_tiles')
+def export_tiles(network: nx.Graph, path='output/tiles', zooms=ZOOMS, bounds=FRANCE, workers=None):
+    """ This function exports the railways as a pyramid of map tiles, with an HTML page to browse them offline.
+
+    Lower zoom levels only show the stations of higher k-cores, and merge the segments drawn over the same pixels.
+    Tiles are rendered in parallel (see scenarios), those without content are not written.
+
+    :param network: The railways graph
+    :param path: The output directory, index.html is the viewer
+    :param zooms: The zoom levels
+    :param bounds: The (west longitude, south latitude, east longitude, north latitude) of the exported area
+    :param workers: The number of processes, all the cores by default
+    :return: The number of tiles written
+    """
+    zooms = list(zooms)
+    context = (zoom_layers(network, zooms), outlines(bounds), path)
+    tiles = []
+    for zoom in zooms:
+        xs, ys = tile_range(bounds, zoom)
+        tiles += [(zoom, x, y) for x in xs for y in ys]
+
+    written = sum(run_scenarios(render_tile, context, tiles, workers, label='tiles'))
+
+    x, y = web_mercator(bounds[0], bounds[3])
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'index.html'), 'w') as file:
+        file.write(VIEWER % {'min_zoom': zooms[0], 'max_zoom': zooms[-1], 'left': x * 2 ** zooms[0],
+                             'top': y * 2 ** zooms[0]})
+    return written
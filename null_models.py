@@ -0,0 +1,150 @@
+import numpy as np
+
+from compact_graph import CompactGraph, average_clustering, from_edges, hop_distance_sums, to_compact
+from instrumentation import stage
+from scenarios import run_scenarios
+
+
+def pair_from_index(k, n):
+    """ This function maps indexes in [0, n(n - 1) / 2) to the pairs (i, j), i < j, of n nodes, row by row.
+
+    :param k: An array of indexes
+    :param n: The number of nodes
+    :return: The arrays of the i and j of each pair
+    """
+    k = np.asarray(k, dtype=np.int64)
+    i = n - 2 - np.floor(np.sqrt(-8 * k + 4 * n * (n - 1) - 7) / 2 - 0.5).astype(np.int64)
+    j = k + i + 1 - n * (n - 1) // 2 + (n - i) * (n - i - 1) // 2
+    return i, j
+
+
+def erdos_renyi(n, m, seed=None):
+    """ This function generates a G(n, m) random graph.
+
+    The m edges are drawn at once, without replacement, among the n(n - 1) / 2 possible pairs: there is no self-loop
+    nor duplicate and the graph has exactly m edges.
+
+    :param n: The number of nodes
+    :param m: The number of edges
+    :param seed: The seed of the generator
+    :return: The compact random graph
+    """
+    pairs = np.random.default_rng(seed).choice(n * (n - 1) // 2, size=m, replace=False)
+    i, j = pair_from_index(pairs, n)
+    return from_edges(np.arange(n), i, j, name='erdos_renyi')
+
+
+def configuration_model(degrees, seed=None):
+    """ This function generates a random graph with (nearly) the given degree sequence.
+
+    Edge stubs are shuffled and matched in one draw, then self-loops and duplicate edges are erased, which lowers the
+    degree of a few high degree nodes (the erased configuration model). Use double_edge_swap for exact degrees.
+
+    :param degrees: The degree of each node
+    :param seed: The seed of the generator
+    :return: The compact random graph
+    """
+    degrees = np.asarray(degrees, dtype=np.int64)
+    stubs = np.repeat(np.arange(len(degrees)), degrees)
+    if len(stubs) % 2:
+        stubs = stubs[:-1]
+    stubs = np.random.default_rng(seed).permutation(stubs).reshape(-1, 2)
+
+    low = stubs.min(axis=1)
+    high = stubs.max(axis=1)
+    keys = np.unique((low * len(degrees) + high)[low != high])
+    return from_edges(np.arange(len(degrees)), keys // len(degrees), keys % len(degrees), name='configuration_model')
+
+
+def double_edge_swap(C: CompactGraph, swaps_per_edge=10, seed=None):
+    """ This function rewires a graph with double edge swaps, keeping every degree.
+
+    Two edges (a, b) and (c, d) become (a, d) and (c, b), unless that creates a self-loop or an existing edge. The
+    random edge pairs are drawn in one NumPy call.
+
+    :param C: The compact graph
+    :param swaps_per_edge: The number of attempted swaps per edge
+    :param seed: The seed of the generator
+    :return: The compact rewired graph
+    """
+    n = len(C)
+    sources = np.repeat(np.arange(n), C.degree())
+    upper = sources < C.indices
+    u = sources[upper].tolist()
+    v = C.indices[upper].tolist()
+    m = len(u)
+    if m < 2:
+        return from_edges(np.arange(n), u, v, name='double_edge_swap')
+
+    edges = {(a, b) if a < b else (b, a) for a, b in zip(u, v)}
+    generator = np.random.default_rng(seed)
+    first = generator.integers(0, m, swaps_per_edge * m).tolist()
+    second = generator.integers(0, m, swaps_per_edge * m).tolist()
+    flip = generator.integers(0, 2, swaps_per_edge * m).tolist()
+
+    for x, y, f in zip(first, second, flip):
+        a, b = u[x], v[x]
+        c, d = (u[y], v[y]) if f else (v[y], u[y])
+        if x == y or a == d or c == b:
+            continue
+        new_1 = (a, d) if a < d else (d, a)
+        new_2 = (c, b) if c < b else (b, c)
+        if new_1 in edges or new_2 in edges or new_1 == new_2:
+            continue
+        edges.discard((a, b) if a < b else (b, a))
+        edges.discard((c, d) if c < d else (d, c))
+        edges.add(new_1)
+        edges.add(new_2)
+        u[x], v[x] = a, d
+        u[y], v[y] = c, b
+
+    return from_edges(np.arange(n), u, v, name='double_edge_swap')
+
+
+def null_model(model, C: CompactGraph, seed=None):
+    """ This function generates a null model of a graph.
+
+    :param model: 'erdos_renyi' (same number of nodes and edges), 'configuration' (same degrees, erased) or
+        'rewired' (same degrees, by double edge swaps)
+    :param C: The compact graph
+    :param seed: The seed of the generator
+    :return: The compact random graph
+    """
+    if model == 'erdos_renyi':
+        return erdos_renyi(C.number_of_nodes(), C.number_of_edges(), seed)
+    if model == 'configuration':
+        return configuration_model(C.degree(), seed)
+    if model == 'rewired':
+        return double_edge_swap(C, seed=seed)
+    raise ValueError(f"Unknown null model: {model}")
+
+
+def null_model_replicate(context, seed):
+    """ This function measures a null model of the studied graph (run in a scenario worker).
+
+    :param context: The name of the null model and the compact graph
+    :param seed: The seed of the replicate
+    :return: The average clustering and the average shortest path length of the random graph
+    """
+    model, C = context
+    random_graph = null_model(model, C, seed)
+    total, pairs = hop_distance_sums(random_graph)
+    return average_clustering(random_graph), total / pairs
+
+
+@stage('null_model_statistics')
+def null_model_statistics(G, model='erdos_renyi', replicates=10, seed=None, workers=None):
+    """ This function measures replicated null models of a graph, in parallel.
+
+    :param G: The graph, as a NetworkX or compact graph
+    :param model: The null model (see null_model)
+    :param replicates: The number of random graphs
+    :param seed: The seed of the first replicate, the others use the following seeds
+    :param workers: The number of processes, all the cores by default
+    :return: The average clustering and average shortest path length of each replicate, as two arrays
+    """
+    C = G if isinstance(G, CompactGraph) else to_compact(G)
+    seed = np.random.SeedSequence(seed).generate_state(1)[0] if seed is None else seed
+    seeds = [int(seed) + i for i in range(replicates)]
+    results = list(run_scenarios(null_model_replicate, (model, C), seeds, workers, label='null models'))
+    return np.array([c for c, _ in results]), np.array([d for _, d in results])
@@ -1,92 +1,244 @@
+import warnings
+
 import networkx as nx
-from datetime import datetime
+import numpy as np
+
+import graph_cache
+from gtfs_reader import CHUNK_SIZE, MissingTableError, feed_name, read_table
+from instrumentation import count, stage
+from stations import station_index, stop_point_to_code_UIC
+
+HIGH_SPEED = "french_high_speed_network_GTFS"
+INTER_CITY = "french_inter_city_network_GTFS"
+REGIONAL = "french_regional_networks_GTFS"
+NETWORKS = [HIGH_SPEED, INTER_CITY, REGIONAL]
+
+# Seconds of an empty arrival or departure time
+MISSING_TIME = -1
+
+# Graph of each feed parsed by this process, by feed cache key
+_layers = {}
+
+
+def gtfs_times_to_seconds(times):
+    """ This function converts GTFS times to seconds since the start of the service day.
+
+    GTFS times are not wall-clock times: a trip running past midnight keeps counting hours (e.g. "25:10:00"). Stops
+    which are not timepoints may have empty times, they are read as MISSING_TIME.
+
+    :param times: A sequence of "HH:MM:SS" strings
+    :return: An int64 array of seconds, MISSING_TIME for the empty times
+    """
+    times = np.char.strip(np.asarray(times, dtype=str))
+    seconds = np.full(len(times), MISSING_TIME, dtype=np.int64)
+    given = times != ''
+    if given.any():
+        hms = np.array(':'.join(times[given].tolist()).split(':'), dtype=np.int64).reshape(-1, 3)
+        seconds[given] = hms @ np.array([3600, 60, 1], dtype=np.int64)
+    return seconds
+
+
+def stop_time_chunks(network_path, codes_UIC, trips=None, chunk_size=CHUNK_SIZE):
+    """ This function streams the stop_times table of a GTFS feed as chunks of typed columns.
+
+    Trip ids and UIC codes are numbered in order of first appearance, in the given dictionaries, so that the numbers
+    are consistent from one chunk to the next.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :param codes_UIC: The {UIC code: index} dictionary, filled while reading
+    :param trips: The {trip id: index} dictionary, filled while reading
+    :param chunk_size: The number of rows of a chunk
+    :return: A generator of (trip index, UIC code index, arrival seconds, departure seconds) arrays
+    """
+    trips = {} if trips is None else trips
+    columns = ['trip_id', 'arrival_time', 'departure_time', 'stop_id']
+    for chunk in read_table(network_path, 'stop_times', columns, chunk_size):
+        yield (np.array([trips.setdefault(trip_id, len(trips)) for trip_id in chunk['trip_id']], dtype=np.int64),
+               np.array([codes_UIC.setdefault(stop_point_to_code_UIC(stop_id), len(codes_UIC))
+                         for stop_id in chunk['stop_id']], dtype=np.int64),
+               gtfs_times_to_seconds(chunk['arrival_time']),
+               gtfs_times_to_seconds(chunk['departure_time']))
+
+
+def compute_edges(trips, stops, arrivals, departures):
+    """ This function computes the travel time between consecutive stops of every trip in one pass.
+
+    The graph is undirected, so (a, b) and (b, a) are the same edge. When several trips serve the same edge,
+    the last one in the file is kept, as the former edge by edge construction did. The connections leaving or
+    reaching a stop without time (MISSING_TIME) are left out.
+
+    :param trips: The trip index of each stop event
+    :param stops: The UIC code index of each stop event
+    :param arrivals: The arrival time of each stop event, in seconds
+    :param departures: The departure time of each stop event, in seconds
+    :return: The source indexes, destination indexes and travel times in minutes of the deduplicated edges
+    """
+    timed = (trips[1:] == trips[:-1]) & (departures[:-1] != MISSING_TIME) & (arrivals[1:] != MISSING_TIME)
+    sources = stops[:-1][timed]
+    destinations = stops[1:][timed]
+    travel_times = (arrivals[1:] - departures[:-1])[timed] // 60
 
+    # Last occurrence wins: search the first occurrence in the reversed arrays
+    low = np.minimum(sources, destinations)[::-1]
+    high = np.maximum(sources, destinations)[::-1]
+    keys = low * (int(stops.max(initial=0)) + 1) + high
+    _, first = np.unique(keys, return_index=True)
+    last = np.sort(len(keys) - 1 - first)
 
-def stop_point_to_code_UIC(stop_point):
-    return stop_point.split('-')[1]
+    return sources[last], destinations[last], travel_times[last]
 
 
-def parse_stops(network_path, railways: nx.Graph):
-    """ This function is used to add stations attributes.
+def add_stop_times(network_path, railways: nx.Graph, chunk_size=CHUNK_SIZE):
+    """ This function adds the stations and the connections of a GTFS feed to the railways graph.
 
-    :param network_path: The GTFS directory path
+    The stop_times table is streamed by chunks, so memory depends on the number of stations and connections only,
+    not on the size of the table.
+
+    :param network_path: The GTFS directory or .zip archive path
     :param railways: The railways graph
+    :param chunk_size: The number of rows of a chunk
+    """
+    codes_UIC = {}
+    trip_ids = {}
+    edges = {}
+    previous = None  # The last stop event of the previous chunk, its trip may go on in the next one
+    for chunk in stop_time_chunks(network_path, codes_UIC, trip_ids, chunk_size):
+        if previous is not None:
+            chunk = [np.concatenate([[p], column]) for p, column in zip(previous, chunk)]
+        sources, destinations, travel_times = compute_edges(*chunk)
+        # Chunks come in file order: the last trip of an edge still wins
+        for a, b, t in zip(sources.tolist(), destinations.tolist(), travel_times.tolist()):
+            edges[(a, b) if a < b else (b, a)] = (a, b, t)
+        previous = [column[-1] for column in chunk]
+
+    # Stations in order of first appearance
+    codes_UIC = list(codes_UIC)
+    railways.add_nodes_from(codes_UIC)
+    railways.add_edges_from((codes_UIC[b], codes_UIC[a], {'travel_time': t}) for a, b, t in edges.values())
+
+
+def parse_network(network_path):
+    """ This function parse the GTFS files of a single feed to a NetworkX graph of its stations and connections.
+
+    Station attributes are set on the merged railways (see parse_railways and stations). A feed without stop_times
+    table (like our regional feed today) gives an empty graph, with a warning.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :return: The graph of the feed
+    """
+    railways = nx.Graph(name=feed_name(network_path))
+    with stage('parse_network', feed=feed_name(network_path)):
+        try:
+            add_stop_times(network_path, railways)
+        except MissingTableError as error:
+            warnings.warn(f"{error}: it adds no station nor connection to the railways")
+    return railways
+
+
+def network_layer(dataset_path, network, use_cache=True):
+    """ This function gives the graph of a single feed, parsing it at most once per process.
+
+    Every edge of the layer records the feed it comes from in its 'network' attribute. The layer is shared: callers
+    must not modify it.
+
+    :param dataset_path: The dataset path where GTFS files are stored
+    :param network: The GTFS directory of the feed
+    :param use_cache: Whether to read and write the on-disk graph cache
+    :return: The graph of the feed
+    """
+    network_path = dataset_path + "/" + network
+    key = (network_path, use_cache, graph_cache.cache_key(network_path))
+
+    count('feed_layer_cache_hits' if key in _layers else 'feed_layer_cache_misses')
+    if key not in _layers:
+        if use_cache:
+            layer = graph_cache.cached_graph(network_path, lambda: parse_network(network_path))
+        else:
+            layer = parse_network(network_path)
+        nx.set_edge_attributes(layer, network, 'network')
+        _layers[key] = layer
+
+    return _layers[key]
+
+
+def railways_key(dataset_path, networks=None, exclude=()):
+    """ This function computes the cache key of the connections of the railways (see graph_cache), to tie results
+    computed from the graph to the feeds it was parsed from.
+
+    :param dataset_path: The dataset path where GTFS files are stored
+    :param networks: The GTFS directories to merge, all of them by default
+    :param exclude: The GTFS directories to leave out
+    :return: A hexadecimal key
     """
+    networks = NETWORKS if networks is None else networks
+    return graph_cache.combined_key([dataset_path + "/" + network for network in networks if network not in exclude])
+
 
-    with open("dataset/frequentation-stations.csv") as file:
-        file.readline()  # Skip header
-        frequentation = {}
-        for line in file:
-            fields = line.split(';')
-            code_UIC = fields[1]
-            travelers_2021 = fields[4]
-            frequentation[code_UIC] = travelers_2021
-
-    with open(network_path + "/stops.txt", 'r', encoding='utf-8') as file:
-        for line in file:
-            fields = line.split(',')
-            stop_id = fields[0]
-            if stop_id.startswith('StopPoint:'):
-                code_UIC = stop_point_to_code_UIC(stop_id)
-                stop_name = fields[1]
-                lat = fields[3]
-                long = fields[4]
-                travelers_2021 = frequentation.get(code_UIC, 1000)
-
-                nx.set_node_attributes(railways, {code_UIC: stop_name}, "stop_name")
-                nx.set_node_attributes(railways, {code_UIC: travelers_2021}, "travelers_2021")
-                nx.set_node_attributes(railways, {code_UIC: lat}, "lat")
-                nx.set_node_attributes(railways, {code_UIC: long}, "long")
-
-
-def parse_railways(dataset_path, networks=None):
+@stage('parse_railways')
+def parse_railways(dataset_path, networks=None, use_cache=True, exclude=()):
     """ This function parse GTFS files to a NetworkX graph.
 
+    Each feed is parsed once per process (see network_layer) and kept in the on-disk cache (see graph_cache), so
+    asking for another combination of feeds only merges the layers already in memory. Station attributes come from
+    the station index of the dataset, also loaded once per process (see stations). The cache key of the railways
+    is kept in railways.graph['cache_key'] (see railways_key).
+
     :param dataset_path: The dataset path where GTFS files are stored
-    :param networks:
+    :param networks: The GTFS directories to merge, all of them by default
+    :param use_cache: Whether to read and write the on-disk graph cache
+    :param exclude: The GTFS directories to leave out, e.g. [HIGH_SPEED] for the network without high speed
     :return: The graph of the railways
     """
 
     if networks is None:
-        networks = ["french_high_speed_network_GTFS", "french_inter_city_network_GTFS", "french_regional_networks_GTFS"]
+        networks = NETWORKS
+
+    layers = [network_layer(dataset_path, network, use_cache) for network in networks if network not in exclude]
+    return merge_layers(layers, station_index(dataset_path, NETWORKS), railways_key(dataset_path, networks, exclude))
+
 
+def merge_layers(layers, stations, cache_key=None):
+    """ This function merges the graphs of some feeds into the railways, and sets the attributes of their stations.
+
+    :param layers: The graphs of the feeds (see network_layer), later feeds overwrite the travel times and source
+                   network of earlier ones
+    :param stations: The station index of the dataset (see stations.station_index)
+    :param cache_key: The cache key of the railways (see railways_key), none by default
+    :return: The graph of the railways
+    """
     railways = nx.Graph(name='railways')
 
-    for network in networks:
-        network_path = dataset_path + "/" + network
-        with open(network_path + "/stop_times.txt", 'r') as file:
-            file.readline()  # Skip header
-            previous_stop_id = None
-            departure_time = None
-            for line in file:
-                fields = line.split(',')
-
-                arrival_time = fields[1]
-                code_UIC = stop_point_to_code_UIC(fields[3])  # Using the UIC code of the station
-                stop_sequence = int(fields[4])
-
-                if stop_sequence == 0:
-                    # This is the starting point of the trip
-                    railways.add_node(code_UIC)
-                else:
-                    # Compute travel time
-                    # --> Check validity
-                    departure_hour = int(departure_time.split(':')[0])
-                    arrival_hour = int(arrival_time.split(':')[0])
-                    if departure_hour > 23 or arrival_hour > 23:
-                        continue
-                    departure = datetime.strptime(departure_time, '%H:%M:%S')
-                    arrival = datetime.strptime(arrival_time, '%H:%M:%S')
-
-                    delta = arrival - departure
-                    travel_time = int(delta.total_seconds() // 60)
-
-                    railways.add_node(code_UIC)
-                    railways.add_edge(code_UIC, previous_stop_id, travel_time=travel_time)
-
-                previous_stop_id = code_UIC
-                departure_time = fields[2]
-
-        parse_stops(network_path, railways)
+    for layer in layers:
+        railways.add_nodes_from(layer.nodes())
+        railways.add_edges_from(layer.edges(data=True))
 
+    stations.attach(railways)
+    if cache_key is not None:
+        railways.graph['cache_key'] = cache_key
     return railways
+
+
+def network_view(railways: nx.Graph, networks):
+    """ This function gives a read-only view of the railways restricted to the edges of some feeds.
+
+    No graph is copied. An edge served by several feeds belongs to the one its travel time comes from (the last
+    merged), use parse_railways for an exact merge of a subset of feeds.
+
+    :param railways: The railways graph
+    :param networks: The GTFS directories to keep
+    :return: The view of the railways
+    """
+    networks = set(networks)
+    return nx.subgraph_view(railways, filter_edge=lambda u, v: railways[u][v].get('network') in networks)
+
+
+def edges_by_network(railways: nx.Graph):
+    """ This function counts the edges of the railways by source feed.
+
+    :param railways: The railways graph
+    :return: The number of edges for each GTFS directory
+    """
+    count = {}
+    for _, _, network in railways.edges(data='network'):
+        count[network] = count.get(network, 0) + 1
+    return count
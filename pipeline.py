@@ -0,0 +1,381 @@
+import concurrent.futures
+import contextlib
+import glob
+import hashlib
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+import traceback
+
+import graph_cache
+from instrumentation import count, stage
+
+PIPELINE_DIR = os.path.join(graph_cache.CACHE_DIR, "pipeline")
+PIPELINE_VERSION = 1  # Bump when the records or artifacts change format, to run every step again
+
+
+def file_fingerprint(paths):
+    """ This function summarizes the size and modification time of some input files, as graph_cache.cache_key does.
+
+    :param paths: The file paths
+    :return: A hexadecimal fingerprint
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            digest.update(f"|{path}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+        except FileNotFoundError:
+            digest.update(f"|{path}|missing".encode())
+    return digest.hexdigest()[:16]
+
+
+def file_hash(path):
+    """ This function hashes the content of a file.
+
+    :param path: The file path
+    :return: A hexadecimal hash
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def code_fingerprint(function):
+    """ This function summarizes the code a function may run: its own source, and the source files of the repository
+    modules of the functions, classes and modules it refers to, with the repository modules they import, transitively.
+
+    :param function: A module level function
+    :return: A hexadecimal fingerprint
+    """
+    repository = os.path.dirname(os.path.abspath(__file__))
+
+    def referred_modules(namespace, values):
+        # The modules of imported functions and classes, and imported modules, from the repository only
+        names = []
+        for value in values:
+            if inspect.ismodule(value):
+                names.append(value.__name__)
+            elif inspect.isroutine(value) or inspect.isclass(value):
+                names.append(getattr(value, '__module__', None))
+        for name in names:
+            path = getattr(sys.modules.get(name), '__file__', None)
+            if path is not None and os.path.dirname(os.path.abspath(path)) == repository:
+                namespace.append(name)
+        return namespace
+
+    # Globals used by the function and by the functions nested in it
+    function = inspect.unwrap(function)
+    used, codes = set(), [function.__code__]
+    while codes:
+        code = codes.pop()
+        used.update(code.co_names)
+        codes += [constant for constant in code.co_consts if inspect.iscode(constant)]
+    stack = referred_modules([], [function.__globals__[name] for name in used if name in function.__globals__])
+
+    modules = set()
+    while stack:
+        name = stack.pop()
+        if name not in modules:
+            modules.add(name)
+            stack = referred_modules(stack, vars(sys.modules[name]).values())
+
+    digest = hashlib.sha1(inspect.getsource(function).encode())
+    for path in sorted(os.path.abspath(sys.modules[name].__file__) for name in modules):
+        digest.update(f"|{os.path.basename(path)}={file_hash(path)}".encode())
+    return digest.hexdigest()[:16]
+
+
+def artifact_path(content, directory=PIPELINE_DIR):
+    return os.path.join(directory, "artifacts", f"{content}.pkl")
+
+
+def store_artifact(value, directory=PIPELINE_DIR):
+    """ This function writes the result of a step to the artifact store, under the hash of its content.
+
+    :param value: The result, any picklable object
+    :param directory: The pipeline cache directory
+    :return: The hexadecimal content hash
+    """
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    content = hashlib.sha1(data).hexdigest()[:16]
+    path = artifact_path(content, directory)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)  # Never leave a half written artifact behind
+    return content
+
+
+def load_artifact(content, directory=PIPELINE_DIR):
+    """ This function reads a result from the artifact store.
+
+    :param content: The content hash given by store_artifact
+    :param directory: The pipeline cache directory
+    :return: The result
+    """
+    with open(artifact_path(content, directory), 'rb') as file:
+        return pickle.load(file)
+
+
+class PipelineError(Exception):
+    """ Raised when some steps of a pipeline failed, or were skipped because one of their inputs failed. """
+
+    def __init__(self, steps):
+        super().__init__(f"Steps failed or skipped: {', '.join(steps)}")
+        self.steps = steps
+
+
+class Step:
+    """ A stage of an experiment: a module level function of the results of other steps, cached on disk.
+
+    function(*inputs, **params) is called in a worker process with the results of the input steps, in order. The step
+    runs again only when its key changes: its code (see code_fingerprint) or version (to bump when a library it uses
+    changes its results), its parameters, the fingerprint of the files it reads (see file_fingerprint), or the
+    content of one of its inputs. A step giving the same result as before does not make the next ones run again. The
+    files a step writes are listed in outputs: it runs again when one of them is missing or modified. Parallel steps
+    are given the number of processes of their own pool as a workers argument, which is not part of the key.
+    """
+
+    def __init__(self, name, function, inputs=(), params=None, fingerprint=None, outputs=(), version=0,
+                 parallel=False):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.fingerprint = fingerprint
+        self.outputs = list(outputs)
+        self.version = version
+        self.parallel = parallel
+
+    def key(self, contents):
+        """ This function computes the cache key of the step.
+
+        :param contents: The content hashes of the results of the input steps, in order
+        :return: A hexadecimal key
+        """
+        code = f"{self.function.__module__}.{self.function.__qualname__}|{code_fingerprint(self.function)}"
+
+        digest = hashlib.sha1()
+        digest.update(f"{PIPELINE_VERSION}|{self.name}|{self.version}|{code}".encode())
+        digest.update(json.dumps([self.params, self.outputs], sort_keys=True, default=repr).encode())
+        if self.fingerprint is not None:
+            digest.update(f"|{self.fingerprint()}".encode())
+        for name, content in zip(self.inputs, contents):
+            digest.update(f"|{name}={content}".encode())
+        return digest.hexdigest()[:16]
+
+
+def _execute(name, function, contents, params, outputs, directory):
+    """ This function runs a step and stores its result (run in a worker process).
+
+    :return: The record of the run: the content hash of the result, the printed text, the hashes of the output files
+             and the wall time
+    """
+    inputs = [load_artifact(content, directory) for content in contents]
+    printed = io.StringIO()
+    start = time.perf_counter()
+    with stage(name), contextlib.redirect_stdout(printed):
+        value = function(*inputs, **params)
+    wall = time.perf_counter() - start
+
+    missing = [path for path in outputs if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Step '{name}' did not write {', '.join(missing)}")
+    return {'content': store_artifact(value, directory), 'printed': printed.getvalue(),
+            'outputs': {path: file_hash(path) for path in outputs}, 'wall': wall}
+
+
+class Pipeline:
+    """ A DAG of steps, run by Pipeline.run with the results of the previous runs reused from the on-disk cache.
+
+    Each step result is kept in the artifact store under the hash of its content, and each run of a step is recorded
+    under its key (see Step.key). Steps are run in parallel as soon as their inputs are ready.
+    """
+
+    def __init__(self, directory=PIPELINE_DIR):
+        self.directory = directory
+        self.steps = {}
+
+    def add(self, step):
+        """ This function adds a step, after the steps it depends on.
+
+        :param step: The step
+        :return: The step
+        """
+        if step.name in self.steps:
+            raise ValueError(f"Step '{step.name}' is declared twice")
+        unknown = [name for name in step.inputs if name not in self.steps]
+        if unknown:
+            raise KeyError(f"Step '{step.name}' depends on undeclared steps: {', '.join(unknown)}")
+        self.steps[step.name] = step
+        return step
+
+    def dependencies(self, targets):
+        """ This function lists the steps needed by some targets, each after its inputs.
+
+        :param targets: The names of the target steps
+        :return: The steps, in a topological order
+        """
+        needed = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in self.steps:
+                raise KeyError(f"Unknown step '{name}'")
+            if name not in needed:
+                needed.add(name)
+                stack += self.steps[name].inputs
+        # Steps are declared after their inputs (see add)
+        return [step for name, step in self.steps.items() if name in needed]
+
+    def record_path(self, step, key):
+        return os.path.join(self.directory, "steps", f"{step.name}-{key}.json")
+
+    def cached_record(self, step, key):
+        """ This function reads the record of a previous run of a step, if it is still valid.
+
+        :param step: The step
+        :param key: Its current key
+        :return: The record, None when the step must run
+        """
+        try:
+            with open(self.record_path(step, key)) as file:
+                record = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(artifact_path(record['content'], self.directory)):
+            return None
+        for path, content in record['outputs'].items():
+            if not os.path.exists(path) or file_hash(path) != content:
+                return None
+        return record
+
+    def save_record(self, step, key, record):
+        path = self.record_path(step, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Only the latest run of a step is kept, as graph_cache does for the feeds
+        for stale in glob.glob(os.path.join(self.directory, "steps", f"{step.name}-*.json")):
+            os.remove(stale)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(record, file)
+        os.replace(temp_path, path)
+
+    def prune(self):
+        """ This function removes the artifacts no recorded run refers to anymore.
+        """
+        referenced = set()
+        for path in glob.glob(os.path.join(self.directory, "steps", "*.json")):
+            with open(path) as file:
+                referenced.add(json.load(file)['content'])
+        for path in glob.glob(os.path.join(self.directory, "artifacts", "*.pkl")):
+            if os.path.basename(path)[:-len(".pkl")] not in referenced:
+                os.remove(path)
+
+    def run(self, targets, jobs=None, workers=None, force=(), quiet=False):
+        """ This function runs the steps needed by some targets, those whose key changed only.
+
+        What the steps print is replayed when they are cached, and the progress is reported on stderr. When a step
+        fails, the steps not depending on it still run, then a PipelineError is raised.
+
+        :param targets: The names of the target steps
+        :param jobs: The number of steps run at the same time, all the cores by default, 1 to run in this process
+        :param workers: The number of processes of the steps running their own pool, all the cores by default
+        :param force: The names of steps to run even when cached
+        :param quiet: Whether to keep what the steps print for the caller instead of printing it
+        :return: The {step name: (content hash, printed text, whether it was cached)} dictionary of the needed steps
+        """
+        pending = self.dependencies(targets)
+        jobs = min(jobs or os.cpu_count() or 1, len(pending) or 1)
+        results = {}
+        running = {}
+        failed = []
+
+        def finished(step, record, cached):
+            results[step.name] = (record['content'], record['printed'], cached)
+            status = "cached" if cached else f"ran in {record['wall']:.1f}s"
+            print(f"[{step.name}] {status}", file=sys.stderr)
+            if record['printed'] and not quiet:
+                print(record['printed'], end="", flush=True)
+
+        def failure(step, error):
+            failed.append(step.name)
+            print(f"[{step.name}] failed", file=sys.stderr)
+            traceback.print_exception(error)
+
+        if jobs > 1:
+            context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+            executor = concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context)
+        else:
+            executor = None
+
+        try:
+            while pending or running:
+                for step in list(pending):
+                    if any(name in failed for name in step.inputs):
+                        # The independent branches go on, only the steps depending on a failed one are dropped
+                        pending.remove(step)
+                        failed.append(step.name)
+                        print(f"[{step.name}] skipped, an input failed", file=sys.stderr)
+                        continue
+                    if any(name not in results for name in step.inputs):
+                        continue
+                    pending.remove(step)
+                    contents = [results[name][0] for name in step.inputs]
+                    key = step.key(contents)
+
+                    record = None if step.name in force else self.cached_record(step, key)
+                    if record is not None:
+                        count('pipeline_cache_hits')
+                        finished(step, record, True)
+                        continue
+
+                    count('pipeline_cache_misses')
+                    params = dict(step.params, workers=workers) if step.parallel else step.params
+                    task = (step.name, step.function, contents, params, step.outputs, self.directory)
+                    if executor is None:
+                        try:
+                            record = _execute(*task)
+                        except Exception as error:
+                            failure(step, error)
+                            continue
+                        self.save_record(step, key, record)
+                        finished(step, record, False)
+                    else:
+                        running[executor.submit(_execute, *task)] = (step, key)
+
+                if running:
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        step, key = running.pop(future)
+                        if future.exception() is not None:
+                            failure(step, future.exception())
+                            continue
+                        self.save_record(step, key, future.result())
+                        finished(step, future.result(), False)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        self.prune()
+        if failed:
+            raise PipelineError(failed)
+        return results
+
+    def result(self, content):
+        """ This function reads the result of a step.
+
+        :param content: The content hash of the result, as given by run
+        :return: The result
+        """
+        return load_artifact(content, self.directory)
@@ -0,0 +1,168 @@
+import random
+
+import networkx as nx
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from compact_graph import CompactGraph, to_compact, to_networkx
+from instrumentation import count
+
+
+class RobustnessEngine:
+    """ Evaluates the city travel time matrix after removing stations from the railways.
+
+    One shortest path tree is computed per city, from all of its stations. Removing stations can only lengthen paths,
+    and only the paths going through them: after a removal, only the rows of the cities whose tree reaches another
+    city through a removed station are computed again, on the railways without the removed stations.
+    """
+
+    def __init__(self, railways, stations_by_city):
+        self.railways = railways if isinstance(railways, CompactGraph) else to_compact(railways)
+        self.stations_by_city = stations_by_city
+        self.cities = [np.array([self.railways.index[station] for station in data[0]]) for data in stations_by_city]
+        targets = np.concatenate(self.cities)
+
+        n = len(self.railways)
+        self.baseline = np.zeros((len(self.cities), len(self.cities)))
+        self.used = np.zeros((len(self.cities), n), dtype=bool)
+        for i, city in enumerate(self.cities):
+            count('dijkstra_calls')
+            D, predecessors, _ = dijkstra(self.railways.matrix(), directed=True, indices=city, min_only=True,
+                                          return_predecessors=True)
+            self.baseline[i] = self.city_row(D)
+            # Stations on the tree paths towards the stations of every city
+            for node in targets.tolist():
+                while node >= 0 and not self.used[i, node]:
+                    self.used[i, node] = True
+                    node = predecessors[node]
+
+    def city_row(self, D):
+        return np.array([D[city].min() for city in self.cities])
+
+    def city_matrix_without(self, removed_stations):
+        """ This function computes the city travel time matrix of the railways without some stations.
+
+        :param removed_stations: The UIC codes of the removed stations
+        :return: The city travel time matrix, NaN for the cities left without station, inf for disconnected cities
+        """
+        removed = np.array([self.railways.index[station] for station in removed_stations], dtype=np.int64)
+        keep = np.ones(len(self.railways), dtype=bool)
+        keep[removed] = False
+        new_id = np.cumsum(keep) - 1
+        sub_matrix = None
+
+        matrix = self.baseline.copy()
+        alive = np.array([keep[city].any() for city in self.cities])
+        for i in np.flatnonzero(self.used[:, removed].any(axis=1) & alive):
+            if sub_matrix is None:
+                kept = np.flatnonzero(keep)
+                sub_matrix = self.railways.matrix()[kept][:, kept]
+            sources = new_id[self.cities[i][keep[self.cities[i]]]]
+            D = np.full(len(self.railways), np.inf)
+            count('dijkstra_calls')
+            D[keep] = dijkstra(sub_matrix, directed=True, indices=sources, min_only=True)
+            matrix[i] = self.city_row(D)
+
+        matrix[~alive, :] = np.nan
+        matrix[:, ~alive] = np.nan
+        return matrix
+
+    def degradation(self, removed_stations):
+        """ This function measures how much the travel times between the remaining cities increase.
+
+        :param removed_stations: The UIC codes of the removed stations
+        :return: The average increase in minutes over the connected pairs, and the number of disconnected pairs
+        """
+        delta = self.city_matrix_without(removed_stations) - self.baseline
+        remaining = ~np.isnan(delta)
+        disconnected = np.isinf(delta) & remaining
+        connected = remaining & ~disconnected
+        average = float(delta[connected].mean()) if connected.any() else np.nan
+        return average, int(disconnected.sum()) // 2
+
+
+def attack_order(railways, strategy='degree', seed=None, k=None):
+    """ This function orders the stations for an attack (or failure) sequence.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param strategy: 'random', 'degree' or 'betweenness' (travel time weighted)
+    :param seed: The seed of the random order, or of the betweenness pivots
+    :param k: The number of pivots for an approximate betweenness, all the stations by default
+    :return: The UIC codes of the stations, the first removed first
+    """
+    if strategy == 'random':
+        nodes = railways.nodes.tolist() if isinstance(railways, CompactGraph) else list(railways.nodes())
+        random.Random(seed).shuffle(nodes)
+        return nodes
+
+    G = railways if isinstance(railways, nx.Graph) else None
+    if strategy == 'degree':
+        if G is None:
+            order = np.argsort(-railways.degree(), kind='stable')
+            return railways.nodes[order].tolist()
+        return [node for node, _ in sorted(G.degree(), key=lambda item: item[1], reverse=True)]
+
+    if strategy == 'betweenness':
+        if G is None:
+            G = to_networkx(railways)
+        centrality = nx.betweenness_centrality(G, k=k, weight='travel_time', seed=seed)
+        return sorted(centrality, key=centrality.get, reverse=True)
+
+    raise ValueError(f"Unknown attack strategy: {strategy}")
+
+
+def percolation_curve(railways, order):
+    """ This function computes the size of the largest connected component while stations are removed in order.
+
+    The curve is built backwards: stations are added back in reverse order and merged with a union-find, which
+    costs O(m α(n)) for the whole curve instead of one connected components search per removal.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param order: The UIC codes of the removed stations, the first removed first
+    :return: The fraction of the stations in the largest component after removing 0, 1, ..., len(order) stations
+    """
+    C = railways if isinstance(railways, CompactGraph) else to_compact(railways)
+    n = len(C)
+    parent = list(range(n))
+    size = [1] * n
+    present = np.ones(n, dtype=bool)
+
+    removed = [C.index[station] for station in order]
+    present[removed] = False
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i == j:
+            return size[i]
+        if size[i] < size[j]:
+            i, j = j, i
+        parent[j] = i
+        size[i] += size[j]
+        return size[i]
+
+    largest = 0
+    for i in np.flatnonzero(present).tolist():
+        for j in C.neighbors(i).tolist():
+            if present[j]:
+                union(i, j)
+    for i in np.flatnonzero(present).tolist():
+        largest = max(largest, size[find(i)])
+
+    curve = [largest]
+    for i in reversed(removed):
+        present[i] = True
+        largest = max(largest, 1)
+        for j in C.neighbors(i).tolist():
+            if present[j]:
+                largest = max(largest, union(i, j))
+        curve.append(largest)
+
+    return (np.array(curve[::-1]) / n).tolist()
@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import sys
+import time
+
+from instrumentation import reset_counters, stage
+
+# Shared state of the running scenarios: set before the pool starts so forked workers inherit it instead of
+# receiving it with every task
+_context = None
+
+
+def _init_worker(context):
+    global _context
+    _context = context
+    reset_counters()
+
+
+def _call(function, context, scenario):
+    with stage(function.__name__):
+        return function(context, scenario)
+
+
+def _run(task):
+    function, scenario = task
+    return _call(function, _context, scenario)
+
+
+def report_progress(done, total, start, label='scenarios'):
+    """ This function prints the progress and the estimated remaining time of a sweep on stderr.
+
+    :param done: The number of finished scenarios
+    :param total: The number of scenarios
+    :param start: The start time of the sweep, as given by time.perf_counter()
+    :param label: The name of the sweep
+    """
+    elapsed = time.perf_counter() - start
+    eta = elapsed / done * (total - done) if done else 0
+    sys.stderr.write(f"\r[{label}] {done}/{total} - elapsed {elapsed:.1f}s - ETA {eta:.1f}s ")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def run_scenarios(function, context, scenarios, workers=None, label='scenarios', progress=True):
+    """ This function evaluates independent scenarios on a process pool and yields their results in order.
+
+    function(context, scenario) is called for every scenario. The context (graph, distance matrices...) goes to
+    each worker once: inherited at fork time where available, otherwise sent once per worker when it starts.
+
+    :param function: A module level function taking the context and a scenario
+    :param context: The data shared by all the scenarios
+    :param scenarios: The scenarios to evaluate
+    :param workers: The number of processes, all the cores by default, 1 to run in this process
+    :param label: The name of the sweep, for progress reporting
+    :param progress: Whether to report progress and ETA on stderr
+    :return: A generator of the results, in the order of scenarios
+    """
+    global _context
+
+    scenarios = list(scenarios)
+    workers = min(workers or os.cpu_count() or 1, max(len(scenarios), 1))
+    start = time.perf_counter()
+    last_report = [start]
+
+    def progress_made(done):
+        now = time.perf_counter()
+        if progress and (done == len(scenarios) or now - last_report[0] >= 0.5):
+            report_progress(done, len(scenarios), start, label)
+            last_report[0] = now
+
+    if workers == 1:
+        for done, scenario in enumerate(scenarios, 1):
+            yield _call(function, context, scenario)
+            progress_made(done)
+        return
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _context = context
+        pool = multiprocessing.get_context('fork').Pool(workers, initializer=reset_counters)
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(context,))
+
+    try:
+        chunksize = max(1, len(scenarios) // (workers * 8))
+        tasks = ((function, scenario) for scenario in scenarios)
+        for done, result in enumerate(pool.imap(_run, tasks, chunksize=chunksize), 1):
+            yield result
+            progress_made(done)
+    finally:
+        pool.terminate()
+        _context = None
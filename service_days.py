@@ -0,0 +1,326 @@
+import datetime
+import warnings
+
+import networkx as nx
+import numpy as np
+
+from gtfs_reader import MissingTableError, has_table, read_table
+from instrumentation import stage
+from parser_GTFS import MISSING_TIME, NETWORKS, parse_railways, stop_time_chunks
+
+WEEKDAYS = [0, 1, 2, 3, 4]
+WEEKEND = [5, 6]
+
+
+def gtfs_date(date):
+    """ This function formats a date the way GTFS does.
+
+    :param date: A datetime.date, or a "YYYYMMDD" or "YYYY-MM-DD" string
+    :return: The "YYYYMMDD" string
+    """
+    if isinstance(date, (datetime.date, datetime.datetime)):
+        return date.strftime('%Y%m%d')
+    return str(date).replace('-', '')
+
+
+def parse_date(date):
+    """ This function reads a date given as in gtfs_date.
+
+    :param date: A datetime.date, or a "YYYYMMDD" or "YYYY-MM-DD" string
+    :return: The datetime.date
+    """
+    return datetime.datetime.strptime(gtfs_date(date), '%Y%m%d').date()
+
+
+def feed_dates(network_path):
+    """ This function gives the first and last dates of a feed, from feed_info.txt, or from its calendars.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :return: The first and last dates, as datetime.date, None when the feed has no calendar at all
+    """
+    if has_table(network_path, 'feed_info'):
+        for chunk in read_table(network_path, 'feed_info', ['feed_start_date', 'feed_end_date']):
+            if chunk['feed_start_date'][0] and chunk['feed_end_date'][0]:
+                return parse_date(chunk['feed_start_date'][0]), parse_date(chunk['feed_end_date'][0])
+
+    dates = []
+    if has_table(network_path, 'calendar'):
+        for chunk in read_table(network_path, 'calendar', ['start_date', 'end_date']):
+            dates += chunk['start_date'] + chunk['end_date']
+    if has_table(network_path, 'calendar_dates'):
+        for chunk in read_table(network_path, 'calendar_dates', ['date']):
+            dates += [min(chunk['date']), max(chunk['date'])]
+    if not dates:
+        return None
+    return parse_date(min(dates)), parse_date(max(dates))
+
+
+def read_calendar(network_path, start, days):
+    """ This function computes the days each service of a feed runs, from calendar.txt and calendar_dates.txt.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :param start: The first date, as datetime.date
+    :param days: The number of days from the first date
+    :return: The service ids and the (services x days) boolean matrix of the days they run
+    """
+    services = {}
+    rows = []
+
+    def row(service_id):
+        if service_id not in services:
+            services[service_id] = len(services)
+            rows.append(np.zeros(days, dtype=bool))
+        return rows[services[service_id]]
+
+    def day(date):
+        return (parse_date(date) - start).days
+
+    if has_table(network_path, 'calendar'):
+        names = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+        weekdays = np.array([(start + datetime.timedelta(days=d)).weekday() for d in range(days)], dtype=np.int64)
+        for chunk in read_table(network_path, 'calendar', ['service_id', 'start_date', 'end_date'] + names):
+            for i, service_id in enumerate(chunk['service_id']):
+                runs = np.array([chunk[name][i] == '1' for name in names])[weekdays]
+                first, last = max(day(chunk['start_date'][i]), 0), min(day(chunk['end_date'][i]) + 1, days)
+                row(service_id)[first:last] |= runs[first:last]
+
+    if has_table(network_path, 'calendar_dates'):
+        for chunk in read_table(network_path, 'calendar_dates', ['service_id', 'date', 'exception_type']):
+            for service_id, date, exception_type in zip(chunk['service_id'], chunk['date'], chunk['exception_type']):
+                d = day(date)
+                if 0 <= d < days:
+                    row(service_id)[d] = exception_type == '1'
+
+    return list(services), np.array(rows, dtype=bool).reshape(len(rows), days)
+
+
+def trip_services(network_path):
+    """ This function maps the trips of a feed to their service.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :return: The {trip id: service id} dictionary
+    """
+    services = {}
+    for chunk in read_table(network_path, 'trips', ['trip_id', 'service_id']):
+        services.update(zip(chunk['trip_id'], chunk['service_id']))
+    return services
+
+
+def feed_connections(network_path, codes_UIC, trip_ids):
+    """ This function reads the connections of a GTFS feed: each train going from a stop to the next of its trip.
+    The connections leaving or reaching a stop without time are left out.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :param codes_UIC: The {UIC code: index} dictionary, filled while reading
+    :param trip_ids: The {trip id: index} dictionary, filled while reading
+    :return: The departure stations, arrival stations, departure times, arrival times and trip indexes, in the
+        order of stop_times.txt
+    """
+    columns = [[] for _ in range(5)]
+    previous = None
+    for trips, stops, arrivals, departures in stop_time_chunks(network_path, codes_UIC, trip_ids):
+        if previous is not None:
+            trips, stops, arrivals, departures = (np.concatenate([[p], column])
+                                                  for p, column in zip(previous, (trips, stops, arrivals, departures)))
+        timed = (trips[1:] == trips[:-1]) & (departures[:-1] != MISSING_TIME) & (arrivals[1:] != MISSING_TIME)
+        for column, values in zip(columns, (stops[:-1], stops[1:], departures[:-1], arrivals[1:], trips[:-1])):
+            column.append(values[timed])
+        previous = (trips[-1], stops[-1], arrivals[-1], departures[-1])
+
+    return [np.concatenate(column) if column else np.zeros(0, dtype=np.int64) for column in columns]
+
+
+class ServiceIndex:
+    """ The connections of the railways and the days they run, to build the graph of any day without parsing.
+
+    Each service is a bitset over the days of the feeds (from feed_info.txt), each trip is mapped to its service
+    once, and each connection to its trip and to its undirected edge. The graph of a date, of the weekdays or of the
+    weekends is then a mask over these arrays.
+    """
+
+    @stage('service_index')
+    def __init__(self, dataset_path, networks=None, exclude=()):
+        self.dataset_path = dataset_path
+        self.networks = [network for network in (NETWORKS if networks is None else networks) if network not in exclude]
+        self.feed_paths = []
+
+        codes_UIC = {}
+        columns = [[] for _ in range(6)]
+        calendars = []
+        trip_service = []
+        for feed, network in enumerate(self.networks):
+            network_path = dataset_path + "/" + network
+            trip_ids = {}
+            try:
+                connections = feed_connections(network_path, codes_UIC, trip_ids)
+            except MissingTableError as error:
+                warnings.warn(f"{error}: it adds no connection to the service index")
+                continue
+            self.feed_paths.append(network_path)
+            connections[4] = connections[4] + len(trip_service)
+            connections.append(np.full(len(connections[0]), feed, dtype=np.int64))
+            for column, values in zip(columns, connections):
+                column.append(values)
+
+            services = trip_services(network_path)
+            trip_service += [(network_path, services.get(trip_id)) for trip_id in trip_ids]
+            calendars.append((network_path, feed_dates(network_path)))
+
+        self.stations = list(codes_UIC)
+        (self.departure_station, self.arrival_station, self.departure_time, self.arrival_time, self.trip,
+         self.network) = [np.concatenate(column) if column else np.zeros(0, dtype=np.int64) for column in columns]
+
+        # Days of all the feeds
+        ranges = [dates for _, dates in calendars if dates is not None]
+        self.start = min((first for first, _ in ranges), default=datetime.date.today())
+        self.days = (max((last for _, last in ranges), default=self.start) - self.start).days + 1
+
+        service_ids = {}
+        bits = []
+        for network_path, _ in calendars:
+            services, runs = read_calendar(network_path, self.start, self.days)
+            for service_id in services:
+                service_ids[(network_path, service_id)] = len(service_ids)
+            bits.append(runs)
+        self.services = list(service_ids)
+        self.bits = np.packbits(np.concatenate(bits) if bits else np.zeros((0, self.days), dtype=bool), axis=1)
+        # -1 for the trips without known service, which never run on a given date
+        self.trip_service = np.array([service_ids.get(key, -1) for key in trip_service], dtype=np.int64)
+
+        # Undirected edge of each connection
+        low = np.minimum(self.departure_station, self.arrival_station)
+        high = np.maximum(self.departure_station, self.arrival_station)
+        self.edges, self.edge = np.unique(np.stack([low, high], axis=1).reshape(-1, 2), axis=0, return_inverse=True)
+        self.edge = self.edge.ravel()
+
+    def dates(self, weekdays=None):
+        """ This function lists the dates of the feeds.
+
+        :param weekdays: The days of the week to keep (0 for Monday), all of them by default
+        :return: The dates, as datetime.date
+        """
+        dates = [self.start + datetime.timedelta(days=d) for d in range(self.days)]
+        return dates if weekdays is None else [date for date in dates if date.weekday() in weekdays]
+
+    def day_mask(self, dates):
+        """ This function builds the bitset of some dates, packed as the service bitsets.
+
+        :param dates: A date or a list of dates (see gtfs_date)
+        :return: The packed bitset
+        """
+        dates = [dates] if isinstance(dates, (str, datetime.date)) else dates
+        mask = np.zeros(self.days, dtype=bool)
+        for date in dates:
+            d = (parse_date(date) - self.start).days
+            if not 0 <= d < self.days:
+                raise ValueError(f"{gtfs_date(date)} is out of the feeds dates ({gtfs_date(self.start)} to "
+                                 f"{gtfs_date(self.dates()[-1])})")
+            mask[d] = True
+        return np.packbits(mask)
+
+    def running_services(self, dates):
+        """ This function tells which services run on at least one of some dates.
+
+        :param dates: A date or a list of dates (see gtfs_date)
+        :return: A boolean array, by service
+        """
+        return (self.bits & self.day_mask(dates)).any(axis=1)
+
+    def running_trips(self, dates=None):
+        """ This function tells which trips run on at least one of some dates.
+
+        :param dates: A date or a list of dates (see gtfs_date), None for every trip
+        :return: A boolean array, by trip
+        """
+        if dates is None:
+            return np.ones(len(self.trip_service), dtype=bool)
+        services = np.append(self.running_services(dates), False)  # The -1 service never runs
+        return services[self.trip_service]
+
+    def running_connections(self, dates=None):
+        """ This function tells which connections run on at least one of some dates.
+
+        :param dates: A date or a list of dates (see gtfs_date), None for every connection
+        :return: A boolean array, by connection
+        """
+        return self.running_trips(dates)[self.trip]
+
+    def edge_travel_times(self, dates=None):
+        """ This function computes the travel time of the edges on some dates.
+
+        As in the railways graph, the last connection of stop_times.txt (and of the last feed) gives the travel time.
+
+        :param dates: A date or a list of dates (see gtfs_date), None for every connection
+        :return: The travel time in minutes of each edge, and its connection, -1 for the edges not served
+        """
+        running = np.flatnonzero(self.running_connections(dates))
+        last = np.full(len(self.edges), -1, dtype=np.int64)
+        np.maximum.at(last, self.edge[running], running)
+        travel_times = np.full(len(self.edges), -1, dtype=np.int64)
+        served = last >= 0
+        travel_times[served] = (self.arrival_time[last[served]] - self.departure_time[last[served]]) // 60
+        return travel_times, last
+
+    def graph(self, dates=None, railways=None):
+        """ This function builds the railways graph of some dates, with the stations they serve.
+
+        :param dates: A date or a list of dates (see gtfs_date), every trip by default
+        :param railways: The graph the station attributes are taken from, parsed from the same feeds by default
+        :return: The railways graph
+        """
+        if railways is None:
+            railways = parse_railways(self.dataset_path, self.networks)
+        travel_times, last = self.edge_travel_times(dates)
+        served = np.flatnonzero(last >= 0)
+
+        # Stations in order of first appearance among the running connections
+        running = np.flatnonzero(self.running_connections(dates))
+        stops = np.stack([self.departure_station[running], self.arrival_station[running]], axis=1).ravel()
+        _, first = np.unique(stops, return_index=True)
+        stations = [self.stations[i] for i in stops[np.sort(first)].tolist()]
+
+        name = 'railways' if dates is None else gtfs_date(dates) if isinstance(dates, (str, datetime.date)) \
+            else f"railways of {len(dates)} days"
+        G = nx.Graph(name=name)
+        G.add_nodes_from((station, railways.nodes[station]) if station in railways else station
+                         for station in stations)
+        G.add_edges_from((self.stations[a], self.stations[b],
+                          {'travel_time': t, 'network': self.networks[n]})
+                         for a, b, t, n in zip(self.edges[served, 0].tolist(), self.edges[served, 1].tolist(),
+                                               travel_times[served].tolist(), self.network[last[served]].tolist()))
+        return G
+
+    def weekday_graph(self, railways=None):
+        """ This function builds the railways graph of the trips running on at least one weekday.
+
+        :param railways: The graph the station attributes are taken from
+        :return: The railways graph
+        """
+        return self.graph(self.dates(WEEKDAYS), railways)
+
+    def weekend_graph(self, railways=None):
+        """ This function builds the railways graph of the trips running on at least one weekend day.
+
+        :param railways: The graph the station attributes are taken from
+        :return: The railways graph
+        """
+        return self.graph(self.dates(WEEKEND), railways)
+
+    def compare(self, dates_a, dates_b):
+        """ This function compares the edges served on two sets of dates, without building the graphs.
+
+        :param dates_a: A date or a list of dates (see gtfs_date)
+        :param dates_b: A date or a list of dates (see gtfs_date)
+        :return: The UIC code pairs of the edges only served on the first dates, only on the second dates, and
+            served on both with a different travel time
+        """
+        travel_times_a, _ = self.edge_travel_times(dates_a)
+        travel_times_b, _ = self.edge_travel_times(dates_b)
+
+        def pairs(mask):
+            return [(self.stations[a], self.stations[b]) for a, b in self.edges[mask].tolist()]
+
+        both = (travel_times_a >= 0) & (travel_times_b >= 0)
+        return (pairs((travel_times_a >= 0) & (travel_times_b < 0)),
+                pairs((travel_times_a < 0) & (travel_times_b >= 0)),
+                pairs(both & (travel_times_a != travel_times_b)))
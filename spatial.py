@@ -0,0 +1,209 @@
+import networkx as nx
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from compact_graph import CompactGraph
+from geo import geodesic
+from stations import station_travelers
+
+EARTH_RADIUS = 6371.0088  # Mean earth radius in km
+# Margin of the KD-tree queries on the sphere, before the exact geodesic filter on the ellipsoid
+SPHERE_MARGIN = 1.01
+
+
+def unit_vectors(lat, long):
+    """ This function maps coordinates to points of the unit sphere, where straight line distances grow with
+    great-circle distances.
+
+    :param lat: The latitudes, in degrees
+    :param long: The longitudes, in degrees
+    :return: The (n, 3) array of points
+    """
+    phi, lambda_ = np.radians(lat), np.radians(long)
+    return np.stack([np.cos(phi) * np.cos(lambda_), np.cos(phi) * np.sin(lambda_), np.sin(phi)], axis=-1)
+
+
+def chord(distance):
+    # Straight line length, on the unit sphere, of a great-circle distance in km
+    return 2 * np.sin(np.minimum(np.asarray(distance, dtype=np.float64) / (2 * EARTH_RADIUS), np.pi / 2))
+
+
+class SpatialIndex:
+    """ A KD-tree over the coordinates of the stations, for radius, nearest neighbour and distance band queries.
+
+    The tree works on the unit sphere: results are refined with the geodesic distance (see geo), so they are exact.
+    Stations without coordinates are left out.
+    """
+
+    def __init__(self, railways):
+        if isinstance(railways, CompactGraph):
+            codes, lat, long = railways.nodes.tolist(), railways.lat, railways.long
+        else:
+            codes = list(railways.nodes())
+            lat = np.array([float(railways.nodes[node].get('lat', np.nan)) for node in codes])
+            long = np.array([float(railways.nodes[node].get('long', np.nan)) for node in codes])
+        located = ~(np.isnan(lat) | np.isnan(long))
+
+        self.codes = np.asarray(codes, dtype=str)[located]
+        self.index = {code: i for i, code in enumerate(self.codes.tolist())}
+        self.lat = np.asarray(lat, dtype=np.float64)[located]
+        self.long = np.asarray(long, dtype=np.float64)[located]
+        self.tree = cKDTree(unit_vectors(self.lat, self.long))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def within(self, lat, long, radius):
+        """ This function finds the stations within a radius of a point.
+
+        :param lat: The latitude of the point
+        :param long: The longitude of the point
+        :param radius: The radius in km
+        :return: The UIC codes of the stations and their distances in km, the closest first
+        """
+        ids = np.array(self.tree.query_ball_point(unit_vectors(lat, long), chord(radius * SPHERE_MARGIN)),
+                       dtype=np.int64)
+        distances = geodesic(lat, long, self.lat[ids], self.long[ids])
+        order = np.argsort(distances)
+        keep = order[distances[order] <= radius]
+        return self.codes[ids[keep]].tolist(), distances[keep]
+
+    def around(self, station, radius):
+        """ This function finds the stations within a radius of a station, the station included.
+
+        :param station: The UIC code of the station
+        :param radius: The radius in km
+        :return: The UIC codes of the stations and their distances in km, the closest first
+        """
+        i = self.index[station]
+        return self.within(self.lat[i], self.long[i], radius)
+
+    def nearest(self, lat, long, k=1):
+        """ This function finds the k stations closest to a point.
+
+        :param lat: The latitude of the point
+        :param long: The longitude of the point
+        :param k: The number of stations
+        :return: The UIC codes of the stations and their distances in km, the closest first
+        """
+        k = min(k, len(self))
+        # A few more candidates, as the order on the sphere and on the ellipsoid may differ slightly
+        _, ids = self.tree.query(unit_vectors(lat, long), k=min(len(self), k + 4))
+        ids = np.atleast_1d(ids)
+        distances = geodesic(lat, long, self.lat[ids], self.long[ids])
+        order = np.argsort(distances)[:k]
+        return self.codes[ids[order]].tolist(), distances[order]
+
+    def pairs_within(self, radius):
+        """ This function finds all the pairs of stations closer than a radius.
+
+        :param radius: The radius in km
+        :return: The (m, 2) array of station ids (positions in codes), i < j, and their distances in km
+        """
+        pairs = self.tree.query_pairs(chord(radius * SPHERE_MARGIN), output_type='ndarray').reshape(-1, 2)
+        distances = geodesic(self.lat[pairs[:, 0]], self.long[pairs[:, 0]], self.lat[pairs[:, 1]],
+                             self.long[pairs[:, 1]])
+        keep = distances <= radius
+        return pairs[keep], distances[keep]
+
+    def pairs_in_band(self, stations_a, stations_b, min_distance=0, max_distance=np.inf):
+        """ This function finds the pairs of stations of two sets whose distance lies in a band.
+
+        :param stations_a: The UIC codes of the first stations
+        :param stations_b: The UIC codes of the second stations
+        :param min_distance: The minimum distance in km
+        :param max_distance: The maximum distance in km
+        :return: The list of (station_a, station_b, distance) tuples
+        """
+        stations_b = [station for station in stations_b if station in self.index]
+        ids_b = np.array([self.index[station] for station in stations_b], dtype=np.int64)
+        if not len(ids_b):
+            return []
+        tree_b = cKDTree(unit_vectors(self.lat[ids_b], self.long[ids_b]))
+
+        pairs = []
+        radius = chord(max_distance * SPHERE_MARGIN) if np.isfinite(max_distance) else 2.0
+        for station_a in stations_a:
+            if station_a not in self.index:
+                continue
+            i = self.index[station_a]
+            found = np.array(tree_b.query_ball_point(unit_vectors(self.lat[i], self.long[i]), radius),
+                             dtype=np.int64)
+            distances = geodesic(self.lat[i], self.long[i], self.lat[ids_b[found]], self.long[ids_b[found]])
+            for j, distance in zip(found.tolist(), distances.tolist()):
+                if min_distance <= distance <= max_distance:
+                    pairs.append((station_a, stations_b[j], distance))
+        return pairs
+
+
+def group_by_commune(railways: nx.Graph):
+    """ This function groups the stations by commune (see stations), a station without commune on its own.
+
+    Communes are told apart by their department, as several share a name (e.g. Saint-Denis), and named after the
+    commune only.
+
+    :param railways: The railways graph
+    :return: A list of (stations, name) tuples
+    """
+    groups = {}
+    for node, data in railways.nodes(data=True):
+        if data.get('commune'):
+            key, name = (data['commune'], data.get('department')), data['commune']
+        else:
+            key, name = node, data.get('stop_name') or node
+        groups.setdefault(key, (name, []))[1].append(node)
+    return [(stations, name) for name, stations in groups.values()]
+
+
+def group_by_distance(railways, radius=5):
+    """ This function groups the stations closer than a radius, by single linkage: two stations are in the same
+    group when a chain of stations, each closer than the radius to the next, joins them.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param radius: The radius in km
+    :return: A list of (stations, name) tuples, each group named after its busiest station
+    """
+    spatial = SpatialIndex(railways)
+    pairs, _ = spatial.pairs_within(radius)
+    n = len(spatial)
+    adjacency = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, labels = connected_components(adjacency, directed=False)
+
+    groups = {}
+    for code, label in zip(spatial.codes.tolist(), labels.tolist()):
+        groups.setdefault(label, []).append(code)
+
+    def busiest(stations):
+        return max(stations, key=lambda station: station_travelers(railways, station))
+
+    return [(stations, station_name(railways, busiest(stations))) for stations in groups.values()]
+
+
+def station_name(railways, station):
+    if isinstance(railways, CompactGraph):
+        return str(railways.stop_name[railways.index[station]]) or station
+    return railways.nodes[station].get('stop_name', station)
+
+
+def urban_areas(railways, by='commune', radius=5, top=None):
+    """ This function groups the stations into urban areas, as the stations_by_city lists of the experiments.
+
+    :param railways: A network, as a NetworkX graph for the grouping by commune
+    :param by: 'commune' to group by commune, 'distance' to group the stations closer than a radius
+    :param radius: The radius in km of the grouping by distance
+    :param top: The number of urban areas to keep, the busiest first, all of them by default
+    :return: A list of (stations, name) tuples, by decreasing number of travellers
+    """
+    if by == 'commune':
+        groups = group_by_commune(railways)
+    elif by == 'distance':
+        groups = group_by_distance(railways, radius)
+    else:
+        raise ValueError(f"Unknown grouping {by}, expected 'commune' or 'distance'")
+
+    travelers = [sum(station_travelers(railways, station) for station in stations) for stations, _ in groups]
+    order = sorted(range(len(groups)), key=lambda i: -travelers[i])
+    groups = [groups[i] for i in order]
+    return groups if top is None else groups[:top]
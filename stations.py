@@ -0,0 +1,209 @@
+import os
+
+import networkx as nx
+import numpy as np
+
+from compact_graph import CompactGraph
+from gtfs_reader import MissingTableError, read_csv, read_table
+from instrumentation import count, stage
+
+FREQUENTATION_PATH = "dataset/frequentation-stations.csv"
+LIST_STATIONS_PATH = "dataset/list-stations.csv"
+
+MISSING_TRAVELERS = 1000  # Travellers of the stations missing from the frequentation file
+
+# Station index of each dataset loaded by this process, by dataset path
+_indexes = {}
+
+
+def stop_point_to_code_UIC(stop_point):
+    return stop_point.split('-')[1]
+
+
+class StationIndex:
+    """ The stations of all the feeds, joined with the SNCF open data files on their UIC code, as typed columns.
+
+    Station i is codes[i]. Coordinates are NaN and travellers -1 when unknown. travelers[k] holds the travellers
+    of the year years[k].
+    """
+
+    def __init__(self, codes, stop_name, lat, long, years, travelers, commune, department, postal_code):
+        self.codes = np.asarray(codes, dtype=str)
+        self.index = {code: i for i, code in enumerate(self.codes.tolist())}
+        self.stop_name = np.asarray(stop_name, dtype=str)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.long = np.asarray(long, dtype=np.float64)
+        self.years = list(years)
+        self.travelers = np.asarray(travelers, dtype=np.int64).reshape(len(self.years), len(self.codes))
+        self.commune = np.asarray(commune, dtype=str)
+        self.department = np.asarray(department, dtype=str)
+        self.postal_code = np.asarray(postal_code, dtype=str)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def travelers_of(self, year=2021):
+        """ This function gives the travellers of every station on a year.
+
+        :param year: The year
+        :return: The travellers of each station, -1 when unknown
+        """
+        return self.travelers[self.years.index(year)]
+
+    def node_attributes(self, nodes):
+        """ This function gives the attributes of some stations, as expected on the nodes of the railways graph.
+
+        :param nodes: The UIC codes of the stations
+        :return: The {UIC code: {attribute: value}} dictionary, for the stations of the index
+        """
+        attributes = {}
+        travelers = {year: self.travelers_of(year).tolist() for year in self.years}
+        for node in nodes:
+            i = self.index.get(node)
+            if i is None:
+                continue
+            data = {'stop_name': str(self.stop_name[i])}
+            if not np.isnan(self.lat[i]) and not np.isnan(self.long[i]):
+                data['lat'] = float(self.lat[i])
+                data['long'] = float(self.long[i])
+            for year, values in travelers.items():
+                if values[i] >= 0:
+                    data[f'travelers_{year}'] = values[i]
+            data.setdefault('travelers_2021', MISSING_TRAVELERS)
+            if self.commune[i]:
+                data['commune'] = str(self.commune[i])
+                data['department'] = str(self.department[i])
+            if self.postal_code[i]:
+                data['postal_code'] = str(self.postal_code[i])
+            attributes[node] = data
+        return attributes
+
+    @stage('station_attributes')
+    def attach(self, railways: nx.Graph):
+        """ This function sets the attributes of the stations of a railways graph, in one bulk operation.
+
+        :param railways: The railways graph
+        """
+        nx.set_node_attributes(railways, self.node_attributes(railways.nodes()))
+
+
+def read_stops(network_path, stations):
+    """ This function reads the names and coordinates of the stop points of a feed.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :param stations: The {UIC code: (name, lat, long)} dictionary, filled while reading
+    """
+    for chunk in read_table(network_path, 'stops', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon']):
+        for stop_id, stop_name, lat, long in zip(chunk['stop_id'], chunk['stop_name'], chunk['stop_lat'],
+                                                 chunk['stop_lon']):
+            if stop_id.startswith('StopPoint:'):
+                stations[stop_point_to_code_UIC(stop_id)] = (stop_name, float(lat or 'nan'), float(long or 'nan'))
+
+
+def read_frequentation(path=FREQUENTATION_PATH):
+    """ This function reads the travellers of the stations for every year of the frequentation file.
+
+    :param path: The SNCF stations frequentation file
+    :return: The years, and the {UIC code: (postal code, [travellers of each year])} dictionary
+    """
+    frequentation = {}
+    years = None
+    for chunk in read_csv(path):
+        if years is None:
+            years = sorted(int(column.split()[-1]) for column in chunk if column.startswith('Total Voyageurs 2'))
+        columns = [chunk[f'Total Voyageurs {year}'] for year in years]
+        for i, code in enumerate(chunk['Code UIC']):
+            frequentation[code] = (chunk['Code postal'][i], [int(column[i]) if column[i] else -1 for column in columns])
+    return years or [], frequentation
+
+
+def read_list_stations(path=LIST_STATIONS_PATH):
+    """ This function reads the commune, department and coordinates of the stations of the SNCF stations list.
+
+    A station may be listed once per line serving it, the first row is kept.
+
+    :param path: The SNCF stations list file
+    :return: The {UIC code: (commune, department, lat, long)} dictionary
+    """
+    stations = {}
+    for chunk in read_csv(path, ['CODE_UIC', 'COMMUNE', 'DEPARTEMEN', 'Y_WGS84', 'X_WGS84']):
+        for code, commune, department, lat, long in zip(chunk['CODE_UIC'], chunk['COMMUNE'], chunk['DEPARTEMEN'],
+                                                        chunk['Y_WGS84'], chunk['X_WGS84']):
+            if code not in stations:
+                stations[code] = (commune, department, float(lat or 'nan'), float(long or 'nan'))
+    return stations
+
+
+@stage('build_station_index')
+def build_station_index(network_paths, frequentation_path=FREQUENTATION_PATH, list_stations_path=LIST_STATIONS_PATH):
+    """ This function joins the stops of some feeds with the SNCF open data files on their UIC code.
+
+    The stations are those of the feeds. The stations list gives their commune and department, and their
+    coordinates when the feeds have none.
+
+    :param network_paths: The GTFS directories or .zip archives paths
+    :param frequentation_path: The SNCF stations frequentation file
+    :param list_stations_path: The SNCF stations list file
+    :return: The station index
+    """
+    stops = {}
+    for network_path in network_paths:
+        try:
+            read_stops(network_path, stops)
+        except MissingTableError:
+            continue
+    years, frequentation = read_frequentation(frequentation_path)
+    listed = read_list_stations(list_stations_path) if os.path.exists(list_stations_path) else {}
+
+    codes = list(stops)
+    lat = np.array([stops[code][1] for code in codes], dtype=np.float64)
+    long = np.array([stops[code][2] for code in codes], dtype=np.float64)
+    for i, code in enumerate(codes):
+        if code in listed and (np.isnan(lat[i]) or np.isnan(long[i])):
+            lat[i], long[i] = listed[code][2], listed[code][3]
+
+    missing = (None, [-1] * len(years))
+    travelers = np.array([frequentation.get(code, missing)[1] for code in codes], dtype=np.int64)
+    return StationIndex(codes, [stops[code][0] for code in codes], lat, long, years,
+                        travelers.T.reshape(len(years), len(codes)),
+                        [listed[code][0] if code in listed else '' for code in codes],
+                        [listed[code][1] if code in listed else '' for code in codes],
+                        [frequentation.get(code, missing)[0] or '' for code in codes])
+
+
+def station_index(dataset_path, networks):
+    """ This function gives the station index of a dataset, building it at most once per process.
+
+    The SNCF open data files are read from the dataset path.
+
+    :param dataset_path: The dataset path where GTFS files are stored
+    :param networks: The GTFS directories of the feeds
+    :return: The station index
+    """
+    key = (dataset_path, tuple(networks))
+    count('station_index_cache_hits' if key in _indexes else 'station_index_cache_misses')
+    if key not in _indexes:
+        _indexes[key] = build_station_index([dataset_path + "/" + network for network in networks],
+                                            os.path.join(dataset_path, os.path.basename(FREQUENTATION_PATH)),
+                                            os.path.join(dataset_path, os.path.basename(LIST_STATIONS_PATH)))
+    return _indexes[key]
+
+
+def station_travelers(railways, station):
+    """ This function gives the number of travellers of a station in 2021.
+
+    A station missing from the frequentation file counts MISSING_TRAVELERS travellers, as StationIndex.attach sets
+    them on the railways graph.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param station: The UIC code of the station
+    :return: The number of travellers
+    """
+    if isinstance(railways, CompactGraph):
+        travelers = int(railways.travelers[railways.index[station]])
+    else:
+        travelers = int(railways.nodes[station].get('travelers_2021', -1))
+    return travelers if travelers >= 0 else MISSING_TRAVELERS
@@ -7,10 +7,16 @@ import random
 from matplotlib import pyplot as plt
 
 import visualization
-from parser_GTFS import parse_railways
+from centrality import betweenness
+import null_models
+from instrumentation import stage
+from compact_graph import CompactGraph, average_clustering, hop_distance_sums, hop_distances, to_compact, \
+    to_networkx
+from parser_GTFS import parse_railways, HIGH_SPEED, INTER_CITY, REGIONAL
 from geopy.distance import distance
 
 
+@stage('degree_distribution')
 def degree_distribution(G: nx.DiGraph):
     """ This function is used to compute the degree distribution of a given graph
 
@@ -42,9 +48,17 @@ def degree_distribution(G: nx.DiGraph):
     return d
 
 
-def centrality(G):
+@stage('centrality')
+def centrality(G, k=None, seed=None, workers=None):
+    """ This function prints the most central stations.
 
-    BC = nx.betweenness_centrality(G, weight='travel_time')
+    :param G: The railways graph
+    :param k: The number of sampled sources for an approximate betweenness, exact by default
+    :param seed: The seed of the sampling
+    :param workers: The number of processes for the betweenness
+    """
+
+    BC = betweenness(G, k=k, seed=seed, workers=workers)
     CC = nx.closeness_centrality(G, distance='travel_time')
     DC = nx.degree_centrality(G)
     PR = nx.pagerank(G)
@@ -57,6 +71,7 @@ def centrality(G):
     tops(G, PR, label="page_rank")
 
 
+@stage('k_core')
 def k_core(G):
 
     core = nx.k_core(G)
@@ -69,6 +84,10 @@ def k_core(G):
 
 
 def distance(G, i):
+    if isinstance(G, CompactGraph):
+        D = hop_distances(G, G.index[i])
+        return D[np.isfinite(D) & (D > 0)].astype(int).tolist()
+
     D = {}
     Q = deque()
     D[i] = 0
@@ -84,41 +103,60 @@ def distance(G, i):
 
 def distances(G, n=300):
     D = {}
-    for i in G.nodes() if len(G) <= n else random.sample(G.nodes(), n):
+    nodes = G.nodes.tolist() if isinstance(G, CompactGraph) else list(G.nodes())
+    for i in nodes if len(G) <= n else random.sample(nodes, n):
         D[i] = distance(G, i)
     return D
 
 
-def erdos_renyi(n, m):
-    G = nx.MultiGraph()
-    for i in range(n):
-        G.add_node(i)
-    edges = []
-    while len(edges) < m:
-        i = random.randint(0, n - 1)
-        j = random.randint(0, n - 1)
-        if i != j:
-            edges.append((i, j))
-    G.add_edges_from(edges)
-    return G
+def erdos_renyi(n, m, seed=None):
+    """ This function generates a G(n, m) random graph with exactly m edges (see null_models).
+
+    :param n: The number of nodes
+    :param m: The number of edges
+    :param seed: The seed of the generator
+    :return: The random graph
+    """
+    return to_networkx(null_models.erdos_renyi(n, m, seed))
 
 
-def small_world(G: nx.Graph):
+@stage('small_world')
+def small_world(G: nx.Graph, replicates=10, seed=None, workers=None, model='erdos_renyi'):
+    """ This function computes the small world coefficient sigma = (C / C_random) / (D / D_random).
 
-    D = distances(G)
-    D = np.mean([i for d in list(D.values()) for i in d])
+    D is the exact average shortest path length of the graph (batched BFS over all the sources), C_random and
+    D_random are averaged over replicated null models (Erdős–Rényi graphs with as many nodes and edges by default),
+    measured in parallel.
+    The confidence intervals are bootstrapped over the replicates.
+
+    :param G: The railways graph
+    :param replicates: The number of random graphs
+    :param seed: The seed of the random graphs and of the bootstrap
+    :param workers: The number of processes
+    :param model: The null model (see null_models.null_model)
+    :return: sigma, C / C_random and D / D_random, and the 95% confidence interval of each
+    """
+    compact = G if isinstance(G, CompactGraph) else to_compact(G)
 
-    C = nx.average_clustering(G)
+    total, pairs = hop_distance_sums(compact)
+    D = total / pairs
+    C = average_clustering(compact)
 
-    G_random = nx.Graph(erdos_renyi(G.number_of_nodes(), G.number_of_edges()))
+    C_random, D_random = null_models.null_model_statistics(compact, model, replicates, seed, workers)
 
-    D_random = distances(G_random)
-    D_random = np.mean([i for d in list(D_random.values()) for i in d])
+    def ratios(C_random, D_random):
+        with np.errstate(divide='ignore'):
+            clustering_ratio = C / np.mean(C_random)
+            distance_ratio = D / np.mean(D_random)
+        return clustering_ratio / distance_ratio, clustering_ratio, distance_ratio
 
-    C_random = nx.average_clustering(G_random)
+    generator = np.random.default_rng(seed)
+    samples = [generator.integers(0, replicates, replicates) for _ in range(1000)]
+    bootstrap = np.array([ratios(C_random[sample], D_random[sample]) for sample in samples])
+    low, high = np.percentile(bootstrap, [2.5, 97.5], axis=0)
 
-    sigma = (C / C_random) / (D / D_random)
-    return sigma, C / C_random, D / D_random
+    sigma, clustering_ratio, distance_ratio = ratios(C_random, D_random)
+    return sigma, clustering_ratio, distance_ratio, list(zip(low, high))
 
 
 def tops(G, data_dict, label, n=10):
@@ -127,6 +165,7 @@ def tops(G, data_dict, label, n=10):
         print(G.nodes[i]['stop_name'], c)
 
 
+@stage('info')
 def info(G):
     print("{:>12s} | '{:s}'".format('Graph', G.name))
 
@@ -135,6 +174,10 @@ def info(G):
 
     print("{:>12s} | {:,d} ({:,d})".format('Nodes', n, nx.number_of_isolates(G)))
     print("{:>12s} | {:,d} ({:,d})".format('Edges', m, nx.number_of_selfloops(G)))
+    if n == 0:
+        # A feed without stop_times, like our regional feed today, gives an empty graph
+        print()
+        return G
     print("{:>12s} | {:.2f} ({:,d})".format('Degree', 2 * m / n, max([k for _, k in G.degree()])))
 
     if isinstance(G, nx.DiGraph):
@@ -149,32 +192,34 @@ def info(G):
 
     print("{:>12s} | {:.4f}".format('Clustering', nx.average_clustering(G)))
 
-    score = small_world(railways)
-    print("{:>12s} | {:.2f} {:.2f} {:.2f}".format('Small world', score[0], score[1], score[2]))
+    score = small_world(G)
+    print("{:>12s} | {:.2f} [{:.2f}, {:.2f}] {:.2f} [{:.2f}, {:.2f}] {:.2f} [{:.2f}, {:.2f}]".format(
+        'Small world', score[0], *score[3][0], score[1], *score[3][1], score[2], *score[3][2]))
     print()
 
     return G
 
 
-# Complete
-railways = parse_railways('dataset')
-info(railways)
+if __name__ == '__main__':
+    # Complete
+    railways = parse_railways('dataset')
+    info(railways)
 
-score = nx.degree_assortativity_coefficient(railways)
-print("{:>12s} | {:.2f}".format('Assort.', score))
+    score = nx.degree_assortativity_coefficient(railways)
+    print("{:>12s} | {:.2f}".format('Assort.', score))
 
-# degree_distribution(railways)
-# centrality(railways)
-k_core(railways)
+    # degree_distribution(railways)
+    # centrality(railways)
+    k_core(railways)
 
-# High-speed
-railways = parse_railways('dataset', networks=["french_high_speed_network_GTFS"])
-info(railways)
+    # High-speed
+    railways = parse_railways('dataset', networks=[HIGH_SPEED])
+    info(railways)
 
-# Intercity
-railways = parse_railways('dataset', networks=["french_inter_city_network_GTFS"])
-info(railways)
+    # Intercity
+    railways = parse_railways('dataset', networks=[INTER_CITY])
+    info(railways)
 
-# Regional
-railways = parse_railways('dataset', networks=["french_regional_networks_GTFS"])
-info(railways)
+    # Regional
+    railways = parse_railways('dataset', networks=[REGIONAL])
+    info(railways)
@@ -0,0 +1,299 @@
+import math
+import os
+import shutil
+from datetime import date, timedelta
+
+import numpy as np
+
+from parser_GTFS import HIGH_SPEED, INTER_CITY, REGIONAL
+
+GENERATOR_VERSION = 1  # Bump when the generated feeds change, to drop the stored datasets
+SYNTHETIC_DIR = "cache/synthetic"
+
+BOUNDS = (-4.5, 43.0, 7.5, 50.5)  # Area of the stations: west longitude, south latitude, east, north
+FEED_START = date(2023, 5, 7)
+FIRST_CODE_UIC = 80000000
+YEARS = list(range(2021, 2014, -1))
+
+# Shape of each feed of dataset/ at scale 1: stations, routes, trips, services and calendar_dates rows, stops of a
+# route and speed of its trains. As in dataset/, the regional feed has no trips nor stop_times.
+PROFILES = {
+    HIGH_SPEED: {'operator': 'OCETGV INOUI', 'stations': 250, 'routes': 77, 'trips': 3798, 'services': 3798,
+                 'calendar_dates': 6775, 'days': 31, 'stops': 5, 'speed': 220, 'dwell': 4},
+    INTER_CITY: {'operator': 'OCEINTERCITES', 'stations': 163, 'routes': 17, 'trips': 1792, 'services': 1792,
+                 'calendar_dates': 5783, 'days': 91, 'stops': 10, 'speed': 110, 'dwell': 2},
+    REGIONAL: {'operator': 'OCETrain TER', 'stations': 4700, 'routes': 665, 'trips': 0, 'services': 30000,
+               'calendar_dates': 110160, 'days': 91, 'stops': 12, 'speed': 70, 'dwell': 1},
+}
+
+# Stations of the SNCF open data files, as a share of all the stations
+FREQUENTATION_SHARE = 0.63
+LIST_STATIONS_SHARE = 0.81
+
+
+class StationGrid:
+    """ The stations of a synthetic dataset, on a jittered grid over the area of the feeds.
+
+    Station i is on row i // columns and column i % columns. Each feed serves a sub-lattice of the grid, the fewer its
+    stations the wider its step, so that the stations of the high speed feed are also regional stations.
+    """
+
+    def __init__(self, stations, rng):
+        west, south, east, north = BOUNDS
+        ratio = (east - west) * math.cos(math.radians((south + north) / 2)) / (north - south)
+        self.columns = max(1, round(math.sqrt(stations * ratio)))
+        self.rows = max(1, math.ceil(stations / self.columns))
+        n = self.rows * self.columns
+
+        cell = np.arange(n)
+        self.lat = north - (cell // self.columns + rng.uniform(0.1, 0.9, n)) * (north - south) / self.rows
+        self.long = west + (cell % self.columns + rng.uniform(0.1, 0.9, n)) * (east - west) / self.columns
+        self.codes = [str(FIRST_CODE_UIC + i) for i in range(n)]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def step(self, stations):
+        """ This function gives the step of the sub-lattice having about some number of stations.
+
+        :param stations: The number of stations
+        :return: The step, in rows and columns
+        """
+        return max(1, round(math.sqrt(len(self) / max(stations, 1))))
+
+    def sub_lattice(self, step):
+        """ This function lists the stations of a sub-lattice.
+
+        :param step: The step of the sub-lattice
+        :return: The station ids
+        """
+        rows = np.arange(0, self.rows, step)
+        columns = np.arange(0, self.columns, step)
+        return (rows[:, None] * self.columns + columns[None, :]).ravel()
+
+    def distances(self, stations):
+        """ This function gives the distance between consecutive stations of a route, on an equirectangular map.
+
+        :param stations: The station ids of the route
+        :return: The distances in km
+        """
+        lat, long = self.lat[stations], self.long[stations]
+        x = np.radians(np.diff(long)) * np.cos(np.radians((lat[1:] + lat[:-1]) / 2))
+        y = np.radians(np.diff(lat))
+        return 6371.0 * np.hypot(x, y)
+
+
+def random_route(grid, step, stops, rng):
+    """ This function draws the stations of a route, as a walk on a sub-lattice which mostly keeps its direction.
+
+    :param grid: The station grid
+    :param step: The step of the sub-lattice
+    :param stops: The number of stations of the route
+    :param rng: The random generator
+    :return: The station ids, without repetition
+    """
+    rows, columns = math.ceil(grid.rows / step), math.ceil(grid.columns / step)
+    directions = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+    i, j = int(rng.integers(rows)), int(rng.integers(columns))
+    direction = int(rng.integers(8))
+    route = [i * step * grid.columns + j * step]
+    for _ in range(8 * stops):
+        if len(route) == stops:
+            break
+        if rng.random() < 0.3:
+            direction = (direction + int(rng.choice([-1, 1]))) % 8
+        di, dj = directions[direction]
+        if not (0 <= i + di < rows and 0 <= j + dj < columns):
+            direction = (direction + 4) % 8  # Bounce on the edges of the area
+            continue
+        i, j = i + di, j + dj
+        station = i * step * grid.columns + j * step
+        if station not in route:
+            route.append(station)
+    return route
+
+
+def gtfs_times(seconds):
+    """ This function formats seconds since the start of the service day as GTFS times, past 24:00:00 if need be.
+
+    :param seconds: The seconds
+    :return: The "HH:MM:SS" strings
+    """
+    return [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in np.asarray(seconds, dtype=np.int64).tolist()]
+
+
+def write_table(path, header, rows):
+    """ This function writes a table of a GTFS feed, or any CSV file.
+
+    :param path: The file path
+    :param header: The column names
+    :param rows: The rows, as formatted lines
+    """
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        file.write(header + "\n")
+        for start in range(0, len(rows), 100000):
+            file.write("".join(row + "\n" for row in rows[start:start + 100000]))
+
+
+def write_feed(feed_path, grid, profile, scale, rng):
+    """ This function writes a synthetic GTFS feed.
+
+    :param feed_path: The GTFS directory
+    :param grid: The station grid
+    :param profile: The shape of the feed at scale 1 (see PROFILES)
+    :param scale: The size of the feed relative to the profile
+    :param rng: The random generator
+    """
+    def scaled(count):
+        return max(1, round(count * scale)) if count else 0
+
+    os.makedirs(feed_path, exist_ok=True)
+    operator = profile['operator']
+    step = grid.step(scaled(profile['stations']))
+    stations = grid.sub_lattice(step)
+
+    write_table(os.path.join(feed_path, 'agency.txt'), "agency_id,agency_name,agency_url,agency_timezone,agency_lang",
+                ["1187,SNCF,http://www.sncf.com,Europe/Paris,fr"])
+    end = FEED_START + timedelta(days=profile['days'] - 1)
+    write_table(os.path.join(feed_path, 'feed_info.txt'),
+                "feed_id,feed_publisher_name,feed_publisher_url,feed_lang,feed_start_date,feed_end_date,feed_version",
+                [f"0,SNCF_default,http://www.sncf.com,fr,{FEED_START:%Y%m%d},{end:%Y%m%d},synthetic-{scale}"])
+    write_table(os.path.join(feed_path, 'transfers.txt'),
+                "from_stop_id,to_stop_id,transfer_type,min_transfer_time,from_route_id,to_route_id", [])
+
+    stops = []
+    for i in stations.tolist():
+        code, lat, long = grid.codes[i], f"{grid.lat[i]:.7f}", f"{grid.long[i]:.7f}"
+        stops.append(f"StopArea:OCE{code},Station {code},,{lat},{long},,,1,")
+        stops.append(f"StopPoint:{operator}-{code},Station {code},,{lat},{long},,,0,StopArea:OCE{code}")
+    write_table(os.path.join(feed_path, 'stops.txt'),
+                "stop_id,stop_name,stop_desc,stop_lat,stop_lon,zone_id,stop_url,location_type,parent_station", stops)
+
+    routes = [random_route(grid, step, max(2, int(rng.poisson(profile['stops'] - 2)) + 2), rng)
+              for _ in range(scaled(profile['routes']))]
+    write_table(os.path.join(feed_path, 'routes.txt'),
+                "route_id,agency_id,route_short_name,route_long_name,route_desc,route_type,route_url,route_color,"
+                "route_text_color",
+                [f"FR:Line::{k}:,1187,{k},Station {grid.codes[route[0]]} - Station {grid.codes[route[-1]]},,2,,,"
+                 for k, route in enumerate(routes)])
+
+    # Each service runs on a few days evenly spaced from a random first day, drawn for all the services at once
+    services = scaled(profile['services'])
+    days = profile['days']
+    counts = np.full(services, scaled(profile['calendar_dates']) // services)
+    counts[:scaled(profile['calendar_dates']) % services] += 1
+    counts = np.clip(counts, 1, days)
+    gaps = rng.integers(1, np.maximum(days // counts, 1) + 1)
+    service_ids = np.repeat(np.arange(services), counts)
+    ranks = np.arange(len(service_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+    service_days = (np.repeat(rng.integers(0, days, services), counts) + ranks * np.repeat(gaps, counts)) % days
+    order = np.lexsort((service_days, service_ids))
+    day_names = [f"{FEED_START + timedelta(days=day):%Y%m%d}" for day in range(days)]
+    calendar = [f"{service + 1:06d},{day_names[day]},1"
+                for service, day in zip(service_ids[order].tolist(), service_days[order].tolist())]
+    write_table(os.path.join(feed_path, 'calendar_dates.txt'), "service_id,date,exception_type", calendar)
+
+    trips = scaled(profile['trips'])
+    if not trips:
+        return
+
+    # Minutes between the departures from consecutive stations of each route
+    hops = [np.maximum(1, np.round(grid.distances(route) / profile['speed'] * 60)).astype(np.int64) * 60
+            for route in routes]
+    trip_rows = []
+    stop_times = []
+    for k in range(trips):
+        r = k % len(routes)
+        direction = k // len(routes) % 2
+        route = routes[r][::-1] if direction else routes[r]
+        hop = hops[r][::-1] if direction else hops[r]
+        trip_id = f"{operator.replace(' ', '')}:{r}:{k}"
+        trip_rows.append(f"FR:Line::{r}:,{k % services + 1:06d},{trip_id},{k},{direction},{k},")
+
+        dwell = profile['dwell'] * 60
+        departures = int(rng.integers(5 * 60, 21 * 60)) * 60 + np.concatenate([[0], np.cumsum(hop + dwell)])
+        arrivals = departures - dwell
+        arrivals[0] = departures[0]
+        departures[-1] = arrivals[-1]
+        for sequence, (station, arrival, departure) in enumerate(zip(route, gtfs_times(arrivals),
+                                                                     gtfs_times(departures))):
+            stop_times.append(f"{trip_id},{arrival},{departure},StopPoint:{operator}-{grid.codes[station]},"
+                              f"{sequence},,0,0,")
+    write_table(os.path.join(feed_path, 'trips.txt'),
+                "route_id,service_id,trip_id,trip_headsign,direction_id,block_id,shape_id", trip_rows)
+    write_table(os.path.join(feed_path, 'stop_times.txt'),
+                "trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,pickup_type,drop_off_type,"
+                "shape_dist_traveled", stop_times)
+
+
+def write_station_files(dataset_path, grid, rng):
+    """ This function writes synthetic SNCF stations frequentation and stations list files.
+
+    Communes gather the stations of 3 x 3 blocks of the grid, departments those of 30 x 30 blocks.
+
+    :param dataset_path: The dataset directory
+    :param grid: The station grid
+    :param rng: The random generator
+    """
+    n = len(grid)
+    rows, columns = np.arange(n) // grid.columns, np.arange(n) % grid.columns
+    commune = [f"COMMUNE {r}-{c}" for r, c in zip((rows // 3).tolist(), (columns // 3).tolist())]
+    department = [f"DEPARTEMENT {r}-{c}" for r, c in zip((rows // 30).tolist(), (columns // 30).tolist())]
+
+    # Heavy tailed travellers, slowly growing over the years
+    travelers = np.exp(rng.normal(10.5, 2.0, n))[None, :] * np.linspace(1.0, 0.8, len(YEARS))[:, None]
+    travelers = np.round(travelers).astype(np.int64)
+    header = ";".join(["Nom de la gare", "Code UIC", "Code postal", "Segmentation DRG"]
+                      + [f"Total Voyageurs{total} {year}" for year in YEARS for total in ("", " + Non voyageurs")])
+    frequentation = []
+    for i in np.flatnonzero(rng.random(n) < FREQUENTATION_SHARE).tolist():
+        counts = ";".join(f"{travelers[k, i]};{travelers[k, i] * 6 // 5}" for k in range(len(YEARS)))
+        frequentation.append(f"Station {grid.codes[i]};{grid.codes[i]};{10000 + i % 90000:05d};b;{counts}")
+    write_table(os.path.join(dataset_path, 'frequentation-stations.csv'), header, frequentation)
+
+    list_stations = [f"{grid.codes[i]};Station {grid.codes[i]};{commune[i]};{department[i]};"
+                     f"{grid.long[i]:.7f};{grid.lat[i]:.7f}"
+                     for i in np.flatnonzero(rng.random(n) < LIST_STATIONS_SHARE).tolist()]
+    write_table(os.path.join(dataset_path, 'list-stations.csv'), "CODE_UIC;LIBELLE;COMMUNE;DEPARTEMEN;X_WGS84;Y_WGS84",
+                list_stations)
+
+
+def generate_dataset(dataset_path, scale=1, seed=0, profiles=None):
+    """ This function writes a synthetic dataset shaped like dataset/: a GTFS feed per network, with stops, routes,
+    trips, stop_times and calendar_dates, and the SNCF stations files.
+
+    The same scale and seed always give the same files. The stations are shared by the feeds, the routes are walks
+    between neighbouring stations.
+
+    :param dataset_path: The dataset directory
+    :param scale: The size of the dataset relative to dataset/, e.g. 10 for ten times as many stations and trips
+    :param seed: The seed of the generator
+    :param profiles: The {network: profile} shapes of the feeds at scale 1, PROFILES by default
+    :return: The dataset path
+    """
+    profiles = PROFILES if profiles is None else profiles
+    rng = np.random.default_rng(seed)
+    grid = StationGrid(max(round(max(profile['stations'] for profile in profiles.values()) * scale), 1), rng)
+
+    os.makedirs(dataset_path, exist_ok=True)
+    for k, (network, profile) in enumerate(profiles.items()):
+        write_feed(os.path.join(dataset_path, network), grid, profile, scale, np.random.default_rng([seed, k]))
+    write_station_files(dataset_path, grid, np.random.default_rng([seed, len(profiles)]))
+    return dataset_path
+
+
+def synthetic_dataset(scale=1, seed=0, directory=SYNTHETIC_DIR):
+    """ This function gives the synthetic dataset of a scale and seed, generating it on the first call only.
+
+    :param scale: The size of the dataset relative to dataset/
+    :param seed: The seed of the generator
+    :param directory: The directory of the generated datasets
+    :return: The dataset path
+    """
+    dataset_path = os.path.join(directory, f"v{GENERATOR_VERSION}-scale{scale}-seed{seed}")
+    if not os.path.isdir(dataset_path):
+        temp_path = dataset_path + ".tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        generate_dataset(temp_path, scale, seed)
+        os.replace(temp_path, dataset_path)  # Never leave a half written dataset behind
+    return dataset_path
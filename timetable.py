@@ -0,0 +1,189 @@
+from bisect import bisect_right
+
+import numpy as np
+
+from gtfs_reader import has_table, read_table
+from instrumentation import stage
+from parser_GTFS import stop_point_to_code_UIC
+from service_days import ServiceIndex, gtfs_date
+
+CHANGE_TIME = 5 * 60  # Default minimum time to change trains in a station, in seconds
+
+
+def change_times(network_path, codes_UIC, change_time=CHANGE_TIME):
+    """ This function gives the minimum change time of each station, from the transfers.txt in-station records.
+
+    :param network_path: The GTFS directory or .zip archive path
+    :param codes_UIC: The {UIC code: index} dictionary of the stations
+    :param change_time: The change time of the stations without record, in seconds
+    :return: The {station index: change time in seconds} dictionary of the recorded stations
+    """
+    times = {}
+    if not has_table(network_path, 'transfers'):
+        return times
+    for chunk in read_table(network_path, 'transfers', ['from_stop_id', 'to_stop_id', 'min_transfer_time']):
+        for from_stop, to_stop, time in zip(chunk['from_stop_id'], chunk['to_stop_id'], chunk['min_transfer_time']):
+            if '-' not in from_stop or '-' not in to_stop or time == '':
+                continue
+            code_UIC = stop_point_to_code_UIC(from_stop)
+            if code_UIC == stop_point_to_code_UIC(to_stop) and code_UIC in codes_UIC:
+                times[codes_UIC[code_UIC]] = max(times.get(codes_UIC[code_UIC], 0), int(time))
+    return times
+
+
+class Timetable:
+    """ The elementary connections of the trains, sorted by departure time, for the Connection Scan Algorithm.
+
+    A connection is a train going from a station to the next one of its trip, without stop in between. Times are
+    seconds since the start of the service day. Stations are UIC codes, as in the railways graph: changing train
+    within a station, even between two stop points, costs the change time of the station.
+    """
+
+    def __init__(self, stations, departure_station, arrival_station, departure_time, arrival_time, trip,
+                 change_time=None, name=''):
+        self.name = name
+        self.stations = np.asarray(stations, dtype=str)
+        self.index = {station: i for i, station in enumerate(self.stations.tolist())}
+        self.change_time = np.full(len(self.stations), CHANGE_TIME, dtype=np.int64) if change_time is None \
+            else np.asarray(change_time, dtype=np.int64)
+
+        # Ties are broken by arrival time so that the connections of a trip stay in order when they take no time
+        order = np.lexsort((arrival_time, departure_time))
+        self.departure_station = np.asarray(departure_station, dtype=np.int64)[order]
+        self.arrival_station = np.asarray(arrival_station, dtype=np.int64)[order]
+        self.departure_time = np.asarray(departure_time, dtype=np.int64)[order]
+        self.arrival_time = np.asarray(arrival_time, dtype=np.int64)[order]
+        self.trip = np.asarray(trip, dtype=np.int64)[order]
+        self.number_of_trips = int(self.trip.max()) + 1 if len(self.trip) else 0
+
+        # Scanning plain lists is much faster than indexing numpy arrays one item at a time
+        self._connections = list(zip(self.departure_station.tolist(), self.arrival_station.tolist(),
+                                     self.departure_time.tolist(), self.arrival_time.tolist(), self.trip.tolist()))
+        self._departures = self.departure_time.tolist()
+        self._change = self.change_time.tolist()
+
+    def __len__(self):
+        return len(self._connections)
+
+    def earliest_arrivals(self, sources, departure_time=0):
+        """ This function computes the earliest arrival time at every station, leaving from some stations.
+
+        :param sources: The UIC codes of the source stations
+        :param departure_time: The earliest departure time, in seconds
+        :return: The earliest arrival time at each station, in seconds, inf when unreachable
+        """
+        n = len(self.stations)
+        arrival = [np.inf] * n
+        # Time from which a train can be boarded in each station: no change time at the sources
+        ready = [np.inf] * n
+        for station in sources:
+            arrival[self.index[station]] = departure_time
+            ready[self.index[station]] = departure_time
+        boarded = [False] * self.number_of_trips
+
+        change = self._change
+        for a, b, departure, arrival_b, trip in self._connections[bisect_right(self._departures, departure_time - 1):]:
+            if boarded[trip] or ready[a] <= departure:
+                boarded[trip] = True
+                if arrival_b < arrival[b]:
+                    arrival[b] = arrival_b
+                    ready[b] = arrival_b + change[b]
+
+        return np.array(arrival, dtype=np.float64)
+
+    def earliest_arrival(self, source, destination, departure_time=0):
+        """ This function gives the earliest arrival time of a journey between two stations.
+
+        :param source: The UIC code of the source station
+        :param destination: The UIC code of the destination station
+        :param departure_time: The earliest departure time, in seconds
+        :return: The arrival time in seconds, inf when there is no journey
+        """
+        return float(self.earliest_arrivals([source], departure_time)[self.index[destination]])
+
+    def profiles(self, destinations):
+        """ This function computes, for every station, all the journeys of the day towards some stations.
+
+        The connections are scanned once, by decreasing departure time. Only Pareto optimal journeys are kept: a
+        journey leaving later or arriving earlier than every other one.
+
+        :param destinations: The UIC codes of the destination stations
+        :return: For each station, its (departure time, arrival time) journeys, by decreasing departure time
+        """
+        n = len(self.stations)
+        targets = {self.index[station] for station in destinations}
+        # Earliest arrival at the destinations when staying in each trip
+        in_trip = [np.inf] * self.number_of_trips
+        profiles = [[] for _ in range(n)]
+        # Negated departure times of the profiles, increasing, for bisection
+        keys = [[] for _ in range(n)]
+
+        change = self._change
+        for a, b, departure, arrival_b, trip in reversed(self._connections):
+            best = min(arrival_b if b in targets else np.inf, in_trip[trip])
+            # Best journey from b leaving after the change
+            k = bisect_right(keys[b], -(arrival_b + change[b])) - 1
+            if k >= 0 and profiles[b][k][1] < best:
+                best = profiles[b][k][1]
+            in_trip[trip] = best
+
+            if best < np.inf and (not profiles[a] or best < profiles[a][-1][1]):
+                if profiles[a] and profiles[a][-1][0] == departure:
+                    profiles[a][-1] = (departure, best)
+                else:
+                    profiles[a].append((departure, best))
+                    keys[a].append(-departure)
+
+        return profiles
+
+    def profile(self, source, destination):
+        """ This function gives all the Pareto optimal journeys of the day between two stations.
+
+        :param source: The UIC code of the source station
+        :param destination: The UIC code of the destination station
+        :return: The (departure time, arrival time) journeys, by increasing departure time
+        """
+        return self.profiles([destination])[self.index[source]][::-1]
+
+    def shortest_journeys(self, destination):
+        """ This function gives the duration of the fastest journey of the day from every station to another one.
+
+        Waiting times at the changes are included, the wait before the first train is not.
+
+        :param destination: The UIC code of the destination station
+        :return: The duration in seconds from each station, inf when there is no journey
+        """
+        durations = np.array([min((arrival - departure for departure, arrival in profile), default=np.inf)
+                              for profile in self.profiles([destination])], dtype=np.float64)
+        durations[self.index[destination]] = 0
+        return durations
+
+
+@stage('build_timetable')
+def build_timetable(dataset_path, date=None, networks=None, exclude=(), change_time=CHANGE_TIME, index=None):
+    """ This function builds the timetable of the railways from the GTFS feeds.
+
+    Without date, every trip of the feeds runs on the same day, which is as optimistic as the railways graph.
+    Trips of the day before which run past midnight are not included.
+
+    :param dataset_path: The dataset path where GTFS files are stored
+    :param date: The date (see service_days.gtfs_date), all the trips by default
+    :param networks: The GTFS directories to merge, all of them by default
+    :param exclude: The GTFS directories to leave out
+    :param change_time: The minimum time to change trains, in seconds, unless transfers.txt says otherwise
+    :param index: The service index of the feeds, to build the timetables of several dates without parsing
+    :return: The timetable
+    """
+    if index is None:
+        index = ServiceIndex(dataset_path, networks, exclude)
+
+    codes_UIC = {station: i for i, station in enumerate(index.stations)}
+    change = np.full(len(codes_UIC), change_time, dtype=np.int64)
+    for network_path in index.feed_paths:
+        for station, time in change_times(network_path, codes_UIC, change_time).items():
+            change[station] = time
+
+    running = index.running_connections(date)
+    return Timetable(index.stations, index.departure_station[running], index.arrival_station[running],
+                     index.departure_time[running], index.arrival_time[running], index.trip[running],
+                     change_time=change, name=gtfs_date(date) if date is not None else 'timetable')
@@ -0,0 +1,136 @@
+import networkx as nx
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from compact_graph import CompactGraph
+from geo import station_distances
+from instrumentation import count, stage
+
+
+def multi_source_travel_times(railways, sources, all_pairs=None):
+    """ This function runs a single Dijkstra from a set of stations.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param sources: The UIC codes of the source stations
+    :param all_pairs: The all pairs travel time matrix of the railways (see all_pairs), read instead of running
+        Dijkstra when given
+    :return: A function giving, for a UIC code, its shortest travel time from the set (None when unreachable)
+        and the source station it comes from
+    """
+    if all_pairs is not None:
+        rows = all_pairs.rows(sources)
+        nearest = rows.argmin(axis=0)
+        D = rows[nearest, np.arange(rows.shape[1])]
+
+        def reach(station):
+            i = all_pairs.index[station]
+            if not np.isfinite(D[i]):
+                return None, None
+            return float(D[i]), sources[nearest[i]]
+
+        return reach
+
+    if isinstance(railways, CompactGraph):
+        ids = [railways.index[station] for station in sources]
+        count('dijkstra_calls')
+        D, _, origins = dijkstra(railways.matrix(), directed=True, indices=ids, min_only=True,
+                                 return_predecessors=True)
+
+        def reach(station):
+            i = railways.index[station]
+            if not np.isfinite(D[i]):
+                return None, None
+            return float(D[i]), str(railways.nodes[origins[i]])
+
+        return reach
+
+    count('dijkstra_calls')
+    D, paths = nx.multi_source_dijkstra(railways, set(sources), weight='travel_time')
+
+    def reach(station):
+        if station not in D:
+            return None, None
+        return D[station], paths[station][0]
+
+    return reach
+
+
+def timetable_travel_times(timetable, stations):
+    """ This function computes the fastest journey of the day between every pair of some stations.
+
+    :param timetable: The timetable (see timetable.build_timetable)
+    :param stations: The UIC codes of the stations
+    :return: A function giving, for a set of source stations and a destination station, the duration of the
+        fastest journey in minutes (None when there is none) and the source station it comes from
+    """
+    durations = {}
+    for station in set(stations):
+        if station in timetable.index:
+            durations[station] = timetable.shortest_journeys(station) / 60
+
+    def reach(sources, station):
+        best = (None, None)
+        for source in sources:
+            if station == source:
+                return 0, source
+            if station in durations and source in timetable.index:
+                duration = float(durations[station][timetable.index[source]])
+                if np.isfinite(duration) and (best[0] is None or duration < best[0]):
+                    best = (duration, source)
+        return best
+
+    return reach
+
+
+@stage('city_travel_time_matrix')
+def city_travel_time_matrix(railways, stations_by_city, timetable=None, all_pairs=None):
+    """ This function computes the shortest travel time between every pair of cities, and the distance between the
+    two stations of the fastest connection.
+
+    Only one Dijkstra is run per source city, from all of its stations at once. When several connections are as
+    fast, the first destination station (in the order of stations_by_city) is kept. The distances of a source city
+    are computed in a single geodesic call.
+
+    With a timetable, the travel times are the durations of the fastest journeys of the day, changes included,
+    instead of the sums of the travel times of the railways edges.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param stations_by_city: A list of (stations, city name) tuples
+    :param timetable: The timetable of the trains (see timetable.build_timetable), None to use the graph
+    :param all_pairs: The all pairs travel time matrix of the railways (see all_pairs), to read the graph travel
+        times instead of computing them
+    :return: The travel times and distances matrices, as lists of lists
+    """
+    if timetable is not None:
+        journeys = timetable_travel_times(timetable, [station for data in stations_by_city for station in data[0]])
+
+    travel_times = []
+    distances = []
+    for data_source in stations_by_city:
+        if timetable is None:
+            reach = multi_source_travel_times(railways, data_source[0], all_pairs)
+        else:
+            def reach(station, sources=data_source[0]):
+                return journeys(sources, station)
+
+        travel_times_from_city = []
+        best_pairs = []
+        for data_destination in stations_by_city:
+            best_travel_time = None
+            best_stations = None
+            for station_destination in data_destination[0]:
+                travel_time, station_source = reach(station_destination)
+                if travel_time is not None and (best_travel_time is None or travel_time < best_travel_time):
+                    best_travel_time = travel_time
+                    best_stations = (station_source, station_destination)
+
+            if best_travel_time is None:
+                raise nx.NetworkXNoPath(f"No path between {data_source[1]} and {data_destination[1]}.")
+
+            travel_times_from_city.append(best_travel_time)
+            best_pairs.append(best_stations)
+
+        travel_times.append(travel_times_from_city)
+        distances.append(station_distances(railways, *zip(*best_pairs)).tolist())
+
+    return travel_times, distances
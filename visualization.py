@@ -1,76 +1,150 @@
 from mpl_toolkits.basemap import Basemap
+from matplotlib.collections import LineCollection
 import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
+
+from instrumentation import stage
+
+FRANCE = (-5.0, 41.0, 10.0, 52.0)  # Bounds of the maps: west longitude, south latitude, east, north
+NORTH_EAST = (0.0, 47.0, 8.5, 52.0)
 
-
-def draw_network(network: nx.Graph):
-
-    to_draw = network.copy()
-
-    m = Basemap(llcrnrlon=-5.0, llcrnrlat=41.0, urcrnrlon=10.0, urcrnrlat=52.0,
-                resolution='i', projection='merc', lat_0=48., lon_0=-3.5)
-
-    m.drawcoastlines(linewidth=0.5)
-    m.drawcountries(linewidth=0.5)
-
-    pos = {}
-    node_sizes = []
-    for node in network.nodes(data=True):
-        lat = node[1].get('lat')
-        long = node[1].get('long')
-        travelers = node[1].get('travelers_2021')
-        if lat is not None and long is not None:
-            mx, my = m(float(long), float(lat))
-            pos[node[0]] = (mx, my)
-        else:
-            to_draw.remove_node(node[0])
-
-        if travelers is not None:
-            node_sizes.append(int(travelers) * 0.000001)
-        else:
-            to_draw.remove_node(node[0])
-
-    nx.draw_networkx_edges(G=to_draw, pos=pos, edge_color='g', alpha=0.2, arrows=False, width=0.2)
-    plt.savefig('output/map_routes_french_railway_network.svg', format="svg", bbox_inches="tight", pad_inches=0.3)
-    plt.clf()
-
-    m = Basemap(llcrnrlon=-5.0, llcrnrlat=41.0, urcrnrlon=10.0, urcrnrlat=52.0,
-                resolution='i', projection='merc', lat_0=48., lon_0=-3.5)
-
-    m.drawcoastlines(linewidth=0.5)
-    m.drawcountries(linewidth=0.5)
-
-    nx.draw_networkx_nodes(G=to_draw, pos=pos, node_color='r', alpha=0.8, node_size=node_sizes)
-    plt.savefig('output/map_stations_french_railway_network.svg', format="svg", bbox_inches="tight", pad_inches=0.3)
-    plt.clf()
-
-
-def draw_network_core(network: nx.Graph):
-
-    to_draw = network.copy()
-
-    m = Basemap(llcrnrlon=0.0, llcrnrlat=47.0, urcrnrlon=8.5, urcrnrlat=52.0,
-                resolution='i', projection='merc', lat_0=48., lon_0=-3.5)
-
-    m.drawcoastlines(linewidth=0.5)
-    m.drawcountries(linewidth=0.5)
-
-    pos = {}
-    for node in network.nodes(data=True):
-        lat = node[1].get('lat')
-        long = node[1].get('long')
-        if lat is not None and long is not None:
-            mx, my = m(float(long), float(lat))
-            pos[node[0]] = (mx, my)
-        else:
-            to_draw.remove_node(node[0])
-
-    labels = {}
-    for node in to_draw.nodes():
-        # set the node name as the key and the label as its value
-        labels[node] = to_draw.nodes[node]['stop_name']
-
-    nx.draw_networkx_edges(G=to_draw, pos=pos, edge_color='g', alpha=0.3, arrows=False, width=0.4)
-    nx.draw_networkx_nodes(G=labels, pos=pos, node_color='r', alpha=0.8, node_size=50)
-    nx.draw_networkx_labels(to_draw, pos, labels, font_size=6, font_color='k')
-    plt.savefig('output/k-core_french_railway_network.svg', format="svg", bbox_inches="tight", pad_inches=0.3)
+# Projection and coastlines of each map bounds, built once per process
+_basemaps = {}
+
+
+def basemap(bounds=FRANCE, resolution='i'):
+    """ This function gives the Mercator projection of a map, with its coastlines and borders already loaded.
+
+    Building a Basemap reads the coastline database, which takes seconds: it is done once per bounds and resolution.
+
+    :param bounds: The (west longitude, south latitude, east longitude, north latitude) of the map
+    :param resolution: The resolution of the coastlines: 'c', 'l', 'i', 'h' or 'f'
+    :return: The Basemap
+    """
+    key = (tuple(bounds), resolution)
+    if key not in _basemaps:
+        _basemaps[key] = Basemap(llcrnrlon=bounds[0], llcrnrlat=bounds[1], urcrnrlon=bounds[2], urcrnrlat=bounds[3],
+                                 resolution=resolution, projection='merc', lat_0=48., lon_0=-3.5)
+    return _basemaps[key]
+
+
+def project(m: Basemap, network: nx.Graph):
+    """ This function projects the stations with coordinates in a single vectorized call.
+
+    :param m: The Basemap
+    :param network: The railways graph
+    :return: The UIC codes of the located stations, and their x and y map coordinates
+    """
+    nodes = []
+    lat = []
+    long = []
+    for node, data in network.nodes(data=True):
+        if data.get('lat') is not None and data.get('long') is not None:
+            nodes.append(node)
+            lat.append(float(data['lat']))
+            long.append(float(data['long']))
+    x, y = m(np.array(long), np.array(lat))
+    return nodes, np.asarray(x), np.asarray(y)
+
+
+def edge_segments(network: nx.Graph, nodes, x, y):
+    """ This function gives the segments of the edges between located stations.
+
+    :param network: The railways graph
+    :param nodes: The UIC codes of the located stations
+    :param x: The x map coordinates of the stations
+    :param y: The y map coordinates of the stations
+    :return: The (edges, 2, 2) array of segment ends
+    """
+    index = {node: i for i, node in enumerate(nodes)}
+    ends = np.array([(index[u], index[v]) for u, v in network.edges() if u in index and v in index],
+                    dtype=np.int64).reshape(-1, 2)
+    return np.stack([np.stack([x[ends[:, 0]], y[ends[:, 0]]], axis=1),
+                     np.stack([x[ends[:, 1]], y[ends[:, 1]]], axis=1)], axis=1)
+
+
+def new_map(m: Basemap):
+    """ This function starts a figure with the coastlines and borders of a map.
+
+    :param m: The Basemap
+    :return: The figure and its axes
+    """
+    fig, ax = plt.subplots()
+    m.drawcoastlines(linewidth=0.5, ax=ax)
+    m.drawcountries(linewidth=0.5, ax=ax)
+    return fig, ax
+
+
+def draw_edges(ax, segments, color='g', alpha=0.2, width=0.2, rasterized=True):
+    """ This function draws the edges as a single collection.
+
+    :param ax: The axes
+    :param segments: The segments of the edges (see edge_segments)
+    :param color: The color of the edges
+    :param alpha: The transparency of the edges
+    :param width: The width of the edges
+    :param rasterized: Whether to draw the edges as an image inside vector outputs
+    """
+    lines = LineCollection(segments, colors=color, alpha=alpha, linewidths=width, rasterized=rasterized)
+    ax.add_collection(lines)
+
+
+@stage('save_map')
+def save_map(fig, path, fmt='svg', dpi=300):
+    """ This function writes a map and closes its figure.
+
+    :param fig: The figure
+    :param path: The file path, without extension
+    :param fmt: 'svg' (rasterized layers embedded as images) or 'png'
+    :param dpi: The resolution of the PNG output and of the rasterized layers
+    """
+    fig.savefig(f"{path}.{fmt}", format=fmt, dpi=dpi, bbox_inches="tight", pad_inches=0.3)
+    plt.close(fig)
+
+
+@stage('draw_network')
+def draw_network(network: nx.Graph, fmt='svg', rasterized=True, dpi=300):
+    """ This function draws the routes and the stations of the railways on maps of France.
+
+    The stations without coordinates or travellers are left out.
+
+    :param network: The railways graph
+    :param fmt: The output format, 'svg' or 'png'
+    :param rasterized: Whether to draw the edges and stations as images inside SVG outputs
+    :param dpi: The resolution of the PNG output and of the rasterized layers
+    """
+    m = basemap(FRANCE)
+    to_draw = network.subgraph([node for node, travelers in network.nodes(data='travelers_2021')
+                                if travelers is not None])
+    nodes, x, y = project(m, to_draw)
+
+    fig, ax = new_map(m)
+    draw_edges(ax, edge_segments(to_draw, nodes, x, y), rasterized=rasterized)
+    save_map(fig, 'output/map_routes_french_railway_network', fmt, dpi)
+
+    node_sizes = np.array([int(to_draw.nodes[node]['travelers_2021']) for node in nodes]) * 0.000001
+    fig, ax = new_map(m)
+    ax.scatter(x, y, s=node_sizes, c='r', alpha=0.8, linewidths=0, rasterized=rasterized)
+    save_map(fig, 'output/map_stations_french_railway_network', fmt, dpi)
+
+
+@stage('draw_network_core')
+def draw_network_core(network: nx.Graph, fmt='svg', rasterized=True, dpi=300):
+    """ This function draws a small network, like the k-core of the railways, with the names of its stations.
+
+    :param network: The railways graph
+    :param fmt: The output format, 'svg' or 'png'
+    :param rasterized: Whether to draw the edges as an image inside SVG outputs
+    :param dpi: The resolution of the PNG output and of the rasterized layers
+    """
+    m = basemap(NORTH_EAST)
+    nodes, x, y = project(m, network)
+
+    fig, ax = new_map(m)
+    draw_edges(ax, edge_segments(network, nodes, x, y), alpha=0.3, width=0.4, rasterized=rasterized)
+    ax.scatter(x, y, s=50, c='r', alpha=0.8, linewidths=0)
+    for node, node_x, node_y in zip(nodes, x.tolist(), y.tolist()):
+        ax.text(node_x, node_y, network.nodes[node].get('stop_name', node), fontsize=6, color='k',
+                ha='center', va='center')
+    save_map(fig, 'output/k-core_french_railway_network', fmt, dpi)
@@ -0,0 +1,162 @@
+import itertools
+
+import networkx as nx
+import numpy as np
+
+from compact_graph import CompactGraph, travel_times_from
+from geo import distance_between
+from instrumentation import count
+from spatial import SpatialIndex
+
+AVERAGE_SPEED = 250  # The minimum speed in km/h for a high speed rail of category I.
+COST_PER_KM = 25  # M€
+LINE_DISTANCE_BAND = (100, 1000)  # Plausible lengths of a new high speed line, in km
+
+
+def new_line_parameters(railways, station_a, station_b):
+    """ This function gives the length, cost and travel time of a new high speed line between two stations.
+
+    :param railways: A network, as a NetworkX or compact graph
+    :param station_a: A source station
+    :param station_b: A destination station
+    :return: The distance in km, the cost in M€ and the travel time in minutes
+    """
+    dist = distance_between(railways, station_a, station_b)
+    return dist, dist * COST_PER_KM, dist / AVERAGE_SPEED * 60
+
+
+class WhatIfEngine:
+    """ Evaluates city travel time matrices after adding new lines, without copying the graph.
+
+    The shortest travel times between all the stations of the cities are computed once. Adding an edge (a, b, w)
+    between two of these stations can only shorten a path u-v to min(d(u, v), d(u, a) + w + d(b, v),
+    d(u, b) + w + d(a, v)), so a single line is scored in O(cities²) and a plan of k lines in O(k stations²). The
+    station travel times are read from the all pairs travel time matrix when one is given (see all_pairs).
+    """
+
+    def __init__(self, railways, stations_by_city, all_pairs=None):
+        self.railways = railways
+        self.stations_by_city = stations_by_city
+        self.stations = list(dict.fromkeys(station for data in stations_by_city for station in data[0]))
+        self.index = {station: i for i, station in enumerate(self.stations)}
+        self.cities = [np.array([self.index[station] for station in data[0]]) for data in stations_by_city]
+
+        if all_pairs is not None:
+            ids = [all_pairs.index[station] for station in self.stations]
+            self.distances = np.asarray(all_pairs.matrix[ids][:, ids], dtype=np.float64)
+        elif isinstance(railways, CompactGraph):
+            ids = [railways.index[station] for station in self.stations]
+            self.distances = travel_times_from(railways, ids)[:, ids]
+        else:
+            self.distances = np.full((len(self.stations), len(self.stations)), np.inf)
+            for i, station in enumerate(self.stations):
+                count('dijkstra_calls')
+                lengths = nx.single_source_dijkstra_path_length(railways, station, weight='travel_time')
+                for j, other in enumerate(self.stations):
+                    self.distances[i, j] = lengths.get(other, np.inf)
+
+        # Shortest travel time from each city (its closest station) to each station
+        self.city_to_station = np.array([self.distances[city].min(axis=0) for city in self.cities])
+        self.baseline = self.city_matrix()
+        self.spatial = None
+
+    def city_matrix(self, distances=None):
+        """ This function reduces a station travel time matrix to the city travel time matrix.
+
+        :param distances: The station travel times, the baseline ones by default
+        :return: The city travel time matrix
+        """
+        distances = self.distances if distances is None else distances
+        from_cities = np.array([distances[city].min(axis=0) for city in self.cities])
+        return np.array([from_cities[:, city].min(axis=1) for city in self.cities]).T
+
+    def with_line(self, station_a, station_b, travel_time):
+        """ This function gives the city travel time matrix after adding a single line, in O(cities²).
+
+        :param station_a: A station of one of the cities
+        :param station_b: A station of one of the cities
+        :param travel_time: The travel time of the line, in minutes
+        :return: The city travel time matrix
+        """
+        to_a = self.city_to_station[:, self.index[station_a]]
+        to_b = self.city_to_station[:, self.index[station_b]]
+        through_line = np.minimum(to_a[:, None] + travel_time + to_b[None, :],
+                                  to_b[:, None] + travel_time + to_a[None, :])
+        return np.minimum(self.baseline, through_line)
+
+    def with_lines(self, lines):
+        """ This function gives the city travel time matrix after adding several lines together.
+
+        Lines are added one after the other to the station travel times, so paths using several new lines are found.
+
+        :param lines: A list of (station_a, station_b, travel_time) tuples
+        :return: The city travel time matrix
+        """
+        distances = self.distances
+        for station_a, station_b, travel_time in lines:
+            a = distances[:, self.index[station_a]]
+            b = distances[:, self.index[station_b]]
+            distances = np.minimum(distances, np.minimum(a[:, None] + travel_time + b[None, :],
+                                                         b[:, None] + travel_time + a[None, :]))
+        return self.city_matrix(distances)
+
+    def candidate_lines(self, from_cities=None, min_distance=0, max_distance=np.inf):
+        """ This function lists the lines between the stations of two different cities.
+
+        With a distance band, the lines of each source city are found with one spatial index query (see spatial)
+        instead of enumerating every pair of stations.
+
+        :param from_cities: The names of the cities a line must start from, all of them by default
+        :param min_distance: The minimum length of a line in km
+        :param max_distance: The maximum length of a line in km
+        :return: A list of (source city, destination city, station_a, station_b) tuples
+        """
+        banded = min_distance > 0 or np.isfinite(max_distance)
+        if banded and self.spatial is None:
+            self.spatial = SpatialIndex(self.railways)
+        city_of = {station: k for k, data in enumerate(self.stations_by_city) for station in data[0]}
+
+        candidates = []
+        for k, data_source in enumerate(self.stations_by_city):
+            if from_cities is not None and data_source[1] not in from_cities:
+                continue
+            if banded:
+                others = [station for station in self.stations if city_of[station] != k]
+                lines = self.spatial.pairs_in_band(data_source[0], others, min_distance, max_distance)
+                # Same order as without band: by destination city, then by station
+                lines.sort(key=lambda line: (city_of[line[1]], data_source[0].index(line[0]),
+                                             self.stations_by_city[city_of[line[1]]][0].index(line[1])))
+                candidates += [(data_source[1], self.stations_by_city[city_of[b]][1], a, b) for a, b, _ in lines]
+                continue
+            for data_destination in self.stations_by_city:
+                if data_source[1] == data_destination[1]:
+                    continue
+                for station_source in data_source[0]:
+                    for station_destination in data_destination[0]:
+                        candidates.append((data_source[1], data_destination[1], station_source, station_destination))
+        return candidates
+
+    def rank_plans(self, candidates, weights, k=2, top=10):
+        """ This function ranks plans of k lines built together by the gain in weighted travel time per M€.
+
+        :param candidates: A list of (station_a, station_b) lines
+        :param weights: The weight of each city, e.g. its number of travellers
+        :param k: The number of lines of a plan
+        :param top: The number of plans to return
+        :return: A list of (cost per minute saved, cost, minutes saved, plan) tuples, the best first
+        """
+        lines = {}
+        for station_a, station_b in candidates:
+            dist, cost, travel_time = new_line_parameters(self.railways, station_a, station_b)
+            lines[(station_a, station_b)] = (cost, travel_time)
+
+        baseline = np.average(self.baseline, axis=1, weights=weights).mean()
+        plans = []
+        for plan in itertools.combinations(candidates, k):
+            matrix = self.with_lines([(a, b, lines[(a, b)][1]) for a, b in plan])
+            delta = baseline - np.average(matrix, axis=1, weights=weights).mean()
+            cost = sum(lines[line][0] for line in plan)
+            if delta > 0:
+                plans.append((cost / delta, cost, delta, plan))
+
+        return sorted(plans)[:top]